@@ -0,0 +1,33 @@
+"""Add sync watermarks
+
+Revision ID: 3f1c9a7d2b64
+Revises: e2abdd237415
+Create Date: 2026-10-17 23:05:12.418330
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b64'
+down_revision: Union[str, None] = 'e2abdd237415'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'sync_watermarks',
+        sa.Column('peer', sa.String(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('peer'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('sync_watermarks')
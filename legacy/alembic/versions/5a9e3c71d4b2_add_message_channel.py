@@ -0,0 +1,33 @@
+"""Add message channel
+
+Revision ID: 5a9e3c71d4b2
+Revises: d81f3b6a2e95
+Create Date: 2026-10-18 21:37:52.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a9e3c71d4b2'
+down_revision: Union[str, None] = 'd81f3b6a2e95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A constant default does not rewrite the table: existing messages are in
+    # the default channel, which is the one every node gossiped on before
+    op.add_column('messages', sa.Column('channel', sa.String(length=64), server_default='global',
+                                        nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_channel_id', 'messages', ['channel', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_channel_id', table_name='messages')
+    op.drop_column('messages', 'channel')
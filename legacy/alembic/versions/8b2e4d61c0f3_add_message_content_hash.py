@@ -0,0 +1,66 @@
+"""Add message content hash
+
+Revision ID: 8b2e4d61c0f3
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-17 23:41:37.102845
+
+"""
+import hashlib
+from datetime import timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d61c0f3'
+down_revision: Union[str, None] = '3f1c9a7d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def compute_message_hash(content, user_id, timestamp):
+    # Frozen copy of database.compute_message_hash as of this revision, so the
+    # backfill does not change with the app
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    timestamp = timestamp.astimezone(timezone.utc).isoformat(timespec="microseconds")
+    return hashlib.sha256(f"{content}\x00{user_id}\x00{timestamp}".encode()).hexdigest()
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    messages = sa.table('messages',
+                        sa.column('id', sa.Integer), sa.column('content', sa.String),
+                        sa.column('user_id', sa.Integer), sa.column('timestamp', sa.DateTime(timezone=True)),
+                        sa.column('content_hash', sa.String))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(messages.c.id, messages.c.content, messages.c.user_id, messages.c.timestamp)
+            .where(messages.c.id > last_id).order_by(messages.c.id).limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            messages.update().where(messages.c.id == sa.bindparam('message_id'))
+            .values(content_hash=sa.bindparam('hash')),
+            [{'message_id': row.id, 'hash': compute_message_hash(row.content, row.user_id, row.timestamp)}
+             for row in rows]
+        )
+        last_id = rows[-1].id
+
+    # Rows with the same content, user and timestamp are the same message stored twice
+    op.execute("DELETE FROM messages a USING messages b "
+               "WHERE a.content_hash = b.content_hash AND a.id > b.id")
+    op.create_unique_constraint('messages_content_hash_key', 'messages', ['content_hash'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('messages_content_hash_key', 'messages', type_='unique')
+    op.drop_column('messages', 'content_hash')
@@ -0,0 +1,31 @@
+"""Add message pagination indexes
+
+Revision ID: c47d0e9a5f18
+Revises: 8b2e4d61c0f3
+Create Date: 2026-10-18 10:42:37.215904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47d0e9a5f18'
+down_revision: Union[str, None] = '8b2e4d61c0f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the messages table writable while the indexes build
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_timestamp_id', 'messages', ['timestamp', 'id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_messages_user_id_timestamp', 'messages', ['user_id', 'timestamp'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_user_id_timestamp', table_name='messages')
+    op.drop_index('ix_messages_timestamp_id', table_name='messages')
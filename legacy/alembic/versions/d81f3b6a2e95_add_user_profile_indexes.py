@@ -0,0 +1,51 @@
+"""Add users.updated_at and profile indexes
+
+Revision ID: d81f3b6a2e95
+Revises: c47d0e9a5f18
+Create Date: 2026-10-18 14:21:05.730194
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81f3b6a2e95'
+down_revision: Union[str, None] = 'c47d0e9a5f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(timezone=True),
+                                     server_default=sa.func.now(), nullable=False))
+    # Keeps updated_at right for writes that bypass the ORM, since the
+    # recommendation builder catches up on it
+    op.execute("""
+        CREATE FUNCTION set_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = now();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER users_set_updated_at BEFORE UPDATE ON users
+        FOR EACH ROW EXECUTE FUNCTION set_updated_at()
+    """)
+    with op.get_context().autocommit_block():
+        # jsonb_path_ops serves the @> containment search_users_by_profile runs
+        op.create_index('ix_users_profile', 'users', ['profile'], postgresql_using='gin',
+                        postgresql_ops={'profile': 'jsonb_path_ops'}, postgresql_concurrently=True)
+        op.create_index('ix_users_updated_at_id', 'users', ['updated_at', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_updated_at_id', table_name='users')
+    op.drop_index('ix_users_profile', table_name='users')
+    op.execute("DROP TRIGGER users_set_updated_at ON users")
+    op.execute("DROP FUNCTION set_updated_at()")
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,94 @@
+"""Recall@k and query latency of ANN recommendation indexes against exact search.
+
+Users are synthetic: each draws interest terms from a couple of topics, so
+neighbourhoods are meaningful the way real profile text is (see make_users).
+
+Run from legacy/:  python -m benchmarks.bench_ann [--users N] [--queries N] [-k K]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from src.core.ann import IVFIndex, LSHIndex
+from src.core.ml import RecommendationSystem
+
+CONFIGS = [
+    (LSHIndex, {"n_tables": 8, "n_bits": 14, "probes": 2}),
+    (LSHIndex, {"n_tables": 24, "n_bits": 6, "probes": 2}),
+    (IVFIndex, {"n_lists": 256, "n_probe": 4}),
+    (IVFIndex, {"n_lists": 256, "n_probe": 8}),
+    (IVFIndex, {"n_lists": 256, "n_probe": 16}),
+]
+
+
+def make_users(count, topics=200, words_per_topic=50, terms=15, seed=0):
+    # Topic popularity and word use within a topic are Zipfian, as in real text;
+    # each user mostly writes about one topic and sometimes about a second.
+    rng = random.Random(seed)
+    topic_weights = [1 / (rank + 1) for rank in range(topics)]
+    word_weights = [1 / (rank + 1) for rank in range(words_per_topic)]
+    vocabulary = [[f"t{topic}w{word}" for word in range(words_per_topic)] for topic in range(topics)]
+    users = {}
+    for user_id in range(count):
+        primary, secondary = rng.choices(range(topics), topic_weights, k=2)
+        words = [rng.choices(vocabulary[primary if rng.random() < 0.7 else secondary], word_weights)[0]
+                 for _ in range(terms)]
+        users[user_id] = " ".join(words)
+    return users
+
+
+def measure(rec_system, queries, k, exact):
+    latencies = []
+    results = {}
+    for user_id in queries:
+        started = time.perf_counter()
+        results[user_id] = rec_system.get_recommendations(user_id, top_n=k, exact=exact)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return results, {
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def recall(approximate, exact):
+    hits = sum(len(set(approximate[user_id]) & set(exact[user_id])) for user_id in exact)
+    return hits / max(1, sum(len(found) for found in exact.values()))
+
+
+def run(users=100000, queries=500, k=10, configs=CONFIGS):
+    profiles = make_users(users)
+    query_ids = random.Random(1).sample(range(users), queries)
+    results = []
+    exact = None
+    for index_class, config in configs:
+        rec_system = RecommendationSystem(index=index_class(**config))
+        started = time.perf_counter()
+        rec_system.add_users_bulk(profiles)
+        build_time = time.perf_counter() - started
+        if exact is None:
+            exact, exact_latency = measure(rec_system, query_ids, k, exact=True)
+            results.append({"index": "exact", "recall": 1.0, "build_s": 0.0, **exact_latency})
+        approximate, latency = measure(rec_system, query_ids, k, exact=False)
+        name = index_class.__name__ + " " + " ".join(f"{key}={value}" for key, value in config.items())
+        results.append({"index": name, "recall": recall(approximate, exact), "build_s": build_time, **latency})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'index':<40} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8}")
+    for result in run(args.users, args.queries, args.k):
+        print(f"{result['index']:<40} {result['recall']:>9.3f} {result['p50_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['build_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Event loop lag under concurrent publish and sync load, blocking vs async storage.
+
+Needs the database configured through the usual DB_* environment variables; the
+benchmark writes messages for a throwaway user and deletes them afterwards.
+
+Run from legacy/:  python -m benchmarks.bench_event_loop [--publishes N] [--sync-batches N]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from src.core import async_database, database
+from src.core.channels import DEFAULT_CHANNEL
+from src.core.database import Message
+from src.core.p2p import P2PNode
+
+
+class BlockingStore:
+    # How P2PNode talked to the database before async_database: synchronous
+    # calls made straight from coroutines
+    async def add_message(self, content, user_id, timestamp=None, channel=DEFAULT_CHANNEL):
+        return database.add_message(content, user_id, timestamp=timestamp, channel=channel)
+
+    async def add_messages_bulk(self, messages, chunk_size=500):
+        return database.add_messages_bulk(messages, chunk_size)
+
+    async def get_existing_hashes(self, hashes):
+        return database.get_existing_hashes(hashes)
+
+
+class NullPubsub:
+    async def publish(self, topic, data):
+        pass
+
+
+async def sample_lag(samples, interval, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+def make_batch(user_id, batch, size):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(days=batch)
+    return [Message(content=f"synced {batch}-{i}", user_id=user_id, timestamp=start + timedelta(seconds=i))
+            for i in range(size)]
+
+
+async def run_load(store, user_id, publishes, sync_batches, batch_size, concurrency):
+    node = P2PNode(store=store)
+    node.pubsub = NullPubsub()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def publish(i):
+        async with semaphore:
+            await node.publish_message(f"published {i}", user_id)
+
+    async def sync(batch):
+        async with semaphore:
+            await node._store_new_messages(make_batch(user_id, batch, batch_size))
+
+    samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_lag(samples, 0.001, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[publish(i) for i in range(publishes)],
+                         *[sync(batch) for batch in range(sync_batches)])
+    duration = time.perf_counter() - started
+    stop.set()
+    await sampler
+    return samples, duration
+
+
+def cleanup(user_id):
+    with database.Session() as session:
+        session.query(Message).filter(Message.user_id == user_id).delete()
+        session.query(database.User).filter(database.User.id == user_id).delete()
+        session.commit()
+
+
+async def run(publishes=500, sync_batches=20, batch_size=200, concurrency=16):
+    results = []
+    for name, store in [("blocking", BlockingStore()), ("async", async_database)]:
+        user_id = database.add_user(f"bench-{uuid.uuid4().hex[:12]}", f"{uuid.uuid4().hex[:12]}@bench.invalid")
+        try:
+            samples, duration = await run_load(store, user_id, publishes, sync_batches, batch_size, concurrency)
+        finally:
+            cleanup(user_id)
+        samples.sort()
+        results.append({
+            "store": name,
+            "duration": duration,
+            "lag_p50_ms": statistics.median(samples) * 1000,
+            "lag_p99_ms": samples[int(len(samples) * 0.99)] * 1000,
+            "lag_max_ms": samples[-1] * 1000,
+        })
+    await async_database.dispose_engine()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--publishes", type=int, default=500)
+    parser.add_argument("--sync-batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.publishes, args.sync_batches, args.batch_size, args.concurrency))
+    print(f"{'store':<9} {'duration s':>10} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for result in results:
+        print(f"{result['store']:<9} {result['duration']:>10.2f} {result['lag_p50_ms']:>11.2f} "
+              f"{result['lag_p99_ms']:>11.2f} {result['lag_max_ms']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
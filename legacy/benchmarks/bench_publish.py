@@ -0,0 +1,182 @@
+"""Requests/sec and latency of POST /messages: Flask dev server vs the ASGI app.
+
+"flask" is the old path: a threaded WSGI server whose handler runs a fresh
+event loop per request around publish_message. "asgi" is src/api/asgi.py under
+uvicorn, where the handler enqueues onto the node's outbox and returns.
+
+Neither server needs libp2p: the node's pubsub is a no-op. With --store memory
+(the default) every write sleeps --latency ms instead of hitting a database;
+--store postgres uses async_database and the DB_* environment variables.
+
+Run from legacy/:  python -m benchmarks.bench_publish [--requests N] [--concurrency N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import socket
+import time
+
+from src.core.channels import DEFAULT_CHANNEL
+from src.core.p2p import P2PNode
+
+HOST = "127.0.0.1"
+
+
+class LatencyStore:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def add_message(self, content, user_id, timestamp=None, channel=DEFAULT_CHANNEL):
+        await asyncio.sleep(self.latency)
+
+    async def insert_messages(self, messages, chunk_size=500):
+        await asyncio.sleep(self.latency)
+        return [(i, message.content_hash) for i, message in enumerate(messages)]
+
+    async def get_existing_user_ids(self, user_ids):
+        # Every author exists; publish requests check theirs before writing
+        return set(user_ids)
+
+
+class NullPubsub:
+    async def publish(self, topic, data):
+        pass
+
+
+class BenchNode(P2PNode):
+    # The outbox without a libp2p host
+    async def start(self):
+        self.pubsub = NullPubsub()
+        self.outbox.start()
+
+
+def make_store(kind, latency):
+    if kind == "postgres":
+        from src.core import async_database
+        return async_database
+    return LatencyStore(latency)
+
+
+def serve(server, port, store_kind, latency):
+    logging.disable(logging.INFO)
+    store = make_store(store_kind, latency)
+    if server == "flask":
+        from werkzeug.serving import make_server
+        from src.api import endpoints
+        endpoints.p2p_node.store = store
+        endpoints.p2p_node.pubsub = NullPubsub()
+        make_server(HOST, port, endpoints.app, threaded=True).serve_forever()
+    else:
+        import uvicorn
+        from src.api.asgi import create_app
+        uvicorn.run(create_app(BenchNode(store=store), sync_interval=None), host=HOST, port=port,
+                    log_level="warning")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+class Connection:
+    # Minimal HTTP/1.1 client: the load generator shares the CPU with the
+    # server, so it has to be much cheaper per request than the server is
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def post(self, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(HOST, self.port)
+        self.writer.write(f"POST {path} HTTP/1.1\r\nHost: {HOST}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        status_line, *header_lines = (await self.reader.readuntil(b"\r\n\r\n")).decode().split("\r\n")
+        headers = dict(line.lower().split(": ", 1) for line in header_lines if line)
+        await self.reader.readexactly(int(headers.get("content-length", 0)))
+        # The Flask dev server answers HTTP/1.0 and closes the connection
+        if status_line.startswith("HTTP/1.0") or headers.get("connection") == "close":
+            self.close()
+        return int(status_line.split()[1])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def load(port, requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        connection = Connection(port)
+        try:
+            for i in remaining:
+                body = json.dumps({"content": f"bench message {i}", "user_id": 1}).encode()
+                started = time.perf_counter()
+                status = await connection.post("/messages", body)
+                latencies.append(time.perf_counter() - started)
+                if status >= 300:
+                    errors += 1
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "errors": errors,
+    }
+
+
+def run(server, requests=2000, concurrency=32, store_kind="memory", latency=0.002, warmup=100):
+    port = free_port()
+    process = multiprocessing.Process(target=serve, args=(server, port, store_kind, latency), daemon=True)
+    process.start()
+    try:
+        wait_for_port(port)
+        asyncio.run(load(port, warmup, concurrency))
+        return asyncio.run(load(port, requests, concurrency))
+    finally:
+        process.terminate()
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--store", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--latency", type=float, default=2, help="ms per simulated write")
+    args = parser.parse_args()
+
+    print(f"{'server':<8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for server in ("flask", "asgi"):
+        result = run(server, args.requests, args.concurrency, args.store, args.latency / 1000)
+        print(f"{server:<8} {result['rps']:>9.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare pubsub payload encodings: throughput and bytes on the wire.
+
+Run from legacy/:  python -m benchmarks.bench_wire [--messages N] [--content-size BYTES]
+"""
+import argparse
+import random
+import string
+import time
+from datetime import datetime, timedelta, timezone
+
+from src.core.database import compute_message_hash
+from src.core.wire import Envelope, decode_payload, encode_batches, encode_envelope
+
+
+def make_envelopes(count, content_size, seed=0):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(500)]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    envelopes = []
+    for i in range(count):
+        content = ""
+        while len(content) < content_size:
+            content += rng.choice(words) + " "
+        content = content[:content_size]
+        user_id = rng.randint(1, 10000)
+        timestamp = start + timedelta(microseconds=rng.randint(0, 10 ** 12))
+        envelopes.append(Envelope(compute_message_hash(content, user_id, timestamp), content, user_id,
+                                  timestamp, 0))
+    return envelopes
+
+
+def measure(name, envelopes, encode, decode):
+    started = time.perf_counter()
+    frames = encode(envelopes)
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    decoded = 0
+    for frame in frames:
+        decoded += decode(frame)
+    decode_time = time.perf_counter() - started
+    assert decoded == len(envelopes)
+
+    total_bytes = sum(len(frame) for frame in frames)
+    return {
+        "encoding": name,
+        "frames": len(frames),
+        "bytes_per_message": total_bytes / len(envelopes),
+        "encode_msgs_per_s": len(envelopes) / encode_time,
+        "decode_msgs_per_s": len(envelopes) / decode_time,
+    }
+
+
+def run(messages=20000, content_size=200):
+    envelopes = make_envelopes(messages, content_size)
+    return [
+        # What publish_message sent before envelopes: the content only
+        measure("plain-text", envelopes,
+                lambda es: [e.content.encode() for e in es],
+                lambda frame: len([frame.decode()])),
+        measure("envelope", envelopes,
+                lambda es: [encode_envelope(e, compress=False) for e in es],
+                lambda frame: len(decode_payload(frame))),
+        measure("envelope+zstd", envelopes,
+                lambda es: [encode_envelope(e) for e in es],
+                lambda frame: len(decode_payload(frame))),
+        measure("batch", envelopes,
+                lambda es: list(encode_batches(es, compress=False)),
+                lambda frame: len(decode_payload(frame))),
+        measure("batch+zstd", envelopes,
+                lambda es: list(encode_batches(es)),
+                lambda frame: len(decode_payload(frame))),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--content-size", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'encoding':<14} {'frames':>7} {'bytes/msg':>10} {'encode msg/s':>13} {'decode msg/s':>13}")
+    for result in run(args.messages, args.content_size):
+        print(f"{result['encoding']:<14} {result['frames']:>7} {result['bytes_per_message']:>10.1f} "
+              f"{result['encode_msgs_per_s']:>13,.0f} {result['decode_msgs_per_s']:>13,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Micro-benchmark suite for sync, storage, wire encoding and recommendations.
+
+Runs offline: sync cases use P2PNode over a MemoryStore with fake peers in place
+of libp2p hosts, so they measure dedupe and merge, not the network. Storage
+cases need a local Postgres (the schema uses JSONB and ON CONFLICT, so SQLite
+cannot stand in) configured through the DB_* environment variables, and only
+run with --postgres; they write messages for a throwaway user and delete them.
+
+Inputs are seeded, so runs on the same machine are comparable. Each case is
+timed --repeat times, setup excluded, and the fastest run is what gets compared.
+
+Run from legacy/:
+  python -m benchmarks.suite run [--size small|medium|large] [--only PATTERN] [--out results.json]
+  python -m benchmarks.suite run --baseline baseline.json [--threshold 0.2]
+  python -m benchmarks.suite compare baseline.json results.json [--threshold 0.2]
+
+compare, and run with --baseline, exit with status 1 when any case is slower
+than its baseline by more than the threshold (a fraction, default 0.2).
+"""
+import argparse
+import asyncio
+import fnmatch
+import functools
+import gc
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.bench_ann import make_users
+from benchmarks.bench_wire import make_envelopes
+
+# Problem sizes per case: messages, users or envelopes
+SIZES = {
+    "small": {"sync": 10000, "store_single": 500, "store_bulk": 5000, "wire": 10000, "users": 1000},
+    "medium": {"sync": 100000, "store_single": 2000, "store_bulk": 50000, "wire": 100000, "users": 100000},
+    "large": {"sync": 1000000, "store_single": 5000, "store_bulk": 500000, "wire": 1000000, "users": 1000000},
+}
+SYNC_PEERS = 4  # every message is held by two of them
+SYNC_ALREADY_STORED = 0.1  # fraction of the messages the syncing node already holds
+RECOMMENDATION_QUERIES = 100
+TOP_N = 10
+
+CASES = {}
+
+
+def case(name, size_key, postgres=False):
+    # Registers a context manager that sets up and yields (run, ops): run() is
+    # timed, a function or coroutine function; ops is the amount of work it does
+    def register(factory):
+        CASES[name] = (factory, size_key, postgres)
+        return factory
+    return register
+
+
+@functools.lru_cache(maxsize=1)
+def make_messages(count, seed=0):
+    from src.core.database import compute_message_hash
+    from src.core.memory_store import StoredMessage
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i in range(count):
+        timestamp = start + timedelta(milliseconds=i)
+        content = f"message {i} " + "x" * rng.randint(20, 200)
+        user_id = rng.randint(1, 1000)
+        messages.append(StoredMessage(i + 1, content, user_id, timestamp,
+                                      compute_message_hash(content, user_id, timestamp)))
+    return messages
+
+
+class NullPubsub:
+    async def publish(self, topic, data):
+        pass
+
+
+@case("sync_dedupe", "sync")
+@contextmanager
+def sync_dedupe(count):
+    # A sync round over SYNC_PEERS peers with overlapping stores: every message
+    # arrives twice and a fraction is already stored locally
+    from src.core.memory_store import MemoryStore
+    from src.core.p2p import P2PNode
+    messages = make_messages(count)
+    peers = [f"/ip4/10.0.0.{i}/tcp/4001/p2p/peer{i}" for i in range(SYNC_PEERS)]
+    held = {peer: [] for peer in peers}
+    for i, message in enumerate(messages):
+        for peer in (peers[i % SYNC_PEERS], peers[(i + 1) % SYNC_PEERS]):
+            held[peer].append(message._replace(id=len(held[peer]) + 1))
+
+    store = MemoryStore()
+    asyncio.run(store.add_messages_bulk(messages[:int(count * SYNC_ALREADY_STORED)]))
+    node = P2PNode(store=store, sync_deadline=3600, peer_timeout=3600)
+    node.pubsub = NullPubsub()
+    node.get_connected_peers = lambda: list(peers)
+
+    async def fetch_messages_from_peer(peer, limit):
+        return held[peer]
+
+    node.fetch_messages_from_peer = fetch_messages_from_peer
+    yield node.sync_messages, 2 * count
+    assert len(store) == count, f"sync stored {len(store)} of {count} messages"
+
+
+@contextmanager
+def throwaway_user():
+    from src.core import database
+    from src.core.database import Message
+    user_id = database.add_user(f"bench-{uuid.uuid4().hex[:12]}", f"{uuid.uuid4().hex[:12]}@bench.invalid")
+    try:
+        yield user_id
+    finally:
+        with database.Session() as session:
+            session.query(Message).filter(Message.user_id == user_id).delete()
+            session.query(database.User).filter(database.User.id == user_id).delete()
+            session.commit()
+
+
+@case("store_single", "store_single", postgres=True)
+@contextmanager
+def store_single(count):
+    # One transaction per message, as publish_message did before the outbox
+    from src.core import database
+    with throwaway_user() as user_id:
+        def run():
+            for i in range(count):
+                database.add_message(f"single {uuid.uuid4().hex} {i}", user_id)
+        yield run, count
+
+
+@case("store_bulk", "store_bulk", postgres=True)
+@contextmanager
+def store_bulk(count):
+    from src.core import database
+    with throwaway_user() as user_id:
+        prefix = uuid.uuid4().hex
+        rows = [{"content": f"bulk {prefix} {i}", "user_id": user_id} for i in range(count)]
+        yield lambda: database.add_messages_bulk(rows), count
+
+
+@case("wire_encode", "wire")
+@contextmanager
+def wire_encode(count):
+    from src.core.wire import encode_batches
+    envelopes = make_envelopes(count, 200)
+    yield lambda: list(encode_batches(envelopes)), count
+
+
+@case("wire_decode", "wire")
+@contextmanager
+def wire_decode(count):
+    from src.core.wire import decode_payload, encode_batches
+    frames = list(encode_batches(make_envelopes(count, 200)))
+
+    def run():
+        for frame in frames:
+            for _ in decode_payload(frame):
+                pass
+    yield run, count
+
+
+@case("recommend_build", "users")
+@contextmanager
+def recommend_build(count):
+    from src.core.ml import RecommendationSystem
+    profiles = make_users(count)
+    yield lambda: RecommendationSystem().add_users_bulk(profiles), count
+
+
+def recommendation_queries(count, index=None):
+    from src.core.ml import RecommendationSystem
+    rec_system = RecommendationSystem(index=index)
+    rec_system.add_users_bulk(make_users(count))
+    queries = random.Random(1).sample(range(count), min(count, RECOMMENDATION_QUERIES))
+
+    def run():
+        for user_id in queries:
+            rec_system.get_recommendations(user_id, top_n=TOP_N)
+    return run, len(queries)
+
+
+@case("recommend_query_exact", "users")
+@contextmanager
+def recommend_query_exact(count):
+    yield recommendation_queries(count)
+
+
+@case("recommend_query_ivf", "users")
+@contextmanager
+def recommend_query_ivf(count):
+    from src.core.ann import IVFIndex
+    yield recommendation_queries(count, IVFIndex(n_lists=max(1, min(256, count // 40)), n_probe=8))
+
+
+def time_once(run):
+    gc.collect()
+    started = time.perf_counter()
+    if asyncio.iscoroutinefunction(run):
+        asyncio.run(run())
+    else:
+        run()
+    return time.perf_counter() - started
+
+
+def run_case(name, count, repeat):
+    factory = CASES[name][0]
+    runs = []
+    ops = None
+    for _ in range(repeat):
+        with factory(count) as (run, ops):
+            runs.append(time_once(run))
+    seconds = min(runs)
+    return {"n": count, "ops": ops, "seconds": seconds, "ops_per_sec": ops / seconds if seconds else None,
+            "runs": runs}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(size="small", only=None, repeat=3, postgres=False, log=print):
+    results = {}
+    for name, (_, size_key, needs_postgres) in CASES.items():
+        if only and not any(fnmatch.fnmatch(name, pattern) for pattern in only):
+            continue
+        if needs_postgres and not postgres:
+            results[name] = {"skipped": "needs --postgres"}
+            continue
+        results[name] = run_case(name, SIZES[size][size_key], repeat)
+        log(format_result(name, results[name]))
+    return {
+        "size": size,
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git": git_revision(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def format_result(name, result):
+    if "skipped" in result:
+        return f"{name:<24} skipped: {result['skipped']}"
+    return f"{name:<24} n={result['n']:<9} {result['seconds'] * 1000:>10.1f} ms {result['ops_per_sec']:>12.0f} ops/s"
+
+
+def compare(baseline, current, threshold=0.2):
+    # Returns rows of (name, baseline seconds, current seconds, change, status);
+    # status is "regression", "improvement", "ok" or why the case was not compared
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if "skipped" in result:
+            rows.append((name, None, None, None, "skipped"))
+        elif base is None or "skipped" in base:
+            rows.append((name, None, result["seconds"], None, "no baseline"))
+        elif base["n"] != result["n"]:
+            rows.append((name, base["seconds"], result["seconds"], None, "size differs"))
+        else:
+            change = result["seconds"] / base["seconds"] - 1
+            status = "regression" if change > threshold else "improvement" if change < -threshold else "ok"
+            rows.append((name, base["seconds"], result["seconds"], change, status))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'case':<24} {'baseline ms':>12} {'current ms':>12} {'change':>8}  status")
+    for name, base, current, change, status in rows:
+        base = f"{base * 1000:.1f}" if base is not None else "-"
+        current = f"{current * 1000:.1f}" if current is not None else "-"
+        change = f"{change:+.1%}" if change is not None else "-"
+        print(f"{name:<24} {base:>12} {current:>12} {change:>8}  {status}")
+    return any(row[4] == "regression" for row in rows)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--size", choices=SIZES, default="small")
+    run_parser.add_argument("--only", action="append", help="case name or glob; repeatable")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--postgres", action="store_true", help="include cases that need the database")
+    run_parser.add_argument("--out", help="write results as JSON")
+    run_parser.add_argument("--baseline", help="compare against these results")
+    run_parser.add_argument("--threshold", type=float, default=0.2)
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.command == "compare":
+        sys.exit(1 if print_comparison(compare(load(args.baseline), load(args.current), args.threshold)) else 0)
+
+    results = run_suite(args.size, args.only, args.repeat, args.postgres)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        print()
+        sys.exit(1 if print_comparison(compare(load(args.baseline), results, args.threshold)) else 0)
+
+
+if __name__ == "__main__":
+    main()
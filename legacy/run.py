@@ -1,16 +1,16 @@
-import asyncio
-from src.api.endpoints import app, p2p_node, init_p2p_node
+import os
+import uvicorn
+from dotenv import load_dotenv
 import warnings
 
-warnings.filterwarnings("ignore", category=UserWarning, module="google.protobuf.runtime_version")
+# Before the app is imported: its modules read their settings from the environment.
+# The database schema is not created here: run `alembic upgrade head` first.
+load_dotenv()
+from src.api.asgi import app
 
-async def periodic_sync():
-    while True:
-        await p2p_node.sync_messages()
-        await asyncio.sleep(300)  # Sync every 5 minutes
+warnings.filterwarnings("ignore", category=UserWarning, module="google.protobuf.runtime_version")
 
 if __name__ == '__main__':
-    init_p2p_node()
-    loop = asyncio.get_event_loop()
-    loop.create_task(periodic_sync())
-    app.run(debug=True, use_reloader=False)
+    # A single worker: the process owns one P2PNode, see src/api/asgi.py
+    uvicorn.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)),
+                log_level=os.getenv('LOG_LEVEL', 'info'))
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from src.api.endpoints import app as flask_app, p2p_node
+from src.core.channels import channels_from_profile, normalize_channel
+from src.core.database import iter_profiles_updated_after
+from src.utils.metrics import HTTP_REQUEST_SECONDS
+from src.utils.validators import validate_message_content
+
+logger = logging.getLogger(__name__)
+
+# Production entry point (see run.py). The HTTP handlers and the P2PNode share
+# the server's event loop: the node is started in the lifespan, and POST
+# /messages hands messages to its outbox instead of running a loop per request.
+# Every other route is served by the Flask app in endpoints.py, on a thread pool.
+# One node per process, so serve with a single worker.
+
+SYNC_INTERVAL = 300  # seconds, i.e. every 5 minutes
+ANTI_ENTROPY_EVERY = 12  # sync rounds, i.e. hourly
+WSGI_THREADS = 10
+MAX_BATCH_SIZE = 500  # messages per POST /messages/batch
+
+async def follow_user_channels(node, after=None):
+    # Subscribes the node to the channels its users follow, reading only the
+    # profiles updated after the (updated_at, id) watermark given, on a thread.
+    # Returns the new watermark.
+    rows = await asyncio.to_thread(lambda: list(iter_profiles_updated_after(after)))
+    for user_id, updated_at, profile in rows:
+        await node.set_interests(user_id, channels_from_profile(profile))
+        after = (updated_at, user_id)
+    return after
+
+async def periodic_sync(node, interval=SYNC_INTERVAL):
+    rounds = 0
+    followed = None
+    while True:
+        try:
+            followed = await follow_user_channels(node, followed)
+        except Exception as e:
+            logger.error(f"Failed to update channel subscriptions: {e}")
+        await node.discover_channel_peers()
+        await node.sync_messages()
+        rounds += 1
+        if rounds % ANTI_ENTROPY_EVERY == 0:
+            await node.anti_entropy()
+        await asyncio.sleep(interval)
+
+def error_response(status, error, message, headers=None):
+    return JSONResponse({"error": error, "message": message}, status, headers=headers)
+
+def timed_route(path, endpoint, methods):
+    # A Route whose requests are recorded like the Flask app's (see endpoints.record_request)
+    async def timed_endpoint(request):
+        started = time.perf_counter()
+        response = await endpoint(request)
+        HTTP_REQUEST_SECONDS.labels(request.method, path, str(response.status_code)) \
+            .observe(time.perf_counter() - started)
+        return response
+    return Route(path, timed_endpoint, methods=methods)
+
+def parse_batch(body, content_type):
+    # A JSON array, or one JSON object per line for application/x-ndjson
+    if content_type.split(';')[0].strip() == 'application/x-ndjson':
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array")
+    return items
+
+def parse_batch_item(item):
+    # Returns (content, user_id, timestamp or None, channel); raises ValueError with the reason
+    if not isinstance(item, dict):
+        raise ValueError("Expected an object")
+    content, user_id = item.get('content'), item.get('user_id')
+    if not isinstance(content, str) or not validate_message_content(content):
+        raise ValueError("Invalid content")
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise ValueError("Invalid user_id")
+    timestamp = item.get('timestamp')
+    if timestamp is not None:
+        # Relayed messages keep their original timestamp, and with it their content hash
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid timestamp")
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return content, user_id, timestamp, normalize_channel(item.get('channel'))
+
+def create_app(node=p2p_node, wsgi_app=flask_app, sync_interval=SYNC_INTERVAL):
+    async def post_message(request):
+        try:
+            data = await request.json()
+        except ValueError:
+            return error_response(400, "Bad Request", "Invalid JSON")
+        # Checked here rather than by the outbox, which can no longer tell the client
+        try:
+            content, user_id, timestamp, channel = parse_batch_item(data)
+        except ValueError as e:
+            return error_response(400, "Bad Request", str(e))
+        if user_id not in await node.store.get_existing_user_ids([user_id]):
+            return error_response(400, "Bad Request", "Unknown user_id")
+        try:
+            content_hash = node.enqueue_message(content, user_id, timestamp=timestamp, channel=channel)
+        except asyncio.QueueFull:
+            return error_response(503, "Service Unavailable", "Publish queue is full", {"Retry-After": "1"})
+        # Accepted, not yet stored: the outbox writes and gossips it within publish_flush_interval
+        return JSONResponse({"message": "Message accepted", "content_hash": content_hash}, 202)
+
+    async def post_message_batch(request):
+        # Valid messages are stored in one transaction and published together;
+        # invalid ones, and any the store fails on, are reported per item and do
+        # not fail the rest
+        try:
+            items = parse_batch(await request.body(), request.headers.get('content-type', ''))
+        except ValueError as e:
+            return error_response(400, "Bad Request", f"Invalid batch: {e}")
+        if len(items) > MAX_BATCH_SIZE:
+            return error_response(413, "Payload Too Large", f"At most {MAX_BATCH_SIZE} messages per batch")
+
+        results, parsed = [], {}
+        for index, item in enumerate(items):
+            try:
+                parsed[index] = parse_batch_item(item)
+                results.append({"index": index})
+            except ValueError as e:
+                results.append({"index": index, "status": "rejected", "error": str(e)})
+        known_users = await node.store.get_existing_user_ids({user_id for _, user_id, _, _ in parsed.values()})
+        valid, positions = [], []
+        for index, message in parsed.items():
+            if message[1] in known_users:
+                valid.append(message)
+                positions.append(index)
+            else:
+                results[index].update(status="rejected", error="Unknown user_id")
+        for index, (content_hash, status) in zip(positions, await node.publish_messages(valid)):
+            results[index].update(status=status, content_hash=content_hash)
+
+        counts = {status: 0 for status in ("stored", "duplicate", "rejected", "failed")}
+        for result in results:
+            counts[result["status"]] += 1
+        if valid and counts["failed"] == len(valid):
+            return error_response(503, "Service Unavailable", "Failed to store messages", {"Retry-After": "1"})
+        return JSONResponse({**counts, "results": results})
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await node.start()
+        sync_task = asyncio.create_task(periodic_sync(node, sync_interval)) if sync_interval else None
+        try:
+            yield
+        finally:
+            if sync_task:
+                sync_task.cancel()
+                try:
+                    await sync_task
+                except asyncio.CancelledError:
+                    pass
+            # Drains the outbox
+            await node.stop()
+
+    return Starlette(routes=[
+        timed_route('/messages', post_message, methods=['POST']),
+        timed_route('/messages/batch', post_message_batch, methods=['POST']),
+        Mount('/', WSGIMiddleware(wsgi_app, workers=WSGI_THREADS)),
+    ], lifespan=lifespan)
+
+app = create_app()
@@ -1,16 +1,69 @@
-from flask import Flask, jsonify, request
-from src.core.database import Session, User, add_message, get_recent_messages
+from flask import Flask, Response, abort, g, jsonify, request, stream_with_context
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from src.core.database import Session, User, get_messages as query_messages, iter_messages, iter_users
+from src.core.ml import RecommendationCache
 from src.core.p2p import P2PNode
+from src.core.snapshot import SnapshotReader
+from src.utils import profiler
+from src.utils.helpers import ndjson_chunks
+from src.utils.metrics import HTTP_REQUEST_SECONDS, caches
+from datetime import datetime
 import asyncio
+import base64
+import binascii
+import json
+import os
+import time
+
+MAX_PAGE_SIZE = 100
+MAX_RECOMMENDATIONS = 50
 
 app = Flask(__name__)
-p2p_node = P2PNode()
+# P2P_CHANNELS: comma-separated channels the node follows besides its users'
+# (see channels.py); the default channel when unset
+p2p_node = P2PNode(channels=[name for name in os.getenv('P2P_CHANNELS', '').split(',') if name.strip()])
+# Published by the recommendation builder (python -m src.core.builder)
+recommendations = SnapshotReader(os.getenv('RECOMMENDATION_SNAPSHOT_DIR', 'snapshots/recommendations'),
+                                 cache=RecommendationCache())
+caches.add('recommendations', recommendations.cache)
 
 def start_p2p_node():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(p2p_node.start())
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Labelled by route pattern, not path, to keep the label set bounded.
+    # Streamed responses are timed to their first byte.
+    if 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(request.method, route, str(response.status_code)) \
+            .observe(time.perf_counter() - g.request_started)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    # Collapsed stacks of every thread, sampled for ?seconds=N; see profiler.py
+    if not profiler.PROFILING_ENABLED:
+        abort(404)
+    seconds = request.args.get('seconds', 10, type=float)
+    if not 0 < seconds <= profiler.MAX_PROFILE_SECONDS:
+        abort(400, description=f"seconds must be in (0, {profiler.MAX_PROFILE_SECONDS}]")
+    try:
+        stacks = profiler.sample(seconds)
+    except profiler.ProfilerBusy as e:
+        return jsonify({"error": "Conflict", "message": str(e)}), 409
+    return Response(profiler.format_collapsed(stacks), mimetype='text/plain')
+
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify({"error": "Bad Request", "message": str(error)}), 400
@@ -49,17 +102,84 @@ def get_users():
     session.close()
     return jsonify([{"id": user.id, "username": user.username, "email": user.email} for user in users])
 
+def ndjson_response(records):
+    # Streamed as rows are read; gzip when the client accepts it
+    compress = 'gzip' in request.accept_encodings
+    response = Response(stream_with_context(ndjson_chunks(records, compress=compress)),
+                        mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def timestamp_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"Invalid {name} timestamp")
+
+@app.route('/users/export', methods=['GET'])
+def export_users():
+    return ndjson_response(iter_users(after_id=request.args.get('after_id', type=int)))
+
+@app.route('/users/<int:user_id>/recommendations', methods=['GET'])
+def get_recommendations(user_id):
+    top_n = request.args.get('top_n', 5, type=int)
+    if top_n < 1:
+        abort(400, description="top_n must be positive")
+    recommendations.maybe_refresh()
+    model = recommendations.model
+    if model is None:
+        return jsonify({"error": "Service Unavailable", "message": "No recommendation snapshot yet"}), 503
+    return jsonify({"user_id": user_id, "version": model.version,
+                    "recommendations": model.get_recommendations(user_id, top_n=min(top_n, MAX_RECOMMENDATIONS))})
+
+@app.route('/messages/export', methods=['GET'])
+def export_messages():
+    records = iter_messages(user_id=request.args.get('user_id', type=int),
+                            since=timestamp_arg('since'), until=timestamp_arg('until'))
+    return ndjson_response(records)
+
 @app.route('/messages', methods=['POST'])
 def post_message():
     data = request.json
-    add_message(data['content'], data['user_id'])
-    asyncio.run(p2p_node.publish_message(data['content']))
+    # Dev server only; asgi.py serves this route on the node's own loop.
+    # publish_message stores the message as well
+    asyncio.run(p2p_node.publish_message(data['content'], data['user_id']))
     return jsonify({"message": "Message posted successfully"}), 201
 
+def encode_cursor(message):
+    # Opaque to clients; only the (timestamp, id) key of the last message served
+    key = json.dumps([message.timestamp.isoformat(), message.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, description="Invalid cursor")
+
 @app.route('/messages', methods=['GET'])
 def get_messages():
-    messages = get_recent_messages()
-    return jsonify([{"id": msg.id, "content": msg.content, "timestamp": str(msg.timestamp), "user_id": msg.user_id} for msg in messages])
+    limit = request.args.get('limit', 10, type=int)
+    if limit < 1:
+        abort(400, description="limit must be positive")
+    limit = min(limit, MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    user_id = request.args.get('user_id', type=int)
+
+    # One extra row tells whether there is a next page
+    messages = query_messages(after=after, limit=limit + 1, user_id=user_id)
+    page = messages[:limit]
+    return jsonify({
+        "messages": [{"id": msg.id, "content": msg.content, "timestamp": str(msg.timestamp), "user_id": msg.user_id} for msg in page],
+        "next_cursor": encode_cursor(page[-1]) if len(messages) > limit else None,
+    })
 
 if __name__ == '__main__':
     app.run(debug=True)
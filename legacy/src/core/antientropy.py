@@ -0,0 +1,198 @@
+import logging
+
+from src.core.channels import DEFAULT_CHANNEL, normalize_channel
+from src.core.sync_protocol import call, message_from_dict, message_to_dict, SyncProtocolError
+
+logger = logging.getLogger(__name__)
+
+# Anti-entropy between two message stores, for peers too far apart for the
+# watermark sync to catch up cheaply.
+#
+# Both sides keep a MerkleIndex over their content hashes. The requester walks the
+# tree top-down, one round-trip per level, only descending into prefixes whose
+# (count, digest) differ from its own. Once a differing subtree is small enough it
+# asks for the hashes under it, and finally for the messages it is missing. For d
+# differing messages among n this costs O(d log n) digests and O(log n) round-trips.
+#
+# Each channel is reconciled separately, over its own index: requests carry the
+# channel, and a peer that does not index a channel answers as if it held none
+# of its messages.
+HEX_DIGITS = "0123456789abcdef"
+MAX_PREFIXES_PER_REQUEST = 4096
+MAX_HASHES_PER_REQUEST = 500
+# Hashes in one "hashes" response: about 67 bytes of JSON each, so 50000 stay
+# well inside sync_protocol.MAX_FRAME_SIZE
+MAX_HASHES_PER_RESPONSE = 50000
+
+
+class MerkleIndex:
+    """Hash-prefix tree keeping (count, XOR of hashes) for every prefix up to depth."""
+
+    def __init__(self, depth=4):
+        self.depth = depth
+        self.nodes = {}
+        # Highest local Message.id folded in, so refresh() only reads new rows
+        self.last_id = None
+
+    def __len__(self):
+        return self.nodes.get("", (0, 0))[0]
+
+    def add(self, content_hash):
+        self._update(content_hash, 1)
+
+    def remove(self, content_hash):
+        self._update(content_hash, -1)
+
+    def _update(self, content_hash, delta):
+        value = int(content_hash, 16)
+        for length in range(self.depth + 1):
+            prefix = content_hash[:length]
+            count, digest = self.nodes.get(prefix, (0, 0))
+            count += delta
+            if count:
+                self.nodes[prefix] = (count, digest ^ value)
+            else:
+                self.nodes.pop(prefix, None)
+
+    def digest(self, prefix):
+        count, digest = self.nodes.get(prefix, (0, 0))
+        return [count, f"{digest:064x}"]
+
+    async def refresh(self, get_message_hashes_after):
+        # Rows committed out of id order can be missed here; rebuild() starts over.
+        async for message_id, content_hash in get_message_hashes_after(self.last_id):
+            self.add(content_hash)
+            self.last_id = message_id
+
+    async def rebuild(self, get_message_hashes_after):
+        self.nodes = {}
+        self.last_id = None
+        await self.refresh(get_message_hashes_after)
+
+
+def _valid_prefix(prefix, depth):
+    return isinstance(prefix, str) and len(prefix) <= depth and all(c in HEX_DIGITS for c in prefix)
+
+
+def antientropy_handlers(indexes, get_message_hashes_with_prefix, get_messages_by_hashes, refresh=None):
+    # indexes maps each channel served to its MerkleIndex. Hashes are looked up
+    # with get_message_hashes_with_prefix(prefix, channel=...), and refresh(channel)
+    # catches an index up before a walk starts.
+    def scope(request):
+        # Returns (channel, index, prefixes); index is None for channels not
+        # served, which the requester reads as empty. Raises ValueError.
+        channel = normalize_channel(request.get("channel"))
+        index = indexes.get(channel)
+        prefixes = request.get("prefixes", [])[:MAX_PREFIXES_PER_REQUEST]
+        if index is not None and not all(_valid_prefix(prefix, index.depth) for prefix in prefixes):
+            raise ValueError("Invalid prefix")
+        return channel, index, prefixes
+
+    async def digests(request):
+        try:
+            channel, index, prefixes = scope(request)
+        except ValueError as e:
+            return {"error": str(e)}
+        if index is None:
+            return {"digests": {}}
+        if refresh is not None and "" in prefixes:
+            await refresh(channel)
+        return {"digests": {prefix: index.digest(prefix) for prefix in prefixes}}
+
+    async def hashes(request):
+        try:
+            channel, index, prefixes = scope(request)
+        except ValueError as e:
+            return {"error": str(e)}
+        if index is None:
+            return {"hashes": {}}
+        # Prefixes are answered in order until the next one would overflow the
+        # frame; the requester asks again for those left out. The first is
+        # always answered, so every request makes progress.
+        answered, total = {}, 0
+        for prefix in prefixes:
+            hashes = await get_message_hashes_with_prefix(prefix, channel=channel)
+            if answered and total + len(hashes) > MAX_HASHES_PER_RESPONSE:
+                break
+            answered[prefix] = hashes
+            total += len(hashes)
+        return {"hashes": answered}
+
+    async def messages_by_hash(request):
+        wanted = request.get("hashes", [])[:MAX_HASHES_PER_REQUEST]
+        return {"messages": [message_to_dict(msg) for msg in await get_messages_by_hashes(wanted)]}
+
+    return {"digests": digests, "hashes": hashes, "messages_by_hash": messages_by_hash}
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _hash_batches(prefixes, counts):
+    # Groups of at most MAX_PREFIXES_PER_REQUEST prefixes whose expected hash
+    # counts add up to at most MAX_HASHES_PER_RESPONSE (one prefix at least)
+    batch, total = [], 0
+    for prefix in prefixes:
+        if batch and (len(batch) == MAX_PREFIXES_PER_REQUEST or total + counts[prefix] > MAX_HASHES_PER_RESPONSE):
+            yield batch
+            batch, total = [], 0
+        batch.append(prefix)
+        total += counts[prefix]
+    if batch:
+        yield batch
+
+
+async def reconcile(stream, index, get_message_hashes_with_prefix, leaf_size=64, stats=None,
+                    channel=DEFAULT_CHANNEL):
+    """Yield pages of messages in channel the peer on stream holds and the local store lacks.
+
+    index and get_message_hashes_with_prefix(prefix) cover the local messages of channel.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(round_trips=0, differing_leaves=0, missing=0)
+
+    frontier = [""]
+    leaves = {}  # differing prefix -> number of hashes the peer holds under it
+    while frontier:
+        next_frontier = []
+        for prefixes in _chunks(frontier, MAX_PREFIXES_PER_REQUEST):
+            remote = (await call(stream, "digests", prefixes=prefixes, channel=channel))["digests"]
+            stats["round_trips"] += 1
+            for prefix in prefixes:
+                remote_digest = remote.get(prefix, [0, None])
+                if remote_digest[0] == 0 or remote_digest == index.digest(prefix):
+                    continue
+                if remote_digest[0] <= leaf_size or len(prefix) >= index.depth:
+                    leaves[prefix] = remote_digest[0]
+                else:
+                    next_frontier.extend(prefix + digit for digit in HEX_DIGITS)
+        frontier = next_frontier
+    stats["differing_leaves"] = len(leaves)
+
+    missing = []
+    for prefixes in _hash_batches(list(leaves), leaves):
+        while prefixes:
+            remote = (await call(stream, "hashes", prefixes=prefixes, channel=channel))["hashes"]
+            stats["round_trips"] += 1
+            answered = [prefix for prefix in prefixes if prefix in remote]
+            for prefix in answered:
+                local = set(await get_message_hashes_with_prefix(prefix))
+                missing.extend(h for h in remote[prefix] if h not in local)
+            # A response cut short to fit its frame leaves the rest to ask for again
+            prefixes = [prefix for prefix in prefixes if prefix not in remote] if answered else []
+    stats["missing"] = len(missing)
+
+    for hashes in _chunks(missing, MAX_HASHES_PER_REQUEST):
+        response = await call(stream, "messages_by_hash", hashes=hashes)
+        stats["round_trips"] += 1
+        wanted = set(hashes)
+        page = []
+        for data in response.get("messages", []):
+            msg = message_from_dict(data)
+            if msg.content_hash not in wanted:
+                raise SyncProtocolError(f"Peer sent a message not matching its hash: {data.get('hash')}")
+            page.append(msg)
+        if page:
+            yield page
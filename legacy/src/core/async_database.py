@@ -0,0 +1,180 @@
+import asyncio
+import os
+import weakref
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.core.channels import DEFAULT_CHANNEL
+from src.core.database import Message, SyncWatermark, User, _chunked, _message_row, database_url, invalidate_messages
+from src.utils.metrics import DB_COMMIT_SECONDS, timed
+
+# Async counterpart of database.py for code running on the P2P event loop, where
+# a blocking query would stall gossip handling for its whole round-trip.
+#
+# Pool settings come from the environment:
+#   DB_POOL_SIZE             persistent connections per event loop (default 10)
+#   DB_MAX_OVERFLOW          extra connections allowed under burst (default 20)
+#   DB_POOL_TIMEOUT          seconds to wait for a free connection (default 30)
+#   DB_POOL_RECYCLE          seconds before a connection is replaced (default 1800)
+#   DB_STATEMENT_CACHE_SIZE  asyncpg prepared statements per connection (default 100;
+#                            set 0 behind pgbouncer in transaction pooling mode)
+# asyncpg connections belong to the loop that opened them, so each loop gets its own engine
+_engines = weakref.WeakKeyDictionary()
+
+
+def create_engine_for_loop(url=None):
+    statement_cache_size = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+    return create_async_engine(
+        url or database_url('postgresql+asyncpg'),
+        pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        pool_pre_ping=True,
+        connect_args={
+            "statement_cache_size": statement_cache_size,
+            "prepared_statement_cache_size": statement_cache_size,
+        },
+    )
+
+
+def get_engine():
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None:
+        engine = _engines[loop] = create_engine_for_loop()
+    return engine
+
+
+def AsyncSession():
+    return async_sessionmaker(get_engine(), expire_on_commit=False)()
+
+
+async def dispose_engine():
+    engine = _engines.pop(asyncio.get_running_loop(), None)
+    if engine is not None:
+        await engine.dispose()
+
+
+async def add_message(content, user_id, timestamp=None, channel=DEFAULT_CHANNEL):
+    with timed(DB_COMMIT_SECONDS, 'add_message'):
+        async with AsyncSession() as session:
+            new_message = Message(content=content, user_id=user_id, timestamp=timestamp, channel=channel)
+            session.add(new_message)
+            await session.commit()
+            # Off the event loop: with a shared cache this is a blocking round-trip
+            await asyncio.to_thread(invalidate_messages, [user_id])
+            return new_message.id
+
+
+async def insert_messages(messages, chunk_size=500):
+    # See database.insert_messages
+    table = Message.__table__
+    stmt = pg_insert(table) \
+        .on_conflict_do_nothing(index_elements=['content_hash']) \
+        .returning(table.c.id, table.c.content_hash)
+    inserted = []
+    user_ids = set()
+    with timed(DB_COMMIT_SECONDS, 'add_messages_bulk'):
+        async with AsyncSession() as session:
+            connection = await session.connection()
+            for chunk in _chunked(messages, chunk_size):
+                rows = [_message_row(message) for message in chunk]
+                user_ids.update(row['user_id'] for row in rows)
+                result = await connection.execute(stmt, rows)
+                inserted.extend(tuple(row) for row in result)
+            await session.commit()
+    if inserted:
+        # Once per batch, off the event loop as for add_message
+        await asyncio.to_thread(invalidate_messages, user_ids)
+    return inserted
+
+
+async def add_messages_bulk(messages, chunk_size=500):
+    return [message_id for message_id, _ in await insert_messages(messages, chunk_size)]
+
+
+async def get_recent_messages(limit=10):
+    async with AsyncSession() as session:
+        result = await session.execute(select(Message).order_by(Message.timestamp.desc()).limit(limit))
+        return result.scalars().all()
+
+
+async def get_messages_after(after_id=None, limit=100, channel=None):
+    async with AsyncSession() as session:
+        query = select(Message)
+        if channel is not None:
+            query = query.where(Message.channel == channel)
+        if after_id is not None:
+            query = query.where(Message.id > after_id)
+        result = await session.execute(query.order_by(Message.id).limit(limit))
+        return result.scalars().all()
+
+
+async def get_existing_hashes(hashes):
+    hashes = set(hashes)
+    if not hashes:
+        return set()
+    async with AsyncSession() as session:
+        result = await session.execute(select(Message.content_hash).where(Message.content_hash.in_(hashes)))
+        return set(result.scalars().all())
+
+
+async def get_existing_user_ids(user_ids):
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    async with AsyncSession() as session:
+        result = await session.execute(select(User.id).where(User.id.in_(user_ids)))
+        return set(result.scalars().all())
+
+
+async def get_message_hashes_after(after_id=None, chunk_size=10000, channel=None):
+    async with AsyncSession() as session:
+        query = select(Message.id, Message.content_hash).where(Message.content_hash.isnot(None))
+        if channel is not None:
+            query = query.where(Message.channel == channel)
+        if after_id is not None:
+            query = query.where(Message.id > after_id)
+        result = await session.stream(query.order_by(Message.id).execution_options(yield_per=chunk_size))
+        async for row in result:
+            yield row.id, row.content_hash
+
+
+async def get_message_hashes_with_prefix(prefix, channel=None):
+    async with AsyncSession() as session:
+        query = select(Message.content_hash).where(Message.content_hash >= prefix,
+                                                   Message.content_hash < prefix + 'g')
+        if channel is not None:
+            query = query.where(Message.channel == channel)
+        result = await session.execute(query)
+        return list(result.scalars().all())
+
+
+async def get_messages_by_hashes(hashes):
+    async with AsyncSession() as session:
+        result = await session.execute(select(Message).where(Message.content_hash.in_(list(hashes))))
+        return result.scalars().all()
+
+
+async def get_sync_watermark(peer):
+    async with AsyncSession() as session:
+        return await session.get(SyncWatermark, peer)
+
+
+async def set_sync_watermark(peer, message_id, timestamp=None):
+    with timed(DB_COMMIT_SECONDS, 'set_sync_watermark'):
+        async with AsyncSession() as session:
+            stmt = pg_insert(SyncWatermark).values(peer=peer, message_id=message_id, timestamp=timestamp,
+                                                   updated_at=datetime.utcnow())
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[SyncWatermark.peer],
+                set_={"message_id": stmt.excluded.message_id,
+                      "timestamp": stmt.excluded.timestamp,
+                      "updated_at": stmt.excluded.updated_at},
+                where=SyncWatermark.message_id < stmt.excluded.message_id)
+            await session.execute(stmt)
+            await session.commit()
@@ -0,0 +1,202 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from src.core.database import iter_profiles_updated_after
+from src.core.ml import RecommendationSystem
+from src.core.snapshot import SnapshotError, current_version, load_snapshot, read_manifest, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Builds recommendation snapshots from User.profile, outside the API process.
+#
+# Profiles are streamed from Postgres in (updated_at, id) order and vectorized in
+# a process pool; the parent only merges term counts into the model and writes
+# the snapshot, which API processes pick up through a SnapshotReader.
+#
+# A full build reads every profile. A catch-up loads the current snapshot and
+# re-reads profiles updated since the watermark stored in its manifest, minus
+# CATCH_UP_OVERLAP: updated_at is set at transaction start, so a transaction
+# committing after a build can carry an older timestamp. Catch-ups cannot see
+# deleted users; the periodic full build drops them.
+
+INTEREST_FIELDS = ("interests", "skills", "topics", "hobbies", "bio", "about")
+CHUNK_SIZE = 2000
+CATCH_UP_OVERLAP = timedelta(seconds=60)
+
+
+def extract_interests(profile):
+    """Interest text of a profile: its INTEREST_FIELDS joined, as strings or lists of strings."""
+    if not isinstance(profile, dict):
+        return ""
+    parts = []
+    for field in INTEREST_FIELDS:
+        value = profile.get(field)
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, (list, tuple)):
+            parts.extend(item for item in value if isinstance(item, str))
+    return " ".join(part.strip() for part in parts if part.strip())
+
+
+def _vectorize_chunk(n_features, rows):
+    # Runs in a worker process. Returns term counts for users with interests and
+    # the ids of those without any.
+    user_ids, texts, empty = [], [], []
+    for user_id, profile in rows:
+        interests = extract_interests(profile)
+        if interests:
+            user_ids.append(user_id)
+            texts.append(interests)
+        else:
+            empty.append(user_id)
+    from sklearn.feature_extraction.text import HashingVectorizer
+    vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+    return user_ids, vectorizer.transform(texts) if texts else None, empty
+
+
+class RecommendationBuilder:
+    def __init__(self, root, n_features=2 ** 20, workers=None, chunk_size=CHUNK_SIZE, keep=3):
+        self.root = root
+        self.n_features = n_features
+        # 0 vectorizes in this process
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.keep = keep
+
+    def _chunks(self, after):
+        chunk, watermark = [], None
+        for user_id, updated_at, profile in iter_profiles_updated_after(after, chunk_size=self.chunk_size):
+            chunk.append((user_id, profile))
+            watermark = (updated_at, user_id)
+            if len(chunk) == self.chunk_size:
+                yield chunk, watermark
+                chunk = []
+        if chunk:
+            yield chunk, watermark
+
+    def _results(self, after):
+        # (vectorized chunk, watermark after it) in order, with at most two chunks
+        # per worker in flight so a large table is never held in memory
+        if not self.workers:
+            for chunk, watermark in self._chunks(after):
+                yield _vectorize_chunk(self.n_features, chunk), watermark
+            return
+        # Workers are spawned rather than forked: the parent holds an open database cursor
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = deque()
+            for chunk, watermark in self._chunks(after):
+                pending.append((pool.submit(_vectorize_chunk, self.n_features, chunk), watermark))
+                if len(pending) >= 2 * self.workers:
+                    future, done_watermark = pending.popleft()
+                    yield future.result(), done_watermark
+            while pending:
+                future, done_watermark = pending.popleft()
+                yield future.result(), done_watermark
+
+    def _apply(self, rec_system, after, applied=None):
+        # Returns the last watermark read and whether the model changed. Rows up
+        # to applied, the watermark the model was built at, are re-read by the
+        # overlap and only count as changes when the model does not hold them.
+        watermark, changed = None, False
+        for (user_ids, counts, empty), watermark in self._results(after):
+            if not changed:
+                changed = applied is None or watermark > applied or \
+                    not self._holds(rec_system, user_ids, counts, empty)
+            if user_ids:
+                rec_system.add_counts_bulk(user_ids, counts, reweight=False)
+            for user_id in empty:
+                rec_system.remove_user(user_id)
+        return watermark, changed
+
+    @staticmethod
+    def _holds(rec_system, user_ids, counts, empty):
+        if any(user_id in rec_system.matrix for user_id in empty):
+            return False
+        if not user_ids:
+            return True
+        counts = counts.tocsr()
+        for row, user_id in enumerate(user_ids):
+            row_slice = slice(counts.indptr[row], counts.indptr[row + 1])
+            if not rec_system.matrix.holds(user_id, counts.indices[row_slice], counts.data[row_slice]):
+                return False
+        return True
+
+    def _publish(self, rec_system, watermark, started):
+        rec_system.refresh_idf()
+        metadata = {"watermark": [watermark[0].isoformat(), watermark[1]] if watermark else None}
+        version = save_snapshot(rec_system, self.root, keep=self.keep, metadata=metadata)
+        logger.info(f"Built recommendation snapshot {version} in {time.monotonic() - started:.1f}s")
+        return version
+
+    def build_full(self):
+        started = time.monotonic()
+        rec_system = RecommendationSystem(n_features=self.n_features)
+        watermark, _ = self._apply(rec_system, None)
+        return self._publish(rec_system, watermark, started)
+
+    def catch_up(self):
+        """Apply profiles updated since the current snapshot; full build when there is none.
+
+        Returns the new version, or None when nothing changed.
+        """
+        if current_version(self.root) is None:
+            return self.build_full()
+        started = time.monotonic()
+        manifest = read_manifest(self.root)
+        if manifest["n_features"] != self.n_features:
+            raise SnapshotError(f"Snapshot has {manifest['n_features']} features, builder {self.n_features}")
+        previous = manifest.get("metadata", {}).get("watermark")
+        after = None
+        if previous is not None:
+            previous = (datetime.fromisoformat(previous[0]), previous[1])
+            after = (previous[0] - CATCH_UP_OVERLAP, 0)
+        rec_system = load_snapshot(self.root, manifest["version"], mmap=False)
+        watermark, changed = self._apply(rec_system, after, previous)
+        if not changed:
+            # Only the overlap was re-read, and the snapshot already holds it
+            return None
+        if previous is not None:
+            # Never move the watermark back when only the overlap changed
+            watermark = max(watermark, previous)
+        return self._publish(rec_system, watermark, started)
+
+    def run(self, interval=60, full_every=60):
+        # Catch up every interval seconds, with a full build every full_every runs
+        runs = 0
+        while True:
+            try:
+                if runs % full_every == 0:
+                    self.build_full()
+                else:
+                    self.catch_up()
+            except Exception as e:
+                logger.error(f"Recommendation build failed: {e}")
+            runs += 1
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build recommendation snapshots from user profiles")
+    parser.add_argument("--root", default=os.getenv('RECOMMENDATION_SNAPSHOT_DIR', 'snapshots/recommendations'))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=60, help="seconds between catch-ups")
+    parser.add_argument("--full-every", type=int, default=60, help="catch-ups between full builds")
+    parser.add_argument("--once", action="store_true", help="run one catch-up (or full build) and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    builder = RecommendationBuilder(args.root, workers=args.workers)
+    if args.once:
+        builder.catch_up()
+    else:
+        builder.run(args.interval, args.full_every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import hashlib
+import re
+
+# Messages belong to a channel, and each channel is gossiped on its own pubsub
+# topic: a node only receives, stores and syncs the channels it subscribes to,
+# so its load grows with its subscriptions rather than with the whole network.
+#
+# The default channel keeps the topic every node used before channels, so
+# nodes that predate them still exchange its messages. The channel travels
+# with a message (in its envelope and in sync responses) but is not part of
+# its content hash: a message is in exactly one channel.
+DEFAULT_CHANNEL = "global"
+TOPIC_PREFIX = "cosmicsynccore"
+MAX_CHANNEL_LENGTH = 64
+_CHANNEL_NAME = re.compile(r"[a-z0-9][a-z0-9_.-]*")
+
+# Profile fields naming the channels a user follows, as a string or a list of strings
+CHANNEL_FIELDS = ("channels", "groups")
+
+
+def normalize_channel(channel):
+    # Channel names are lowercase; None means the default channel. Raises
+    # ValueError for names that cannot be a channel.
+    if channel is None:
+        return DEFAULT_CHANNEL
+    if not isinstance(channel, str):
+        raise ValueError("Channel must be a string")
+    channel = channel.strip().lower()
+    if len(channel) > MAX_CHANNEL_LENGTH or not _CHANNEL_NAME.fullmatch(channel):
+        raise ValueError(f"Invalid channel name: {channel!r}")
+    return channel
+
+
+def topic_for(channel):
+    return TOPIC_PREFIX if channel == DEFAULT_CHANNEL else f"{TOPIC_PREFIX}/{channel}"
+
+
+def channels_from_profile(profile):
+    """Channels a user profile follows, from its CHANNEL_FIELDS; invalid names are skipped."""
+    if not isinstance(profile, dict):
+        return set()
+    channels = set()
+    for field in CHANNEL_FIELDS:
+        value = profile.get(field)
+        for name in [value] if isinstance(value, str) else value if isinstance(value, list) else []:
+            try:
+                channels.add(normalize_channel(name))
+            except ValueError:
+                continue
+    return channels
+
+
+def sync_peer_for(channel, local_id, peer_ids):
+    """The peer, among peer_ids, that local_id pulls channel from when syncing; None if there are none.
+
+    peer_ids are the channel's other subscribers. Hashing (channel, peer id)
+    orders all of them into a ring, the same for every subscriber, and each
+    pulls from the next: however else the network is wired, messages gossip
+    missed travel round the ring to every subscriber. Each channel's ring is
+    ordered differently, so no peer serves every channel.
+    """
+    ring = sorted({local_id, *peer_ids}, key=lambda peer_id: hashlib.sha256(f"{channel}/{peer_id}".encode()).digest())
+    if len(ring) < 2:
+        return None
+    return ring[(ring.index(local_id) + 1) % len(ring)]
+
+
+class ChannelRouter:
+    """Routing table of a node: which topic each channel is published on, and
+    which channels the node subscribes to.
+
+    A channel stays subscribed while anything holds an interest in it: the
+    node's own configuration (holder "node") or local users following it
+    (holder the user id). set_interests() returns what changed, for the node
+    to subscribe to or leave the matching topics.
+    """
+
+    def __init__(self, channels=(DEFAULT_CHANNEL,)):
+        self.holders = {}  # channel -> holders interested in it
+        self.interests = {}  # holder -> channels
+        self.set_interests("node", channels)
+
+    def __contains__(self, channel):
+        return channel in self.holders
+
+    def topic(self, channel):
+        return topic_for(channel)
+
+    def subscribed(self):
+        return sorted(self.holders)
+
+    def set_interests(self, holder, channels):
+        # Returns (channels newly subscribed, channels left)
+        channels = {normalize_channel(channel) for channel in channels}
+        previous = self.interests.pop(holder, set())
+        if channels:
+            self.interests[holder] = channels
+        added, removed = [], []
+        for channel in channels - previous:
+            if channel not in self.holders:
+                added.append(channel)
+            self.holders.setdefault(channel, set()).add(holder)
+        for channel in previous - channels:
+            self.holders[channel].discard(holder)
+            if not self.holders[channel]:
+                del self.holders[channel]
+                removed.append(channel)
+        return sorted(added), sorted(removed)
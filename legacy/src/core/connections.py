@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RTT = 0.5  # seconds, assumed until a peer has been measured
+RTT_FLOOR = 0.01  # seconds, so sub-millisecond peers do not dominate the ordering
+
+
+class PeerState:
+    def __init__(self, addr, peer_id=None):
+        self.addr = addr
+        self.peer_id = peer_id
+        self.connected = False
+        self.dialing = False
+        self.failures = 0  # consecutive failed dials, drives the backoff
+        self.total_failures = 0
+        self.errors = 0.0  # failed requests, decaying with each success
+        self.rtt = None  # moving average, seconds
+        self.next_dial = 0.0  # clock() time of the next dial attempt
+
+    @property
+    def health(self):
+        # Higher is better: fast peers whose requests succeed; 0 while disconnected
+        if not self.connected:
+            return 0.0
+        rtt = self.rtt if self.rtt is not None else DEFAULT_RTT
+        return 1.0 / (rtt + RTT_FLOOR) / (1.0 + self.errors)
+
+    def as_dict(self):
+        return {"connected": self.connected, "failures": self.failures, "total_failures": self.total_failures,
+                "errors": self.errors, "rtt": self.rtt, "health": self.health}
+
+
+class ConnectionManager:
+    """Keeps known peers connected, redialling lost ones with capped exponential backoff.
+
+    Connection state follows libp2p's connected/disconnected events (see
+    ConnectionNotifee) and the outcome of dials; nothing is polled. A single
+    scheduler task dials peers as their backoff expires, at most max_dials at a
+    time, so a network blip does not turn into a reconnect storm. Backoff starts
+    at base_backoff, doubles per consecutive failure up to max_backoff, and is
+    shortened by a random fraction of up to jitter so peers lost together are
+    not redialled together.
+
+    dial(addr) is a coroutine that connects to addr or raises.
+    """
+
+    def __init__(self, dial, max_dials=4, base_backoff=1.0, max_backoff=300.0, jitter=0.5, rtt_alpha=0.2,
+                 clock=time.monotonic, rng=random.random):
+        self.dial = dial
+        self.max_dials = max_dials
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.rtt_alpha = rtt_alpha
+        self.clock = clock
+        self.rng = rng
+        self.peers = {}  # addr -> PeerState
+        self.by_peer_id = {}  # peer id -> PeerState, for connection events
+        self.dial_slots = asyncio.Semaphore(max_dials)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.dials = set()  # dial tasks started by the scheduler, for stop()
+
+    def __contains__(self, addr):
+        return addr in self.peers
+
+    def add(self, addr, peer_id=None):
+        state = self.peers.get(addr)
+        if state is None:
+            state = self.peers[addr] = PeerState(addr, peer_id)
+            if peer_id is not None:
+                self.by_peer_id[peer_id] = state
+            self.wakeup.set()
+        return state
+
+    def remove(self, addr):
+        state = self.peers.pop(addr, None)
+        if state is not None and state.peer_id is not None:
+            self.by_peer_id.pop(state.peer_id, None)
+
+    async def connect(self, addr, peer_id=None):
+        # Dials now (within the dial limit) instead of waiting for the scheduler
+        return await self._dial(self.add(addr, peer_id))
+
+    def connected_peers(self):
+        # Healthiest first
+        connected = [state for state in self.peers.values() if state.connected]
+        connected.sort(key=lambda state: state.health, reverse=True)
+        return [state.addr for state in connected]
+
+    def stats(self):
+        return {addr: state.as_dict() for addr, state in self.peers.items()}
+
+    def record_rtt(self, addr, seconds):
+        state = self.peers.get(addr)
+        if state is None:
+            return
+        state.rtt = seconds if state.rtt is None else (1 - self.rtt_alpha) * state.rtt + self.rtt_alpha * seconds
+        state.errors /= 2
+
+    def record_error(self, addr):
+        state = self.peers.get(addr)
+        if state is not None:
+            state.errors += 1
+
+    def on_connected(self, peer_id):
+        state = self.by_peer_id.get(peer_id)
+        if state is not None:
+            state.connected = True
+            state.failures = 0
+
+    def on_disconnected(self, peer_id):
+        state = self.by_peer_id.get(peer_id)
+        if state is None or not state.connected:
+            return
+        state.connected = False
+        state.next_dial = self.clock() + self._backoff(0)
+        logger.info(f"Lost connection to peer {state.addr}")
+        self.wakeup.set()
+
+    def _backoff(self, failures):
+        delay = min(self.max_backoff, self.base_backoff * 2 ** failures)
+        return delay * (1 - self.jitter * self.rng())
+
+    async def _dial(self, state):
+        if state.connected or state.dialing:
+            return state.connected
+        state.dialing = True
+        return await self._attempt(state)
+
+    async def _attempt(self, state):
+        # state.dialing is already set, so nothing else dials the peer meanwhile
+        try:
+            async with self.dial_slots:
+                started = self.clock()
+                try:
+                    await self.dial(state.addr)
+                except Exception as e:
+                    delay = self._backoff(state.failures)
+                    state.failures += 1
+                    state.total_failures += 1
+                    state.next_dial = self.clock() + delay
+                    logger.warning(f"Failed to connect to peer {state.addr}: {e}; retrying in {delay:.1f}s")
+                    return False
+                self.record_rtt(state.addr, self.clock() - started)
+                state.connected = True
+                state.failures = 0
+                logger.info(f"Connected to peer: {state.addr}")
+                return True
+        finally:
+            state.dialing = False
+            self.wakeup.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self.task
+
+    async def stop(self):
+        tasks = [task for task in [self.task, *self.dials] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+        self.dials.clear()
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            now = self.clock()
+            waiting = [state for state in self.peers.values() if not state.connected and not state.dialing]
+            in_flight = sum(state.dialing for state in self.peers.values())
+            due = sorted((state for state in waiting if state.next_dial <= now), key=lambda state: state.next_dial)
+            for state in due[:max(0, self.max_dials - in_flight)]:
+                state.dialing = True
+                task = asyncio.create_task(self._attempt(state))
+                self.dials.add(task)
+                task.add_done_callback(self.dials.discard)
+            upcoming = [state.next_dial for state in waiting if state.next_dial > now]
+            timeout = max(0.0, min(upcoming) - self.clock()) if upcoming else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class ConnectionNotifee:
+    # Forwards libp2p connection events to a ConnectionManager. Implements
+    # libp2p.abc.INotifee without subclassing it, which would import libp2p
+    # with this module.
+    def __init__(self, manager):
+        self.manager = manager
+
+    async def connected(self, network, conn):
+        self.manager.on_connected(str(conn.muxed_conn.peer_id))
+
+    async def disconnected(self, network, conn):
+        self.manager.on_disconnected(str(conn.muxed_conn.peer_id))
+
+    async def opened_stream(self, network, stream):
+        pass
+
+    async def closed_stream(self, network, stream):
+        pass
+
+    async def listen(self, network, multiaddr):
+        pass
+
+    async def listen_close(self, network, multiaddr):
+        pass
@@ -1,12 +1,13 @@
 import os
+import hashlib
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, func, tuple_, Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from sqlalchemy.dialects.postgresql import JSONB
-from datetime import datetime
-
-# Load environment variables from .env file
-load_dotenv()
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from datetime import datetime, timezone
+from src.core.channels import DEFAULT_CHANNEL, MAX_CHANNEL_LENGTH
+from src.utils.cache import LRUCache, RedisCache
+from src.utils.metrics import DB_COMMIT_SECONDS, caches, timed
 
 Base = declarative_base()
 
@@ -16,45 +17,341 @@ class User(Base):
     username = Column(String(64), unique=True, nullable=False)
     email = Column(String(120), unique=True, nullable=False)
     profile = Column(JSONB)
+    # Watermark for incremental recommendation builds (see builder.py)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     messages = relationship("Message", back_populates="user")
 
+    __table_args__ = (
+        Index('ix_users_profile', 'profile', postgresql_using='gin', postgresql_ops={'profile': 'jsonb_path_ops'}),
+        Index('ix_users_updated_at_id', 'updated_at', 'id'),
+    )
+
 class Message(Base):
     __tablename__ = 'messages'
     id = Column(Integer, primary_key=True)
     content = Column(String, nullable=False)
     timestamp = Column(DateTime(timezone=True), default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # Content-addressed id, identical on every node that holds the message
+    content_hash = Column(String(64), unique=True)
+    # See channels.py
+    channel = Column(String(MAX_CHANNEL_LENGTH), nullable=False, default=DEFAULT_CHANNEL,
+                     server_default=DEFAULT_CHANNEL)
     user = relationship("User", back_populates="messages")
 
-# Construct database URL from environment variables
-DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    # Serve keyset pagination in get_messages, newest first, and sync of one channel
+    __table_args__ = (
+        Index('ix_messages_timestamp_id', 'timestamp', 'id'),
+        Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+        Index('ix_messages_channel_id', 'channel', 'id'),
+    )
 
-engine = create_engine(DATABASE_URL)
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+def _normalize_timestamp(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc).isoformat(timespec="microseconds")
 
-def add_message(content, user_id):
-    with Session() as session:
-        new_message = Message(content=content, user_id=user_id)
+def compute_message_hash(content, user_id, timestamp):
+    payload = f"{content}\x00{user_id}\x00{_normalize_timestamp(timestamp)}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+@event.listens_for(Message, "before_insert")
+def _set_content_hash(mapper, connection, message):
+    if message.timestamp is None:
+        message.timestamp = datetime.now(timezone.utc)
+    if message.content_hash is None:
+        message.content_hash = compute_message_hash(message.content, message.user_id, message.timestamp)
+
+class SyncWatermark(Base):
+    # Highest message of a peer's store that has been pulled into ours.
+    # message_id is the peer's local id, which is the sync cursor.
+    __tablename__ = 'sync_watermarks'
+    peer = Column(String, primary_key=True)
+    message_id = Column(Integer, nullable=False)
+    timestamp = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def database_url(driver='postgresql'):
+    # Construct database URL from environment variables, and the .env file
+    load_dotenv()
+    return f"{driver}://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+
+# The engine is created, and the schema with it, on first use rather than on
+# import: importing this module must not need a database
+_engine = None
+
+def get_engine():
+    # The schema is Alembic's (alembic upgrade head); connecting creates nothing
+    global _engine
+    if _engine is None:
+        _engine = create_engine(database_url())
+    return _engine
+
+def create_schema(engine=None):
+    # Creates any missing table straight from the models, bypassing migrations:
+    # for development databases and tests, never for a deployed one
+    Base.metadata.create_all(engine or get_engine())
+
+def __getattr__(name):
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw):
+        if self.kw.get('bind') is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+Session = _LazySessionmaker()
+
+# Read cache for the hottest lookups: users by id and the first page of
+# get_messages, which GET /messages serves to everyone. Writes through this
+# module and async_database keep it coherent: new messages drop the cached
+# pages they belong on, user rows are stored on insert and dropped on ORM
+# updates and deletes. The TTLs bound staleness from anything else, such as a
+# read that raced a write, or writes by other processes to a per-process cache.
+#
+#   CACHE_URL               redis://... to share one cache between API workers
+#                           (needs the redis package); unset for a per-process LRU
+#   CACHE_MAX_SIZE          entries in the per-process LRU (default 10000)
+#   USER_CACHE_TTL          seconds (default 60)
+#   MESSAGE_PAGE_CACHE_TTL  seconds (default 5)
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+MESSAGE_PAGE_CACHE_TTL = float(os.getenv('MESSAGE_PAGE_CACHE_TTL', 5))
+# Rows cached per first page: the API asks for at most 100 plus one, and
+# smaller pages are slices of it
+RECENT_PAGE_SIZE = 101
+
+def create_read_cache(url=None):
+    url = url or os.getenv('CACHE_URL')
+    if url:
+        return RedisCache.from_url(url)
+    return LRUCache(max_size=int(os.getenv('CACHE_MAX_SIZE', 10000)))
+
+read_cache = create_read_cache()
+caches.add('read', read_cache)
+
+def _row(instance):
+    return {column.name: getattr(instance, column.name) for column in instance.__table__.columns}
+
+def invalidate_messages(user_ids):
+    # Drops the cached first pages new messages by user_ids would appear on
+    read_cache.delete(('recent_messages', None))
+    for user_id in set(user_ids):
+        read_cache.delete(('recent_messages', user_id))
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, user):
+    read_cache.delete(('user', user.id))
+
+def add_message(content, user_id, timestamp=None, channel=DEFAULT_CHANNEL):
+    with Session() as session, timed(DB_COMMIT_SECONDS, 'add_message'):
+        new_message = Message(content=content, user_id=user_id, timestamp=timestamp, channel=channel)
         session.add(new_message)
         session.commit()
+        invalidate_messages([user_id])
         return new_message.id
 
+def _message_row(message):
+    if isinstance(message, dict):
+        content, user_id, timestamp = message['content'], message['user_id'], message.get('timestamp')
+        channel = message.get('channel')
+    else:
+        content, user_id, timestamp = message.content, message.user_id, message.timestamp
+        channel = getattr(message, 'channel', None)
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    return {'content': content, 'user_id': user_id, 'timestamp': timestamp,
+            'content_hash': compute_message_hash(content, user_id, timestamp),
+            'channel': channel or DEFAULT_CHANNEL}
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def insert_messages(messages, chunk_size=500):
+    # Inserts messages (Message objects or dicts) in one transaction, one multi-row
+    # INSERT per chunk, skipping any whose content hash is already stored.
+    # Returns (id, content_hash) of the rows actually inserted.
+    table = Message.__table__
+    stmt = pg_insert(table) \
+        .on_conflict_do_nothing(index_elements=['content_hash']) \
+        .returning(table.c.id, table.c.content_hash)
+    inserted = []
+    user_ids = set()
+    with Session() as session, timed(DB_COMMIT_SECONDS, 'add_messages_bulk'):
+        connection = session.connection()
+        for chunk in _chunked(messages, chunk_size):
+            rows = [_message_row(message) for message in chunk]
+            user_ids.update(row['user_id'] for row in rows)
+            result = connection.execute(stmt, rows)
+            inserted.extend(tuple(row) for row in result)
+        session.commit()
+    if inserted:
+        invalidate_messages(user_ids)
+    return inserted
+
+def add_messages_bulk(messages, chunk_size=500):
+    # insert_messages, returning only the ids of the rows inserted
+    return [message_id for message_id, _ in insert_messages(messages, chunk_size)]
+
 def get_recent_messages(limit=10):
+    return get_messages(limit=limit)
+
+def get_messages(after=None, limit=50, user_id=None):
+    # Newest first, keyset-paginated: after is the (timestamp, id) of the last
+    # message of the previous page, so every page is an index range scan of
+    # limit rows however deep it is. First pages come from read_cache.
+    if after is not None or limit > RECENT_PAGE_SIZE:
+        return _query_messages(after, limit, user_id)
+    key = ('recent_messages', user_id)
+    rows = read_cache.get(key)
+    if rows is None:
+        rows = [_row(message) for message in _query_messages(None, RECENT_PAGE_SIZE, user_id)]
+        read_cache.set(key, rows, ttl=MESSAGE_PAGE_CACHE_TTL)
+    return [Message(**row) for row in rows[:limit]]
+
+def _query_messages(after, limit, user_id):
     with Session() as session:
-        messages = session.query(Message).order_by(Message.timestamp.desc()).limit(limit).all()
-        return messages
+        query = session.query(Message)
+        if user_id is not None:
+            query = query.filter(Message.user_id == user_id)
+        if after is not None:
+            query = query.filter(tuple_(Message.timestamp, Message.id) < tuple_(*after))
+        return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
 
-def add_user(username, email, profile=None):
+def get_messages_after(after_id=None, limit=100, channel=None):
+    # Pages through the local store in insertion order for peers syncing from
+    # us, through one channel or all of them
+    with Session() as session:
+        query = session.query(Message)
+        if channel is not None:
+            query = query.filter(Message.channel == channel)
+        if after_id is not None:
+            query = query.filter(Message.id > after_id)
+        return query.order_by(Message.id).limit(limit).all()
+
+def get_existing_hashes(hashes):
+    # Returns the subset of content hashes already stored locally
+    hashes = set(hashes)
+    if not hashes:
+        return set()
+    with Session() as session:
+        rows = session.query(Message.content_hash).filter(Message.content_hash.in_(hashes)).all()
+    return {row[0] for row in rows}
+
+def get_message_hashes_after(after_id=None, chunk_size=10000, channel=None):
+    # Yields (id, content_hash) in insertion order, e.g. to build or refresh a MerkleIndex
+    with Session() as session:
+        query = session.query(Message.id, Message.content_hash).filter(Message.content_hash.isnot(None))
+        if channel is not None:
+            query = query.filter(Message.channel == channel)
+        if after_id is not None:
+            query = query.filter(Message.id > after_id)
+        for row in query.order_by(Message.id).yield_per(chunk_size):
+            yield row.id, row.content_hash
+
+def get_message_hashes_with_prefix(prefix, channel=None):
+    # 'g' sorts after every hex digit, so this is a range scan on the unique index
+    with Session() as session:
+        query = session.query(Message.content_hash) \
+            .filter(Message.content_hash >= prefix, Message.content_hash < prefix + 'g')
+        if channel is not None:
+            query = query.filter(Message.channel == channel)
+        rows = query.all()
+    return [row[0] for row in rows]
+
+def get_messages_by_hashes(hashes):
+    with Session() as session:
+        return session.query(Message).filter(Message.content_hash.in_(list(hashes))).all()
+
+def get_sync_watermark(peer):
+    with Session() as session:
+        return session.get(SyncWatermark, peer)
+
+def set_sync_watermark(peer, message_id, timestamp=None):
+    with Session() as session, timed(DB_COMMIT_SECONDS, 'set_sync_watermark'):
+        stmt = pg_insert(SyncWatermark).values(peer=peer, message_id=message_id, timestamp=timestamp,
+                                               updated_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SyncWatermark.peer],
+            set_={"message_id": stmt.excluded.message_id,
+                  "timestamp": stmt.excluded.timestamp,
+                  "updated_at": stmt.excluded.updated_at},
+            where=SyncWatermark.message_id < stmt.excluded.message_id)
+        session.execute(stmt)
+        session.commit()
+
+def iter_messages(user_id=None, since=None, until=None, chunk_size=1000):
+    # Streams messages in insertion order through a server-side cursor, holding
+    # at most chunk_size rows in memory
+    with Session() as session:
+        query = session.query(Message.id, Message.content, Message.user_id, Message.timestamp,
+                              Message.content_hash)
+        if user_id is not None:
+            query = query.filter(Message.user_id == user_id)
+        if since is not None:
+            query = query.filter(Message.timestamp >= since)
+        if until is not None:
+            query = query.filter(Message.timestamp < until)
+        query = query.order_by(Message.id).execution_options(stream_results=True, yield_per=chunk_size)
+        for row in query:
+            yield row._asdict()
+
+def iter_users(after_id=None, chunk_size=1000):
+    # Streams users in id order through a server-side cursor, see iter_messages
+    with Session() as session:
+        query = session.query(User.id, User.username, User.email, User.profile)
+        if after_id is not None:
+            query = query.filter(User.id > after_id)
+        query = query.order_by(User.id).execution_options(stream_results=True, yield_per=chunk_size)
+        for row in query:
+            yield row._asdict()
+
+def iter_profiles_updated_after(after=None, chunk_size=1000):
+    # Yields (id, updated_at, profile) ordered by (updated_at, id), starting after
+    # the (updated_at, id) watermark given, through a server-side cursor
     with Session() as session:
+        query = session.query(User.id, User.updated_at, User.profile)
+        if after is not None:
+            query = query.filter(tuple_(User.updated_at, User.id) > tuple_(*after))
+        query = query.order_by(User.updated_at, User.id) \
+            .execution_options(stream_results=True, yield_per=chunk_size)
+        for row in query:
+            yield row.id, row.updated_at, row.profile
+
+def add_user(username, email, profile=None):
+    with Session() as session, timed(DB_COMMIT_SECONDS, 'add_user'):
         new_user = User(username=username, email=email, profile=profile)
         session.add(new_user)
         session.commit()
+        # Write-through: the row is read back after the commit anyway, for its id
+        read_cache.set(('user', new_user.id), _row(new_user), ttl=USER_CACHE_TTL)
         return new_user.id
 
 def get_user(user_id):
-    with Session() as session:
-        return session.query(User).filter(User.id == user_id).first()
+    # Returns a User detached from any session; its relationships are not loaded
+    row = read_cache.get(('user', user_id))
+    if row is None:
+        with Session() as session:
+            user = session.get(User, user_id)
+            if user is None:
+                return None
+            row = _row(user)
+        read_cache.set(('user', user_id), row, ttl=USER_CACHE_TTL)
+    return User(**row)
 
 # Example of a more complex query using PostgreSQL features
 def search_users_by_profile(search_term):
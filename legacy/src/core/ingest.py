@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def is_transient(error):
+    # Failures worth retrying as they are: lost connections and timeouts, not
+    # rows the database rejected
+    from sqlalchemy.exc import DBAPIError, OperationalError
+
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated or isinstance(error, OperationalError)
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+class BloomFilter:
+    """Probabilistic set of content hashes: no false negatives, rare false positives.
+
+    Positives are only a hint and have to be confirmed against the database.
+    Once more than capacity hashes were added the filter clears itself, so its
+    false-positive rate stays near error_rate without unbounded growth.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, content_hash):
+        # Content hashes are already uniform (sha256), so double hashing over two
+        # slices of the digest is enough to derive hash_count positions.
+        h1 = int(content_hash[:16], 16)
+        h2 = int(content_hash[16:32], 16) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def __contains__(self, content_hash):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(content_hash))
+
+    def add(self, content_hash):
+        if self.count >= self.capacity:
+            self.clear()
+        for pos in self._positions(content_hash):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class IngestQueue:
+    # Bounded buffer between gossip handling and the database. put() blocks when
+    # the queue is full, so a burst slows the pubsub reader down instead of piling
+    # up tasks; a single worker flushes micro-batches of up to batch_size items, or
+    # whatever arrived within flush_interval seconds of the first one.
+    #
+    # A batch that fails transiently is retried up to retries times, with
+    # exponential backoff from retry_delay seconds. After that, or when it is
+    # rejected, its items are flushed one at a time, so one bad item (say a
+    # message by an unknown user) does not take its neighbours down with it.
+    def __init__(self, flush, max_size=10000, batch_size=500, flush_interval=0.25, name="ingested messages",
+                 retries=2, retry_delay=0.1):
+        self.flush = flush
+        self.name = name  # for logs
+        self.queue = asyncio.Queue(max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.worker = None
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    async def put(self, item):
+        await self.queue.put(item)
+
+    def put_nowait(self, item):
+        # Raises asyncio.QueueFull instead of waiting
+        self.queue.put_nowait(item)
+
+    def start(self):
+        self.worker = asyncio.create_task(self._run())
+        return self.worker
+
+    async def stop(self):
+        if self.worker:
+            if not self.worker.done():
+                # The worker flushes its current batch when it reaches the marker
+                await self.queue.put(_STOP)
+                await self.worker
+            self.worker = None
+        # Flush whatever is still buffered
+        while not self.queue.empty():
+            await self._flush(self._drain(self.batch_size))
+
+    def _drain(self, limit):
+        # Stops after the stop marker, if it is reached
+        batch = []
+        while len(batch) < limit and not self.queue.empty() and not (batch and batch[-1] is _STOP):
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                if len(batch) >= self.batch_size or batch[-1] is _STOP:
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            if batch[-1] is _STOP:
+                await self._flush(batch[:-1])
+                return
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        if not batch:
+            return
+        for attempt in range(self.retries + 1):
+            try:
+                await self.flush(batch)
+                return
+            except Exception as e:
+                error = e
+                if not is_transient(e) or attempt == self.retries:
+                    break
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        if len(batch) == 1:
+            logger.error(f"Failed to flush 1 of {self.name}: {error}")
+            return
+        logger.warning(f"Failed to flush {len(batch)} {self.name}, flushing them one at a time: {error}")
+        failed = 0
+        for item in batch:
+            try:
+                await self.flush([item])
+            except Exception as e:
+                failed += 1
+                error = e
+        if failed:
+            logger.error(f"Failed to flush {failed} of {len(batch)} {self.name}: {error}")
@@ -0,0 +1,112 @@
+import bisect
+from typing import NamedTuple
+
+from src.core.channels import DEFAULT_CHANNEL
+from src.core.database import _chunked, _message_row
+
+
+class StoredMessage(NamedTuple):
+    id: int
+    content: str
+    user_id: int
+    timestamp: object
+    content_hash: str
+    channel: str = DEFAULT_CHANNEL
+
+
+class Watermark(NamedTuple):
+    peer: str
+    message_id: int
+    timestamp: object
+
+
+class MemoryStore:
+    """Message store held in memory, with the coroutines of async_database.
+
+    For P2PNode(store=MemoryStore()) where a database would get in the way:
+    benchmarks, simulations and tests. Ids are assigned in insertion order from
+    1, and inserts skip content hashes already stored, as the database does.
+    """
+
+    def __init__(self):
+        self.messages = []  # messages[i].id == i + 1
+        self.by_hash = {}
+        self.by_prefix = {}  # first two hex digits of the hash -> hashes, for anti-entropy
+        self.by_channel = {}  # channel -> its messages, in id order
+        self.watermarks = {}
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _insert(self, rows):
+        inserted = []
+        for row in rows:
+            if row['content_hash'] in self.by_hash:
+                continue
+            message = StoredMessage(len(self.messages) + 1, row['content'], row['user_id'], row['timestamp'],
+                                    row['content_hash'], row['channel'])
+            self.messages.append(message)
+            self.by_channel.setdefault(message.channel, []).append(message)
+            self.by_hash[message.content_hash] = message
+            self.by_prefix.setdefault(message.content_hash[:2], []).append(message.content_hash)
+            inserted.append((message.id, message.content_hash))
+        return inserted
+
+    async def add_message(self, content, user_id, timestamp=None, channel=DEFAULT_CHANNEL):
+        row = _message_row({'content': content, 'user_id': user_id, 'timestamp': timestamp, 'channel': channel})
+        self._insert([row])
+        return self.by_hash[row['content_hash']].id
+
+    async def insert_messages(self, messages, chunk_size=500):
+        inserted = []
+        for chunk in _chunked(messages, chunk_size):
+            inserted.extend(self._insert(_message_row(message) for message in chunk))
+        return inserted
+
+    async def add_messages_bulk(self, messages, chunk_size=500):
+        return [message_id for message_id, _ in await self.insert_messages(messages, chunk_size)]
+
+    async def get_recent_messages(self, limit=10):
+        return sorted(self.messages, key=lambda message: message.timestamp, reverse=True)[:limit]
+
+    def _after(self, after_id, channel):
+        if channel is None:
+            return self.messages, after_id or 0
+        messages = self.by_channel.get(channel, [])
+        return messages, bisect.bisect_right(messages, after_id or 0, key=lambda message: message.id)
+
+    async def get_messages_after(self, after_id=None, limit=100, channel=None):
+        messages, start = self._after(after_id, channel)
+        return messages[start:start + limit]
+
+    async def get_existing_hashes(self, hashes):
+        return {content_hash for content_hash in hashes if content_hash in self.by_hash}
+
+    async def get_existing_user_ids(self, user_ids):
+        # There is no users table here: every author exists
+        return set(user_ids)
+
+    async def get_message_hashes_after(self, after_id=None, chunk_size=10000, channel=None):
+        messages, start = self._after(after_id, channel)
+        for message in messages[start:]:
+            yield message.id, message.content_hash
+
+    async def get_message_hashes_with_prefix(self, prefix, channel=None):
+        if len(prefix) >= 2:
+            candidates = self.by_prefix.get(prefix[:2], [])
+        else:
+            candidates = [content_hash for bucket, hashes in self.by_prefix.items() if bucket.startswith(prefix)
+                          for content_hash in hashes]
+        return [content_hash for content_hash in candidates if content_hash.startswith(prefix)
+                and (channel is None or self.by_hash[content_hash].channel == channel)]
+
+    async def get_messages_by_hashes(self, hashes):
+        return [self.by_hash[content_hash] for content_hash in hashes if content_hash in self.by_hash]
+
+    async def get_sync_watermark(self, peer):
+        return self.watermarks.get(peer)
+
+    async def set_sync_watermark(self, peer, message_id, timestamp=None):
+        current = self.watermarks.get(peer)
+        if current is None or current.message_id < message_id:
+            self.watermarks[peer] = Watermark(peer, message_id, timestamp)
@@ -1,43 +1,415 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import itertools
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
+import scipy.sparse as sp
+from src.utils.cache import LRUCache
+from src.utils.metrics import RECOMMENDATION_SECONDS, timed
+
+def _dot_rows(matrix, vector):
+    # matrix @ vector.T for a 1-row sparse vector, in O(matrix.nnz). scipy first
+    # converts vector.T to CSR, an O(n_features) step that dominates for the few
+    # hundred rows an ANN query scores.
+    positions = np.searchsorted(vector.indices, matrix.indices)
+    positions[positions == len(vector.indices)] = 0
+    weights = np.where(vector.indices[positions] == matrix.indices, vector.data[positions], 0) \
+        if len(vector.indices) else np.zeros(len(matrix.indices))
+    return np.bincount(np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr)),
+                       weights=matrix.data * weights, minlength=matrix.shape[0])
+
+class UserMatrix:
+    """Append-only CSR matrix with one row per user, kept in growable arrays.
+
+    Adding a row is amortized O(row size) and csr() wraps the arrays without
+    copying. Replaced or removed users leave an inactive empty row behind until
+    compact().
+    """
+
+    def __init__(self, n_features, capacity=1024, row_capacity=64):
+        self.n_features = n_features
+        self.user_ids = []  # row -> user_id, None for removed rows
+        self.rows = {}  # user_id -> row
+        self.counts = np.zeros(capacity, dtype=np.float64)  # raw term counts
+        self.data = np.zeros(capacity, dtype=np.float64)  # weighted, row-normalized
+        self.indices = np.zeros(capacity, dtype=np.int32)
+        self.indptr = np.zeros(row_capacity + 1, dtype=np.int64)
+        self.active = np.zeros(row_capacity, dtype=bool)  # always one shorter than indptr
+        self.nnz = 0
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, user_id):
+        return user_id in self.rows
+
+    @property
+    def n_rows(self):
+        return len(self.user_ids)
+
+    @staticmethod
+    def _grow(array, size):
+        grown = np.zeros(max(2 * len(array), size), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def row_slice(self, row):
+        return slice(self.indptr[row], self.indptr[row + 1])
+
+    def add(self, user_id, indices, counts):
+        self.remove(user_id)
+        order = np.argsort(indices)  # rows keep sorted indices, see _dot_rows
+        indices, counts = np.asarray(indices)[order], np.asarray(counts)[order]
+        end = self.nnz + len(indices)
+        if end > len(self.counts):
+            self.counts, self.data, self.indices = (self._grow(self.counts, end), self._grow(self.data, end),
+                                                    self._grow(self.indices, end))
+        row = self.n_rows
+        if row + 1 >= len(self.active):
+            self.indptr, self.active = self._grow(self.indptr, row + 2), self._grow(self.active, row + 1)
+        self.indices[self.nnz:end] = indices
+        self.counts[self.nnz:end] = counts
+        self.data[self.nnz:end] = 0
+        self.nnz = end
+        self.indptr[row + 1] = end
+        self.active[row] = True
+        self.rows[user_id] = row
+        self.user_ids.append(user_id)
+        return row
+
+    def holds(self, user_id, indices, counts):
+        # Whether the user's row holds exactly these term counts
+        row = self.rows.get(user_id)
+        if row is None:
+            return False
+        row_slice = self.row_slice(row)
+        order = np.argsort(indices)
+        return (np.array_equal(self.indices[row_slice], np.asarray(indices)[order])
+                and np.array_equal(self.counts[row_slice], np.asarray(counts)[order]))
+
+    def remove(self, user_id):
+        # Returns the term indices the user's row held
+        row = self.rows.pop(user_id, None)
+        if row is None:
+            return None
+        self.user_ids[row] = None
+        self.active[row] = False
+        self.removed += 1
+        row_slice = self.row_slice(row)
+        self.data[row_slice] = 0
+        self.counts[row_slice] = 0
+        return self.indices[row_slice]
+
+    def csr(self, values=None):
+        values = self.data if values is None else values
+        return sp.csr_matrix((values[:self.nnz], self.indices[:self.nnz], self.indptr[:self.n_rows + 1]),
+                             shape=(self.n_rows, self.n_features), copy=False)
+
+    def reweight(self, idf):
+        # data = counts * idf, l2-normalized per row, in one vectorized pass
+        row_of = np.repeat(np.arange(self.n_rows), np.diff(self.indptr[:self.n_rows + 1]))
+        data = self.counts[:self.nnz] * idf[self.indices[:self.nnz]]
+        norms = np.sqrt(np.bincount(row_of, weights=data ** 2, minlength=self.n_rows))
+        norms[norms == 0] = 1
+        self.data[:self.nnz] = data / norms[row_of]
+
+    def compact(self):
+        keep = np.flatnonzero(self.active[:self.n_rows])
+        counts, data = self.csr(self.counts)[keep], self.csr()[keep]
+        self.user_ids = [self.user_ids[row] for row in keep]
+        self.rows = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        self.nnz = data.nnz
+        self.counts = counts.data.astype(np.float64)
+        self.data = data.data.astype(np.float64)
+        self.indices = data.indices.astype(np.int32)
+        self.indptr = data.indptr.astype(np.int64)
+        self.active = np.ones(len(keep), dtype=bool)
+        self.removed = 0
+
+class RecommendationCache:
+    """Top-n results keyed by (user_id, top_n, model version, user generation).
+
+    When a user's vector changes, they get a new generation, and so does every
+    user whose cached results included them. Their old entries become
+    unreachable and age out of the LRU. Users whose results the change would
+    newly enter are not tracked; the TTL bounds that staleness.
+
+    Both maps stay bounded: dependencies are dropped with the entry that
+    recorded them, and a user's generation is forgotten ttl seconds after it
+    was assigned, once every entry keyed by an older one has expired (results
+    are only stored under a current generation). Without a ttl, generations
+    are kept, one per user invalidated.
+    """
+
+    def __init__(self, max_size=100000, ttl=300, clock=time.monotonic):
+        self.entries = LRUCache(max_size, ttl, clock, on_remove=self._forget)
+        self.ttl = ttl
+        self.clock = clock
+        self.generations = OrderedDict()  # user_id -> (generation, assigned at), oldest first
+        self.next_generation = itertools.count(1)  # never reused, even by a user whose generation was forgotten
+        self.dependents = {}  # user_id -> keys of the cached entries whose results include it
+        self.invalidations = 0
+        self.lock = threading.RLock()  # reentered when storing an entry evicts another
+
+    def lookup(self, model_version, user_id, top_n):
+        # Returns (key, results or None). Results computed after a miss are put
+        # under the returned key, so an invalidation racing with the computation
+        # keeps them from being stored instead of leaving them stale.
+        key = (user_id, top_n, model_version, self.generations.get(user_id, (0, None))[0])
+        return key, self.entries.get(key)
+
+    def put(self, key, results):
+        with self.lock:
+            if key[3] != self.generations.get(key[0], (0, None))[0]:
+                return  # invalidated while the results were computed
+            for other in results:
+                self.dependents.setdefault(other, set()).add(key)
+            self.entries.set(key, results)
+
+    def _forget(self, key, results):
+        # Called by the LRU for each entry it drops
+        with self.lock:
+            for other in results:
+                keys = self.dependents.get(other)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.dependents[other]
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            now = self.clock()
+            for affected in {user_id} | {key[0] for key in self.dependents.pop(user_id, ())}:
+                self.generations.pop(affected, None)
+                self.generations[affected] = (next(self.next_generation), now)
+                self.invalidations += 1
+            while self.ttl is not None and self.generations:
+                _, (_, assigned_at) = next(iter(self.generations.items()))
+                if assigned_at + self.ttl > now:
+                    break
+                self.generations.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generations.clear()
+            self.dependents.clear()
+
+    def metrics(self):
+        return {**self.entries.metrics(), "invalidations": self.invalidations}
 
 class RecommendationSystem:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer()
+    # TF-IDF over hashed terms, maintained incrementally: term counts are kept per
+    # user and document frequencies are updated online, so adding a user costs
+    # O(size of their interests) instead of a refit over everyone. Weights match
+    # TfidfVectorizer's defaults (smooth idf, l2 norm) up to hash collisions.
+    #
+    # A new user's vector is weighted with the current IDF; everyone else's keeps
+    # the IDF of the last refresh until the number of users has grown by
+    # idf_refresh_ratio, which amortizes reweighting to O(1) per added user.
+    #
+    # Vectors live in one row-normalized CSR matrix (see UserMatrix), so scoring a
+    # user against everyone is a single sparse matrix-vector product. With an ANN
+    # index (see ann.py) only the index's candidates are scored instead. Results
+    # can be cached across calls with a RecommendationCache.
+    def __init__(self, n_features=2 ** 20, idf_refresh_ratio=0.1, index=None, cache=None):
+        self.n_features = n_features
+        self._vectorizer = None
+        self.idf_refresh_ratio = idf_refresh_ratio
         self.user_interests = {}
-        self.user_vectors = {}
+        self.matrix = UserMatrix(n_features)
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.idf_documents = 0  # number of users the current weights were computed for
+        self.index = index
+        self.version = None  # snapshot this model was saved as or loaded from, see snapshot.py
+        self.epoch = 0  # bumped whenever every vector is reweighted
+        self.cache = cache
+
+    @property
+    def vectorizer(self):
+        # scikit-learn is slow to import, and models loaded from a snapshot to
+        # serve recommendations never vectorize text
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(n_features=self.n_features, alternate_sign=False, norm=None)
+        return self._vectorizer
+
+    @property
+    def model_version(self):
+        return self.version, self.epoch
+
+    @property
+    def n_documents(self):
+        return len(self.matrix)
+
+    def idf(self):
+        return np.log((1 + self.n_documents) / (1 + self.document_frequency)) + 1
 
     def add_user_interests(self, user_id, interests):
-        self.user_interests[user_id] = interests
-        self._update_vectors()
+        counts = self.vectorizer.transform([interests])
+        self._add_counts(user_id, interests, counts.indices, counts.data)
+        if self._idf_is_stale():
+            self.refresh_idf()
+        else:
+            row = self.matrix.rows[user_id]
+            self._weigh_row(row)
+            if self.index is not None:
+                self.index.add(user_id, self.matrix.csr()[row])
+            if self.cache is not None:
+                self.cache.invalidate_user(user_id)
 
-    def _update_vectors(self):
-        interests_list = list(self.user_interests.values())
-        vectors = self.vectorizer.fit_transform(interests_list)
-        for i, user_id in enumerate(self.user_interests.keys()):
-            self.user_vectors[user_id] = vectors[i]
+    def add_users_bulk(self, users):
+        # users maps user_id to interests, or is an iterable of (user_id, interests).
+        # Vectorizes everything in one pass and reweights once at the end.
+        items = list(users.items() if isinstance(users, dict) else users)
+        if not items:
+            return
+        user_ids, interests = zip(*items)
+        self.add_counts_bulk(user_ids, self.vectorizer.transform(interests), interests)
+
+    def add_counts_bulk(self, user_ids, counts, interests=None, reweight=True):
+        # counts holds one row of raw term counts per user, from a HashingVectorizer
+        # with this n_features, possibly run in another process (see builder.py).
+        # Interest text is only kept when given. With reweight=False, callers adding
+        # several batches call refresh_idf() once after the last.
+        counts = counts.tocsr()
+        for row, user_id in enumerate(user_ids):
+            row_slice = slice(counts.indptr[row], counts.indptr[row + 1])
+            self._add_counts(user_id, interests[row] if interests is not None else None,
+                             counts.indices[row_slice], counts.data[row_slice])
+        if reweight:
+            self.refresh_idf()
+
+    def remove_user(self, user_id):
+        self.user_interests.pop(user_id, None)
+        indices = self.matrix.remove(user_id)
+        if indices is not None:
+            self.document_frequency[indices] -= 1
+            self._maybe_compact()
+        if self.index is not None:
+            self.index.remove(user_id)
+        if self.cache is not None:
+            self.cache.invalidate_user(user_id)
+
+    def refresh_idf(self):
+        self.idf_documents = self.n_documents
+        self.epoch += 1
+        self._maybe_compact()
+        self.matrix.reweight(self.idf())
+        if self.index is not None:
+            # Every vector changed, so every signature may have too
+            rows = np.flatnonzero(self.matrix.active[:self.matrix.n_rows])
+            self.index.clear()
+            self.index.add_many([self.matrix.user_ids[row] for row in rows], self.matrix.csr()[rows])
+
+    def _add_counts(self, user_id, interests, indices, counts):
+        previous = self.matrix.remove(user_id)
+        if previous is not None:
+            self.document_frequency[previous] -= 1
+        if interests is None:
+            self.user_interests.pop(user_id, None)
+        else:
+            self.user_interests[user_id] = interests
+        self.matrix.add(user_id, indices, counts)
+        self.document_frequency[indices] += 1
+        self._maybe_compact()
+
+    def _weigh_row(self, row):
+        # Only the IDF of the terms present is computed, from the current counts
+        row_slice = self.matrix.row_slice(row)
+        indices = self.matrix.indices[row_slice]
+        idf = np.log((1 + self.n_documents) / (1 + self.document_frequency[indices])) + 1
+        data = self.matrix.counts[row_slice] * idf
+        norm = np.linalg.norm(data)
+        self.matrix.data[row_slice] = data / norm if norm else data
+
+    def _idf_is_stale(self):
+        return self.n_documents > self.idf_documents * (1 + self.idf_refresh_ratio)
+
+    def _maybe_compact(self):
+        if self.matrix.removed > len(self.matrix):
+            self.matrix.compact()
+
+    def _top_n(self, scores, exclude_row, top_n):
+        scores[~self.matrix.active[:len(scores)]] = -np.inf
+        scores[exclude_row] = -np.inf
+        k = min(top_n, len(self.matrix) - 1)
+        if k <= 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        # Highest score first, earlier rows first among ties
+        ordered = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [self.matrix.user_ids[row] for row in ordered]
 
-    def get_recommendations(self, user_id, top_n=5):
-        if user_id not in self.user_vectors:
+    def _approximate(self, matrix, user_id, top_n):
+        row = self.matrix.rows[user_id]
+        vector = matrix[row]
+        candidates = self.index.candidates(vector)
+        rows = np.fromiter((self.matrix.rows.get(other, -1) for other in candidates), dtype=np.int64,
+                           count=len(candidates))
+        rows = rows[(rows >= 0) & (rows != row)]
+        if not len(rows):
             return []
+        scores = _dot_rows(matrix[rows], vector)
+        order = np.lexsort((rows, -scores))[:top_n]
+        return [self.matrix.user_ids[row] for row in rows[order]]
 
-        user_vector = self.user_vectors[user_id]
-        similarities = {}
+    def get_recommendations(self, user_id, top_n=5, exact=False):
+        with timed(RECOMMENDATION_SECONDS, "single"):
+            if user_id not in self.matrix:
+                return []
+            if self.cache is None or exact:
+                return self._recommend(user_id, top_n, exact)
+            key, results = self.cache.lookup(self.model_version, user_id, top_n)
+            if results is None:
+                results = self._recommend(user_id, top_n, exact)
+                self.cache.put(key, results)
+            return results
 
-        for other_id, other_vector in self.user_vectors.items():
-            if other_id != user_id:
-                similarity = cosine_similarity(user_vector, other_vector)[0][0]
-                similarities[other_id] = similarity
+    def _recommend(self, user_id, top_n, exact):
+        matrix = self.matrix.csr()
+        if self.index is not None and not exact:
+            return self._approximate(matrix, user_id, top_n)
+        row = self.matrix.rows[user_id]
+        scores = (matrix @ matrix[row].T).toarray().ravel()
+        return self._top_n(scores, row, top_n)
 
-        sorted_similarities = sorted(similarities.items(), key=lambda x: x[1], reverse=True)
-        return [user for user, _ in sorted_similarities[:top_n]]
+    def get_recommendations_many(self, user_ids, top_n=5, batch_size=256, exact=False):
+        with timed(RECOMMENDATION_SECONDS, "many"):
+            return self._get_recommendations_many(user_ids, top_n, batch_size, exact)
 
-# Example usage
-rec_system = RecommendationSystem()
-rec_system.add_user_interests(1, "machine learning artificial intelligence data science")
-rec_system.add_user_interests(2, "web development javascript python react")
-rec_system.add_user_interests(3, "artificial intelligence neural networks deep learning")
+    def _get_recommendations_many(self, user_ids, top_n, batch_size, exact):
+        results = {user_id: [] for user_id in user_ids}
+        known = [user_id for user_id in results if user_id in self.matrix]
+        if self.cache is None or exact:
+            results.update(self._recommend_many(known, top_n, batch_size, exact))
+            return results
+        model_version = self.model_version
+        missing = {}
+        for user_id in known:
+            key, cached = self.cache.lookup(model_version, user_id, top_n)
+            if cached is None:
+                missing[user_id] = key
+            else:
+                results[user_id] = cached
+        for user_id, recommended in self._recommend_many(list(missing), top_n, batch_size, exact).items():
+            self.cache.put(missing[user_id], recommended)
+            results[user_id] = recommended
+        return results
 
-recommendations = rec_system.get_recommendations(1, top_n=2)
-print(f"Recommendations for user 1: {recommendations}")
+    def _recommend_many(self, known, top_n, batch_size, exact):
+        # Scores batch_size users at a time with one sparse matrix-matrix product
+        results = {}
+        matrix = self.matrix.csr()
+        if self.index is not None and not exact:
+            for user_id in known:
+                results[user_id] = self._approximate(matrix, user_id, top_n)
+            return results
+        for start in range(0, len(known), batch_size):
+            batch = known[start:start + batch_size]
+            rows = [self.matrix.rows[user_id] for user_id in batch]
+            scores = (matrix[rows] @ matrix.T).toarray()
+            for user_id, row, user_scores in zip(batch, rows, scores):
+                results[user_id] = self._top_n(user_scores, row, top_n)
+        return results
@@ -1,153 +1,609 @@
 import asyncio
+import functools
 import logging
-from libp2p import new_host
-from libp2p.peer.peerinfo import info_from_p2p_addr
-from libp2p.pubsub.pubsub import Pubsub
-from libp2p.pubsub.gossipsub import GossipSub
-from libp2p.network.exceptions import SwarmException
-from src.core.database import add_message, get_recent_messages
+from contextlib import aclosing
+from datetime import datetime, timezone
+from src.core import async_database
+from src.core.channels import DEFAULT_CHANNEL, ChannelRouter, sync_peer_for
+from src.core.database import compute_message_hash
+from src.core.sync_protocol import (SYNC_PROTOCOL_ID, messages_after_handler, request_messages,
+                                    serve_sync_stream)
+from src.core.antientropy import MerkleIndex, antientropy_handlers, reconcile
+from src.core.connections import ConnectionManager, ConnectionNotifee
+from src.core.ingest import BloomFilter, IngestQueue, is_transient
+from src.core.relay import IngestCounters, RelayPolicy
+from src.core.wire import Envelope, decode_payload, encode_batches, encode_envelope
+from src.utils import metrics
+from src.utils.metrics import (DEDUPE_HITS, HANDLE_SECONDS, PEER_FETCH_SECONDS, PUBLISH_SECONDS,
+                               SYNC_ROUND_SECONDS, timed)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# libp2p takes about a second to import, so it is imported when first used
+# rather than with this module: the API, tools and tests import P2PNode
+# without necessarily starting one.
+async def new_host():
+    from libp2p import new_host as create_host
+    return create_host()
+
+def GossipSub(host):
+    from libp2p.pubsub.gossipsub import GossipSub as LibP2PGossipSub
+    return LibP2PGossipSub(host)
+
+def info_from_p2p_addr(peer_addr):
+    from libp2p.peer.peerinfo import info_from_p2p_addr as parse_peer_addr
+    return parse_peer_addr(peer_addr)
+
+def peer_info(peer_addr):
+    # Peers are known by their /.../p2p/<peer id> address, as a string or Multiaddr
+    from multiaddr import Multiaddr
+    return info_from_p2p_addr(Multiaddr(peer_addr) if isinstance(peer_addr, str) else peer_addr)
+
+def watermark_key(peer, channel):
+    # Sync watermarks are kept per peer and channel; the default channel's is
+    # the peer's watermark from before channels
+    return peer if channel == DEFAULT_CHANNEL else f"{peer}#{channel}"
+
 class P2PNode:
-    def __init__(self):
+    def __init__(self, sync_concurrency=8, peer_timeout=10, sync_deadline=60, sync_max_pages=50,
+                 anti_entropy_timeout=300, write_chunk_size=500, relay_policy=None,
+                 ingest_queue_size=10000, ingest_flush_interval=0.25, outbox_size=10000,
+                 publish_flush_interval=0.05, max_dials=4, store=None, channels=None):
         self.host = None
         self.pubsub = None
-        self.peers = set()
-        self.retry_interval = 5  # seconds
-        self.maintain_task = None
+        # Channels this node subscribes to, and the topic each channel is
+        # published on (see channels.py). Every subscribed channel has a gossip
+        # reader once started, and a Merkle index for anti-entropy.
+        self.router = ChannelRouter(channels or (DEFAULT_CHANNEL,))
+        self.subscriptions = {}  # channel -> gossip reader task
+        self.merkle_indexes = {channel: MerkleIndex() for channel in self.router.subscribed()}
+        # Known peers and their connection state, see connections.py
+        self.connections = ConnectionManager(self._dial, max_dials=max_dials)
+        # Sync fan-out: at most sync_concurrency peers are fetched at once, each
+        # fetch is bounded by peer_timeout and the whole round by sync_deadline.
+        self.sync_concurrency = sync_concurrency
+        self.peer_timeout = peer_timeout  # seconds
+        self.sync_deadline = sync_deadline  # seconds
+        self.sync_max_pages = sync_max_pages  # pages pulled from one peer per round
+        self.anti_entropy_timeout = anti_entropy_timeout  # seconds, per peer and per round
+        self.write_chunk_size = write_chunk_size  # synced messages per bulk insert
+        self.peer_stats = {}
+        self.last_sync_report = None
+        self.relay_policy = relay_policy or RelayPolicy()
+        self.counters = IngestCounters()
+        # Incoming gossip is deduped here and persisted in micro-batches
+        self.seen_filter = BloomFilter()
+        self.ingest_queue = IngestQueue(self._persist_gossip, ingest_queue_size, write_chunk_size,
+                                        ingest_flush_interval)
+        self.loop_monitor = None
+        # Messages authored here through enqueue_message, stored and gossiped in micro-batches
+        self.outbox = IngestQueue(self._publish_batch, outbox_size, write_chunk_size, publish_flush_interval,
+                                  name="outgoing messages")
+        # Message storage used on the event loop; anything exposing the
+        # coroutines of async_database works, e.g. memory_store.MemoryStore
+        self.store = store if store is not None else async_database
 
-    async def start(self):
+    async def start(self, host=None, pubsub=None):
+        # host and pubsub default to a new libp2p host with GossipSub; src/sim
+        # passes in-memory ones
         try:
-            self.host = await new_host()
-            self.pubsub = GossipSub(self.host)
-            await self.pubsub.subscribe("cosmicsynccore")
+            self.host = host or await new_host()
+            self.pubsub = pubsub or GossipSub(self.host)
+            self.host.set_stream_handler(SYNC_PROTOCOL_ID, self.handle_sync_stream)
             logger.info(f"P2P node listening on {await self.host.get_addrs()}")
-            self.maintain_task = self.maintain_connections()
-            asyncio.create_task(self.maintain_task)
+            self.host.get_network().register_notifee(ConnectionNotifee(self.connections))
+            self.connections.start()
+            self.ingest_queue.start()
+            self.outbox.start()
+            for channel in self.router.subscribed():
+                await self._subscribe(channel)
+            metrics.bind_node(self)
+            self.loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
         except Exception as e:
             logger.error(f"Failed to start P2P node: {e}")
             raise
 
+    @property
+    def peers(self):
+        return set(self.connections.peers)
+
+    async def set_interests(self, holder, channels):
+        # Replaces the channels holder follows: "node" for the node's own, or a
+        # local user's id for the channels in their profile (channels_from_profile).
+        # Topics are joined and left as the set of channels anyone follows changes.
+        added, removed = self.router.set_interests(holder, channels)
+        for channel in added:
+            self.merkle_indexes[channel] = MerkleIndex()
+            if self.pubsub is not None:
+                await self._subscribe(channel)
+        for channel in removed:
+            self.merkle_indexes.pop(channel, None)
+            if self.pubsub is not None:
+                await self._unsubscribe(channel)
+        if added or removed:
+            logger.info(f"Joined channels {added}, left {removed}")
+        return added, removed
+
+    async def _subscribe(self, channel):
+        subscription = await self.pubsub.subscribe(self.router.topic(channel))
+        self.subscriptions[channel] = asyncio.create_task(self._read_gossip(subscription))
+
+    async def _unsubscribe(self, channel):
+        task = self.subscriptions.pop(channel, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.pubsub.unsubscribe(self.router.topic(channel))
+
     async def stop(self):
-        if self.maintain_task:
-            if isinstance(self.maintain_task, asyncio.Task):
-                self.maintain_task.cancel()
+        await self.connections.stop()
+        for task in (*self.subscriptions.values(), self.loop_monitor):
+            if task:
+                task.cancel()
                 try:
-                    await self.maintain_task
+                    await task
                 except asyncio.CancelledError:
                     pass
-            elif asyncio.iscoroutine(self.maintain_task):
-                # If it's a coroutine, we don't need to do anything
-                pass
+        await self.ingest_queue.stop()
+        await self.outbox.stop()
         if self.host:
             await self.host.close()
         logger.info("P2P node stopped")
 
-    async def publish_message(self, message, user_id):
+    async def publish_message(self, message, user_id, channel=DEFAULT_CHANNEL):
+        # For messages authored on this node: stored once, published once, on
+        # the channel's topic whether or not this node subscribes to it
         try:
-            await self.pubsub.publish("cosmicsynccore", message.encode())
-            add_message(message, user_id)
-            logger.info(f"Message published: {message[:20]}...")
+            with timed(PUBLISH_SECONDS, "single"):
+                timestamp = datetime.now(timezone.utc)
+                content_hash = compute_message_hash(message, user_id, timestamp)
+                self.counters.db_writes += 1
+                await self.store.add_message(message, user_id, timestamp=timestamp, channel=channel)
+                self.counters.messages_originated += 1
+                self.relay_policy.mark_seen(content_hash)
+                self.seen_filter.add(content_hash)
+                envelope = Envelope(content_hash, message, user_id, timestamp, 0, channel)
+                await self.pubsub.publish(self.router.topic(channel), encode_envelope(envelope))
+                self.counters.publishes += 1
+            logger.debug(f"Message published: {message[:20]}...")
         except Exception as e:
             logger.error(f"Failed to publish message: {e}")
             raise
 
+    def enqueue_message(self, message, user_id, timestamp=None, channel=DEFAULT_CHANNEL):
+        # Non-blocking publish_message for request handlers: returns the content hash
+        # at once and leaves storing and gossiping to the outbox worker. Raises
+        # asyncio.QueueFull when the outbox is full.
+        timestamp = timestamp or datetime.now(timezone.utc)
+        content_hash = compute_message_hash(message, user_id, timestamp)
+        self.outbox.put_nowait(Envelope(content_hash, message, user_id, timestamp, 0, channel))
+        return content_hash
+
+    async def publish_messages(self, messages):
+        # Stores (content, user_id, timestamp or None, channel) tuples in one
+        # transaction and gossips them together: one batch frame per channel unless
+        # they exceed MAX_BATCH_BYTES. Returns a (content_hash, status) pair per
+        # message, status being "stored", "duplicate" (already stored) or "failed".
+        # If the transaction fails, each message is retried on its own.
+        envelopes = []
+        for content, user_id, timestamp, channel in messages:
+            timestamp = timestamp or datetime.now(timezone.utc)
+            envelopes.append(Envelope(compute_message_hash(content, user_id, timestamp), content, user_id,
+                                      timestamp, 0, channel))
+        if not envelopes:
+            return []
+        failed = set()
+        try:
+            inserted = await self._publish_batch(envelopes)
+        except Exception as e:
+            logger.warning(f"Failed to publish batch of {len(envelopes)} messages, retrying one at a time: {e}")
+            inserted = set()
+            for envelope in envelopes:
+                try:
+                    inserted |= await self._publish_batch([envelope])
+                except Exception as e:
+                    logger.error(f"Failed to publish message {envelope.content_hash}: {e}")
+                    failed.add(envelope.content_hash)
+        return [(envelope.content_hash,
+                 "failed" if envelope.content_hash in failed else
+                 "stored" if envelope.content_hash in inserted else "duplicate")
+                for envelope in envelopes]
+
+    async def _publish_batch(self, envelopes):
+        # Returns the content hashes of the messages inserted, not already stored
+        with timed(PUBLISH_SECONDS, "batch"):
+            self.counters.db_writes += len(envelopes)
+            inserted = await self.store.insert_messages(envelopes, chunk_size=self.write_chunk_size)
+            self.counters.messages_originated += len(inserted)
+            for envelope in envelopes:
+                self.relay_policy.mark_seen(envelope.content_hash)
+                self.seen_filter.add(envelope.content_hash)
+            by_channel = {}
+            for envelope in envelopes:
+                by_channel.setdefault(envelope.channel, []).append(envelope)
+            for channel, batch in by_channel.items():
+                for frame in encode_batches(batch):
+                    await self.pubsub.publish(self.router.topic(channel), frame)
+            self.counters.publishes += len(envelopes)
+        logger.debug(f"Published {len(envelopes)} messages")
+        return {content_hash for _, content_hash in inserted}
+
+    async def _relay(self, envelope):
+        await self.pubsub.publish(self.router.topic(envelope.channel),
+                                  encode_envelope(envelope._replace(hops=envelope.hops + 1)))
+        self.counters.relays += 1
+
+    async def _read_gossip(self, subscription):
+        # Messages are handled one at a time; when the ingest queue is full,
+        # handle_message waits and the subscription buffers instead.
+        while True:
+            message = await subscription.get()
+            await self.handle_message(message)
+
     async def handle_message(self, message):
         try:
-            decoded_message = message.data.decode()
-            logger.info(f"Received message: {decoded_message[:20]}...")
-            # Here you might want to add logic to store the message in the database
-            # if it's not already there
+            with timed(HANDLE_SECONDS):
+                for envelope in decode_payload(message.data):
+                    await self._accept_envelope(envelope)
         except Exception as e:
             logger.error(f"Failed to handle message: {e}")
 
+    async def _accept_envelope(self, envelope):
+        logger.debug(f"Received message: {envelope.content[:20]}...")
+        if envelope.content_hash is None:
+            # Plain-text payloads carry no author or timestamp to store
+            return
+        if compute_message_hash(envelope.content, envelope.user_id, envelope.timestamp) != envelope.content_hash:
+            logger.warning(f"Dropping message with mismatched hash {envelope.content_hash}")
+            return
+        if envelope.channel not in self.router:
+            # Still in flight from a channel just left, or misrouted
+            logger.debug(f"Dropping message for unsubscribed channel {envelope.channel}")
+            return
+        if not self.relay_policy.mark_seen(envelope.content_hash):
+            self.counters.duplicates_dropped += 1
+            DEDUPE_HITS.labels("seen_cache").inc()
+            return
+        await self.ingest_queue.put(envelope)
+        if self.relay_policy.should_relay(envelope, "gossip"):
+            await self._relay(envelope)
+
+    async def _persist_gossip(self, envelopes):
+        # Only hashes the filter may have seen need a database lookup; the
+        # insert itself also skips anything already stored.
+        maybe_stored = [e.content_hash for e in envelopes if e.content_hash in self.seen_filter]
+        existing_hashes = await self.store.get_existing_hashes(maybe_stored) if maybe_stored else set()
+        fresh = [e for e in envelopes if e.content_hash not in existing_hashes]
+        self.counters.db_writes += len(fresh)
+        inserted_ids = await self.store.add_messages_bulk(fresh, chunk_size=self.write_chunk_size) if fresh else []
+        for envelope in envelopes:
+            self.seen_filter.add(envelope.content_hash)
+        self.counters.messages_ingested += len(inserted_ids)
+        self.counters.duplicates_dropped += len(envelopes) - len(inserted_ids)
+        DEDUPE_HITS.labels("store").inc(len(envelopes) - len(inserted_ids))
+
+    async def discover_channel_peers(self):
+        # Sync only fills in what gossip missed from peers holding the same
+        # channel, and randomly chosen peers may hold none of ours. For each
+        # subscribed channel, the peer sync_peer_for picks among the topic's
+        # peers GossipSub knows of becomes a known peer, so it is dialled and
+        # pulled from. Returns the addresses added.
+        added = []
+        try:
+            local_id = str(self.host.get_id())
+            peerstore = self.host.get_peerstore()
+            for channel in self.router.subscribed():
+                topic_peers = {str(peer_id): peer_id
+                               for peer_id in self.pubsub.peer_topics.get(self.router.topic(channel), ())}
+                topic_peers.pop(local_id, None)
+                peer_id = sync_peer_for(channel, local_id, topic_peers)
+                if peer_id is None or peer_id in self.connections.by_peer_id:
+                    continue
+                addrs = peerstore.addrs(topic_peers[peer_id])
+                if addrs:
+                    addr = f"{addrs[0]}/p2p/{peer_id}"
+                    self.connections.add(addr, peer_id)
+                    added.append(addr)
+        except Exception as e:
+            logger.error(f"Failed to discover channel peers: {e}")
+        if added:
+            logger.info(f"Added channel peers {added}")
+        return added
+
     async def sync_messages(self, limit=100):
+        # limit is the page size requested from each peer; each peer only sends
+        # messages after the watermark we hold for it.
         try:
-            local_messages = get_recent_messages(limit)
-            local_message_ids = set(msg.id for msg in local_messages)
-            print(f"Local message IDs: {local_message_ids}")
-            
-            # Fetch messages from peers
-            peer_messages = []
-            for peer in self.get_connected_peers():
-                try:
-                    peer_msgs = await self.fetch_messages_from_peer(peer, limit)
-                    peer_messages.extend(peer_msgs)
-                except Exception as e:
-                    logger.warning(f"Failed to fetch messages from peer {peer}: {e}")
-            print(f"Fetched {len(peer_messages)} messages from peers")
-            
-            # Deduplicate messages
-            new_message_ids = set()
-            new_messages = []
-            for msg in peer_messages:
-                if msg.id not in local_message_ids and msg.id not in new_message_ids:
-                    new_messages.append(msg)
-                    new_message_ids.add(msg.id)
-            print(f"New messages: {len(new_messages)}")
-            
-            # Sort new messages by timestamp
-            new_messages.sort(key=lambda x: x.timestamp)
-            
-            # Add new messages to the local database
-            for msg in new_messages:
-                add_message(msg.content, msg.user_id)
-            
-            # Publish new messages to the network
-            for msg in new_messages:
-                await self.publish_message(msg.content, msg.user_id)
+            # Fetch messages from peers concurrently and store them as they arrive
+            watermarks = {}
+
+            def record_watermark(peer, peer_msgs):
+                for msg in peer_msgs:
+                    key = watermark_key(peer, msg.channel or DEFAULT_CHANNEL)
+                    if key not in watermarks or msg.id > watermarks[key].id:
+                        watermarks[key] = msg
+
+            fetch = lambda peer: self.fetch_messages_from_peer(peer, limit)
+            with timed(SYNC_ROUND_SECONDS, "sync"):
+                async with aclosing(self._fan_out(fetch, self.peer_timeout, self.sync_deadline)) as results:
+                    stored = await self._ingest(results, on_peer=record_watermark)
+
+                # Only advance watermarks once everything up to them is stored
+                for key, last_msg in watermarks.items():
+                    await self.store.set_sync_watermark(key, last_msg.id, last_msg.timestamp)
             
-            logger.info(f"Synced {len(new_messages)} new messages")
-            return len(new_messages)
+            logger.info(f"Synced {stored} new messages")
+            return stored
         except Exception as e:
             logger.error(f"Failed to sync messages: {e}")
             return 0
 
+    async def anti_entropy(self, leaf_size=64):
+        # Full reconciliation with every connected peer; for peers the watermark
+        # sync cannot catch up cheaply, e.g. after a long partition.
+        try:
+            with timed(SYNC_ROUND_SECONDS, "anti_entropy"):
+                await self.refresh_merkle_index()
+                fetch = lambda peer: self.reconcile_with_peer(peer, leaf_size)
+                async with aclosing(self._fan_out(fetch, self.anti_entropy_timeout,
+                                                  self.anti_entropy_timeout)) as results:
+                    stored = await self._ingest(results)
+                await self.refresh_merkle_index()
+            logger.info(f"Anti-entropy stored {stored} missing messages")
+            return stored
+        except Exception as e:
+            logger.error(f"Failed to run anti-entropy: {e}")
+            return 0
+
+    async def _ingest(self, results, on_peer=None):
+        # Dedupes across peers and writes once write_chunk_size messages are
+        # pending, as peer results arrive. Each peer's page arrives whole, so
+        # memory is bounded by a page plus a chunk, not by the round.
+        seen_hashes = set()
+        pending = []
+        fetched = 0
+        stored = 0
+        async for peer, peer_msgs in results:
+            fetched += len(peer_msgs)
+            for msg in peer_msgs:
+                if (msg.channel or DEFAULT_CHANNEL) not in self.router:
+                    # Peers that predate channels send every channel
+                    continue
+                content_hash = compute_message_hash(msg.content, msg.user_id, msg.timestamp)
+                if content_hash not in seen_hashes:
+                    seen_hashes.add(content_hash)
+                    pending.append(msg)
+                else:
+                    self.counters.duplicates_dropped += 1
+                    DEDUPE_HITS.labels("sync_round").inc()
+            if on_peer is not None:
+                on_peer(peer, peer_msgs)
+            if len(pending) >= self.write_chunk_size:
+                stored += len(await self._store_new_messages(pending))
+                pending = []
+        if pending:
+            stored += len(await self._store_new_messages(pending))
+        logger.debug(f"Fetched {fetched} messages from peers")
+        return stored
+
+    async def _store_new_messages(self, messages):
+        # Drop messages we already hold (e.g. received from another peer)
+        by_hash = {compute_message_hash(msg.content, msg.user_id, msg.timestamp): msg for msg in messages}
+        existing_hashes = await self.store.get_existing_hashes(by_hash.keys())
+        new_messages = [msg for content_hash, msg in by_hash.items() if content_hash not in existing_hashes]
+
+        # Sort new messages by timestamp
+        new_messages.sort(key=lambda x: x.timestamp)
+            
+        # Add new messages to the local database in one transaction. They are not
+        # re-published: their author already gossiped them (see RelayPolicy).
+        self.counters.db_writes += len(new_messages)
+        rejected = set()
+        try:
+            inserted_ids = await self.store.add_messages_bulk(new_messages, chunk_size=self.write_chunk_size)
+        except Exception as e:
+            if is_transient(e):
+                raise
+            # One row the database refuses, e.g. by an author this node has never
+            # seen, fails its whole chunk. Store the rest one at a time and drop
+            # the refused rows, so the sync watermark can move past them rather
+            # than the same page failing against this peer forever.
+            logger.warning(f"Failed to store {len(new_messages)} synced messages, storing them one at a time: {e}")
+            inserted_ids = []
+            for msg in new_messages:
+                self.counters.db_writes += 1
+                try:
+                    inserted_ids.extend(await self.store.add_messages_bulk([msg], chunk_size=1))
+                except Exception as e:
+                    if is_transient(e):
+                        raise
+                    rejected.add(compute_message_hash(msg.content, msg.user_id, msg.timestamp))
+                    logger.warning(f"Dropped synced message from user {msg.user_id}: {e}")
+            self.counters.messages_rejected += len(rejected)
+        self.counters.messages_ingested += len(inserted_ids)
+        self.counters.duplicates_dropped += len(messages) - len(inserted_ids) - len(rejected)
+        DEDUPE_HITS.labels("store").inc(len(messages) - len(inserted_ids) - len(rejected))
+
+        for content_hash, msg in by_hash.items():
+            if content_hash in rejected:
+                continue
+            self.seen_filter.add(content_hash)
+            if content_hash in existing_hashes or not self.relay_policy.mark_seen(content_hash):
+                continue
+            envelope = Envelope(content_hash, msg.content, msg.user_id, msg.timestamp, 0,
+                                msg.channel or DEFAULT_CHANNEL)
+            if self.relay_policy.should_relay(envelope, "sync"):
+                await self._relay(envelope)
+        return inserted_ids
+
+    async def _fan_out(self, fetch, peer_timeout, deadline):
+        peers = self.get_connected_peers()
+        report = {"peers": len(peers), "succeeded": 0, "failed": 0, "timed_out": 0}
+        self.last_sync_report = report
+        if not peers:
+            report["duration"] = 0.0
+            return
+
+        # Timed on the loop's clock, which is simulated time under src/sim
+        loop = asyncio.get_running_loop()
+        round_started = loop.time()
+        semaphore = asyncio.Semaphore(max(1, self.sync_concurrency))
+
+        async def fetch_one(peer):
+            async with semaphore:
+                started = loop.time()
+                try:
+                    msgs = await asyncio.wait_for(fetch(peer), peer_timeout)
+                except asyncio.TimeoutError:
+                    self._record_peer_fetch(peer, loop.time() - started, error="timeout",
+                                            outcome="timeout")
+                    report["timed_out"] += 1
+                    raise
+                except Exception as e:
+                    self._record_peer_fetch(peer, loop.time() - started, error=str(e))
+                    report["failed"] += 1
+                    raise
+                self._record_peer_fetch(peer, loop.time() - started)
+                report["succeeded"] += 1
+                return peer, msgs
+
+        deadline = loop.time() + deadline
+        tasks = {asyncio.ensure_future(fetch_one(peer)): peer for peer in peers}
+        pending = set(tasks)
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                # In peer order rather than set order, so simulated runs are reproducible
+                for task in [task for task in tasks if task in done]:
+                    # Failures were already recorded in fetch_one()
+                    if task.cancelled() or task.exception() is not None:
+                        continue
+                    peer, msgs = task.result()
+                    yield peer, msgs or []
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            report["duration"] = loop.time() - round_started
+            for task in pending:
+                self._record_peer_fetch(tasks[task], report["duration"],
+                                        error="sync deadline exceeded", outcome="timeout")
+                report["timed_out"] += 1
+            logger.info(
+                f"Sync round fetched from {report['succeeded']}/{report['peers']} peers "
+                f"({report['failed']} failed, {report['timed_out']} timed out) "
+                f"in {report['duration']:.2f}s")
+
+    def _record_peer_fetch(self, peer, latency, error=None, outcome=None):
+        # outcome labels the fetch histogram: ok, error or timeout
+        PEER_FETCH_SECONDS.labels(outcome or ("ok" if error is None else "error")).observe(latency)
+        stats = self.peer_stats.setdefault(
+            peer, {"fetches": 0, "failures": 0, "last_latency": None,
+                   "avg_latency": None, "last_error": None})
+        stats["fetches"] += 1
+        stats["last_latency"] = latency
+        if stats["avg_latency"] is None:
+            stats["avg_latency"] = latency
+        else:
+            stats["avg_latency"] = 0.8 * stats["avg_latency"] + 0.2 * latency
+        if error is not None:
+            stats["failures"] += 1
+            stats["last_error"] = error
+            self.connections.record_error(peer)
+            logger.warning(f"Failed to fetch messages from peer {peer}: {error}")
+        else:
+            self.connections.record_rtt(peer, latency)
+
+    def get_peer_stats(self):
+        stats = {peer: dict(stats) for peer, stats in self.peer_stats.items()}
+        for peer, connection in self.connections.stats().items():
+            stats.setdefault(peer, {})["connection"] = connection
+        return stats
+
     async def fetch_messages_from_peer(self, peer, limit):
-        # This method should be implemented to fetch messages from a specific peer
-        # For now, we'll return an empty list
-        return []
+        # Pulls everything the peer stored after our watermarks for it in the
+        # channels we subscribe to, in pages of limit messages, oldest first,
+        # one channel after the other over one stream.
+        after_ids = {}
+        for channel in self.router.subscribed():
+            watermark = await self.store.get_sync_watermark(watermark_key(peer, channel))
+            after_ids[channel] = watermark.message_id if watermark else None
+        info = peer_info(peer)
+        stream = await self.host.new_stream(info.peer_id, [SYNC_PROTOCOL_ID])
+        messages = []
+        try:
+            for channel, after_id in after_ids.items():
+                async for page in request_messages(stream, after_id, limit, self.sync_max_pages, channel):
+                    messages.extend(page)
+        finally:
+            await stream.close()
+        return messages
 
-    async def connect_to_peer(self, peer_addr):
+    async def reconcile_with_peer(self, peer, leaf_size=64):
+        # Reconciles each subscribed channel in turn, over one stream
+        info = peer_info(peer)
+        stream = await self.host.new_stream(info.peer_id, [SYNC_PROTOCOL_ID])
+        messages = []
+        missing = round_trips = 0
         try:
-            peer_info = info_from_p2p_addr(peer_addr)
-            await self.host.connect(peer_info)
-            self.peers.add(peer_addr)
-            logger.info(f"Connected to peer: {peer_addr}")
-        except SwarmException as e:
-            logger.warning(f"Failed to connect to peer {peer_addr}: {e}")
-
-    async def maintain_connections(self):
-        while True:
-            disconnected_peers = set()
-            for peer in self.peers:
-                if not self.host.get_network().is_connected(peer):
-                    disconnected_peers.add(peer)
-            
-            for peer in disconnected_peers:
-                self.peers.remove(peer)
-                asyncio.create_task(self.connect_to_peer(peer))
-            
-            await asyncio.sleep(self.retry_interval)
+            for channel, index in list(self.merkle_indexes.items()):
+                stats = {}
+                hashes_with_prefix = functools.partial(self.store.get_message_hashes_with_prefix, channel=channel)
+                async for page in reconcile(stream, index, hashes_with_prefix, leaf_size, stats, channel):
+                    messages.extend(page)
+                missing += stats['missing']
+                round_trips += stats['round_trips']
+        finally:
+            await stream.close()
+        logger.info(f"Reconciled with peer {peer}: {missing} missing messages "
+                    f"in {round_trips} round-trips")
+        return messages
+
+    async def refresh_merkle_index(self, channel=None):
+        # The index of channel, or of every subscribed channel
+        channels = [channel] if channel is not None else list(self.merkle_indexes)
+        for channel in channels:
+            index = self.merkle_indexes.get(channel)
+            if index is not None:
+                await index.refresh(functools.partial(self.store.get_message_hashes_after, channel=channel))
+
+    async def handle_sync_stream(self, stream):
+        handlers = {"messages_after": messages_after_handler(self.store.get_messages_after)}
+        handlers.update(antientropy_handlers(self.merkle_indexes, self.store.get_message_hashes_with_prefix,
+                                             self.store.get_messages_by_hashes,
+                                             refresh=self.refresh_merkle_index))
+        await serve_sync_stream(stream, handlers)
+
+    async def _dial(self, peer_addr):
+        await self.host.connect(peer_info(peer_addr))
+
+    async def connect_to_peer(self, peer_addr):
+        # Returns whether the peer is connected; a peer that fails stays known
+        # and is redialled with backoff
+        peer_id = str(peer_info(peer_addr).peer_id)
+        return await self.connections.connect(peer_addr, peer_id)
 
     async def add_peer(self, peer_addr):
-        if peer_addr not in self.peers:
+        if peer_addr not in self.connections:
             await self.connect_to_peer(peer_addr)
 
     def get_connected_peers(self):
-        return [peer for peer in self.peers if self.host.get_network().is_connected(peer)]
+        # Healthiest first, so sync rounds start with the fastest peers
+        return self.connections.connected_peers()
 
 async def run_node():
     node = P2PNode()
     await node.start()
 
-    def message_handler(message):
-        asyncio.create_task(node.handle_message(message))
-
-    node.pubsub.subscribe("cosmicsynccore", message_handler)
-
     try:
         while True:
             message = await asyncio.get_event_loop().run_in_executor(None, input, "Enter a message to publish: ")
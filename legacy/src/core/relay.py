@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+
+
+class SeenCache:
+    """Bounded set of recently seen content hashes, each remembered for ttl seconds."""
+
+    def __init__(self, ttl=600, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expiry = OrderedDict()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, content_hash):
+        expiry = self._expiry.get(content_hash)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del self._expiry[content_hash]
+            return False
+        return True
+
+    def add(self, content_hash):
+        # Returns True if the hash was not already in the cache
+        is_new = content_hash not in self
+        self._expiry[content_hash] = time.monotonic() + self.ttl
+        self._expiry.move_to_end(content_hash)
+        self._evict()
+        return is_new
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._expiry:
+            content_hash, expiry = next(iter(self._expiry.items()))
+            if expiry >= now and len(self._expiry) <= self.max_size:
+                break
+            del self._expiry[content_hash]
+
+
+class RelayPolicy:
+    # Decides whether a message this node did not author is re-published. Callers
+    # check mark_seen() first so each message is considered at most once per TTL.
+    #
+    # GossipSub already floods every published message across the mesh, so by
+    # default nothing is relayed: messages pulled by sync were gossiped by their
+    # author already, and re-publishing them only creates a gossip storm. Relaying
+    # can be enabled per source; it is then limited to max_hops relays per
+    # message and to once per seen-cache TTL on each node.
+    def __init__(self, relay_gossip=False, relay_synced=False, max_hops=3, seen_ttl=600,
+                 seen_max_size=100000):
+        self.relay_gossip = relay_gossip
+        self.relay_synced = relay_synced
+        self.max_hops = max_hops
+        self.seen = SeenCache(seen_ttl, seen_max_size)
+
+    def mark_seen(self, content_hash):
+        return self.seen.add(content_hash)
+
+    def should_relay(self, envelope, source):
+        enabled = self.relay_gossip if source == "gossip" else self.relay_synced
+        return enabled and envelope.content_hash is not None and envelope.hops < self.max_hops
+
+
+class IngestCounters:
+    # Counts writes and publishes against the messages they concern, so that
+    # write_amplification and publish_amplification can be checked to be 1.
+    # db_writes counts every row sent to the store, as attempted: rows retried
+    # after a failed transaction, and rows the insert skipped as already
+    # stored, count as writes too, without adding a stored message.
+    def __init__(self):
+        self.messages_originated = 0  # authored on this node and stored
+        self.messages_ingested = 0  # new messages pulled from peers and stored
+        self.db_writes = 0  # message rows sent to the store
+        self.publishes = 0  # pubsub publishes of authored messages
+        self.relays = 0  # pubsub publishes of other nodes' messages
+        self.duplicates_dropped = 0
+        self.messages_rejected = 0  # pulled messages the store refused, e.g. by unknown authors
+
+    @property
+    def write_amplification(self):
+        stored = self.messages_originated + self.messages_ingested
+        return self.db_writes / stored if stored else 0.0
+
+    @property
+    def publish_amplification(self):
+        return self.publishes / self.messages_originated if self.messages_originated else 0.0
+
+    def as_dict(self):
+        counters = dict(vars(self))
+        counters["write_amplification"] = self.write_amplification
+        counters["publish_amplification"] = self.publish_amplification
+        return counters
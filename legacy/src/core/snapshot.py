@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.core.ml import RecommendationSystem, UserMatrix
+
+logger = logging.getLogger(__name__)
+
+# On-disk snapshots of a fitted RecommendationSystem.
+#
+#     <root>/CURRENT                  name of the live version
+#     <root>/<version>/manifest.json  parameters and the array index below
+#     <root>/<version>/<name>.npy     one raw array per file
+#
+# Arrays are plain .npy files so they can be memory-mapped: every process that
+# loads the same version shares one copy of its pages through the page cache.
+# Mappings are copy-on-write, so a loaded model can still be updated in-process
+# without touching the files. Interest text is not stored, only vectors and
+# document frequencies. A version directory is complete before CURRENT
+# names it, and CURRENT is replaced atomically, so readers never see a partial
+# snapshot.
+SNAPSHOT_FORMAT = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _new_version():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_versions(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if os.path.isfile(os.path.join(root, name, MANIFEST_FILE)))
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(root, version=None):
+    version = version or current_version(root)
+    if version is None:
+        raise SnapshotError(f"No snapshot in {root}")
+    try:
+        with open(os.path.join(root, version, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"Unreadable snapshot {version}: {e}")
+
+
+def save_snapshot(rec_system, root, keep=3, metadata=None):
+    """Write rec_system as a new version under root, make it current and return its name.
+
+    metadata is stored in the manifest as is; it must be JSON-serializable.
+    """
+    # Dropping inactive rows first leaves only plain arrays to write
+    rec_system.matrix.compact()
+    matrix = rec_system.matrix
+    version = _new_version()
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = os.path.join(root, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    arrays = {
+        "counts": matrix.counts[:matrix.nnz],
+        "data": matrix.data[:matrix.nnz],
+        "indices": matrix.indices[:matrix.nnz],
+        "indptr": matrix.indptr[:matrix.n_rows + 1],
+        "document_frequency": rec_system.document_frequency,
+    }
+    user_ids = matrix.user_ids
+    if all(isinstance(user_id, int) for user_id in user_ids):
+        arrays["user_ids"] = np.array(user_ids, dtype=np.int64)
+    else:
+        with open(os.path.join(tmp_dir, "user_ids.json"), "w") as f:
+            json.dump(user_ids, f)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "n_features": matrix.n_features,
+        "idf_refresh_ratio": rec_system.idf_refresh_ratio,
+        "idf_documents": rec_system.idf_documents,
+        "users": len(user_ids),
+        "arrays": {name: {"dtype": str(array.dtype), "shape": list(array.shape)}
+                   for name, array in arrays.items()},
+        "metadata": metadata or {},
+    }
+    _write_atomic(os.path.join(tmp_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+    os.rename(tmp_dir, os.path.join(root, version))
+    _write_atomic(os.path.join(root, CURRENT_FILE), version)
+    rec_system.version = version
+
+    for old in list_versions(root)[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    logger.info(f"Saved recommendation snapshot {version} with {len(user_ids)} users")
+    return version
+
+
+def load_snapshot(root, version=None, mmap=True, index=None, cache=None):
+    """Load a version (the current one by default) into a RecommendationSystem."""
+    manifest = read_manifest(root, version)
+    version = manifest["version"]
+    path = os.path.join(root, version)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format: {manifest.get('format')}")
+
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c" if mmap else None)
+        if list(array.shape) != spec["shape"] or str(array.dtype) != spec["dtype"]:
+            raise SnapshotError(f"Snapshot {version} array {name} does not match its manifest")
+        arrays[name] = array
+    if "user_ids" in arrays:
+        user_ids = arrays.pop("user_ids").tolist()
+    else:
+        with open(os.path.join(path, "user_ids.json")) as f:
+            user_ids = json.load(f)
+
+    rec_system = RecommendationSystem(n_features=manifest["n_features"],
+                                      idf_refresh_ratio=manifest["idf_refresh_ratio"], index=index,
+                                      cache=cache)
+    matrix = UserMatrix(manifest["n_features"], capacity=0, row_capacity=0)
+    matrix.counts, matrix.data, matrix.indices = arrays["counts"], arrays["data"], arrays["indices"]
+    matrix.indptr = arrays["indptr"]
+    matrix.active = np.ones(len(user_ids), dtype=bool)
+    matrix.user_ids = user_ids
+    matrix.rows = {user_id: row for row, user_id in enumerate(user_ids)}
+    matrix.nnz = len(matrix.indices)
+    rec_system.matrix = matrix
+    rec_system.document_frequency = arrays["document_frequency"]
+    rec_system.idf_documents = manifest["idf_documents"]
+    rec_system.version = version
+    if index is not None:
+        index.add_many(user_ids, matrix.csr())
+    return rec_system
+
+
+class SnapshotReader:
+    """Serves the current snapshot of root and swaps to newer ones as they are published.
+
+    Request handlers read .model once per request; refresh() loads a new version
+    in full before the reference is replaced, so a request sees either the old or
+    the new model, never a mix.
+    """
+
+    def __init__(self, root, mmap=True, index_factory=None, cache=None, refresh_interval=5):
+        self.root = root
+        self.mmap = mmap
+        self.index_factory = index_factory
+        # Shared by every version loaded; entries are keyed by version
+        self.cache = cache
+        self.refresh_interval = refresh_interval  # seconds between maybe_refresh() checks
+        self.model = None
+        self._lock = threading.Lock()
+        self._checked_at = None
+
+    @property
+    def version(self):
+        return self.model.version if self.model is not None else None
+
+    def refresh(self):
+        # Returns True when a newer snapshot was swapped in
+        version = current_version(self.root)
+        if version is None or version == self.version:
+            return False
+        with self._lock:
+            if version == self.version:
+                return False
+            index = self.index_factory() if self.index_factory else None
+            self.model = load_snapshot(self.root, version, mmap=self.mmap, index=index, cache=self.cache)
+        logger.info(f"Loaded recommendation snapshot {version}")
+        return True
+
+    def maybe_refresh(self):
+        # refresh(), at most once per refresh_interval; cheap enough to call per request
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return False
+        self._checked_at = now
+        return self.refresh()
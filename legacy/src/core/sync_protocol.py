@@ -0,0 +1,151 @@
+import json
+import logging
+import struct
+from datetime import datetime
+
+from src.core.channels import DEFAULT_CHANNEL, normalize_channel
+from src.core.database import Message, compute_message_hash
+
+logger = logging.getLogger(__name__)
+
+# Request/response protocol used by sync_messages to pull messages from a peer.
+#
+# The requester opens a stream and sends one request per page:
+#     {"op": "messages_after", "after": <peer message id or null>, "limit": <page size>,
+#      "channel": <channel>}
+# and the peer answers each one with:
+#     {"messages": [<message>, ...], "has_more": <bool>}
+# Cursors are the serving peer's own insertion ids, so a requester only needs to
+# remember the last id it stored from each peer, per channel (its watermarks),
+# to resume. Requests without a channel, from nodes that predate channels, page
+# through every channel.
+# Other ops (see antientropy.py) share the same framing; the serving side maps
+# each op to a coroutine handler returning the response payload.
+SYNC_PROTOCOL_ID = "/cosmicsynccore/sync/1.0.0"
+
+MAX_PAGE_SIZE = 1000
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+_LENGTH = struct.Struct(">I")
+
+
+class SyncProtocolError(Exception):
+    pass
+
+
+async def _read_exactly(stream, n):
+    data = b""
+    while len(data) < n:
+        chunk = await stream.read(n - len(data))
+        if not chunk:
+            if data:
+                raise SyncProtocolError("Stream closed mid-frame")
+            return None
+        data += chunk
+    return data
+
+
+async def write_frame(stream, payload):
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    if len(body) > MAX_FRAME_SIZE:
+        raise SyncProtocolError(f"Frame of {len(body)} bytes exceeds {MAX_FRAME_SIZE}")
+    await stream.write(_LENGTH.pack(len(body)) + body)
+
+
+async def read_frame(stream):
+    header = await _read_exactly(stream, _LENGTH.size)
+    if header is None:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise SyncProtocolError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+    body = await _read_exactly(stream, length)
+    if body is None:
+        raise SyncProtocolError("Stream closed mid-frame")
+    return json.loads(body)
+
+
+def message_to_dict(message):
+    timestamp = message.timestamp
+    return {
+        "id": message.id,
+        "content": message.content,
+        "user_id": message.user_id,
+        "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+        "hash": message.content_hash,
+        "channel": getattr(message, "channel", None) or DEFAULT_CHANNEL,
+    }
+
+
+def message_from_dict(data):
+    timestamp = data.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    try:
+        channel = normalize_channel(data.get("channel"))
+    except ValueError as e:
+        raise SyncProtocolError(str(e))
+    # The hash is recomputed rather than trusted from the peer
+    return Message(id=data["id"], content=data["content"], user_id=data["user_id"],
+                   timestamp=timestamp,
+                   content_hash=compute_message_hash(data["content"], data["user_id"], timestamp),
+                   channel=channel)
+
+
+async def call(stream, op, **params):
+    await write_frame(stream, {"op": op, **params})
+    response = await read_frame(stream)
+    if response is None:
+        raise SyncProtocolError("Peer closed the stream without answering")
+    if "error" in response:
+        raise SyncProtocolError(response["error"])
+    return response
+
+
+async def request_messages(stream, after_id, page_size, max_pages, channel=DEFAULT_CHANNEL):
+    """Yield pages of messages in channel newer than after_id until the peer has no more."""
+    for _ in range(max_pages):
+        response = await call(stream, "messages_after", after=after_id, limit=page_size, channel=channel)
+        page = [message_from_dict(data) for data in response.get("messages", [])]
+        if page:
+            after_id = page[-1].id
+            yield page
+        if not response.get("has_more") or not page:
+            return
+
+
+def messages_after_handler(get_messages_after):
+    async def handle(request):
+        limit = max(1, min(int(request.get("limit") or MAX_PAGE_SIZE), MAX_PAGE_SIZE))
+        channel = request.get("channel")
+        if channel is not None:
+            channel = normalize_channel(channel)
+        # Fetch one extra row to tell the requester whether to keep paging
+        messages = await get_messages_after(request.get("after"), limit + 1, channel=channel)
+        return {
+            "messages": [message_to_dict(msg) for msg in messages[:limit]],
+            "has_more": len(messages) > limit,
+        }
+    return handle
+
+
+async def serve_sync_stream(stream, handlers):
+    """Answer sync requests on stream until the requester closes it."""
+    try:
+        while True:
+            request = await read_frame(stream)
+            if request is None:
+                return
+            handler = handlers.get(request.get("op"))
+            if handler is None:
+                await write_frame(stream, {"error": f"Unknown op: {request.get('op')}"})
+                continue
+            try:
+                response = await handler(request)
+            except Exception as e:
+                logger.warning(f"Sync request {request.get('op')} failed: {e}")
+                response = {"error": "Request failed"}
+            await write_frame(stream, response)
+    except Exception as e:
+        logger.warning(f"Sync stream failed: {e}")
+    finally:
+        await stream.close()
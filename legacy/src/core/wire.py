@@ -0,0 +1,147 @@
+import struct
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import msgpack
+
+from src.core.channels import DEFAULT_CHANNEL, normalize_channel
+
+try:
+    import zstandard
+except ImportError:  # compression is optional
+    zstandard = None
+
+# Pubsub payload for a message. hops counts application-level relays
+# (see relay.py); GossipSub's own mesh forwarding does not increment it.
+Envelope = namedtuple("Envelope", ["content_hash", "content", "user_id", "timestamp", "hops", "channel"],
+                      defaults=[DEFAULT_CHANNEL])
+
+# Frame layout:
+#     0xff | version (1 byte) | flags (1 byte) | body
+# The body is msgpack; with FLAG_BATCH it is a list of envelopes, otherwise a
+# single one, and with FLAG_ZSTD it is zstd-compressed. Each envelope is the array
+#     [hash (32 raw bytes), content, user_id, timestamp (us since epoch, UTC), hops, channel]
+# Nodes that predate channels send five fields and ignore the sixth; their
+# messages are in the default channel.
+# 0xff never starts valid UTF-8, which tells frames apart from the plain-text
+# payloads older nodes publish.
+MAGIC = 0xFF
+WIRE_VERSION = 2
+FLAG_ZSTD = 0x01
+FLAG_BATCH = 0x02
+_HEADER = struct.Struct(">BBB")
+
+COMPRESSION_THRESHOLD = 1024  # bytes of msgpack body
+MAX_BATCH_BYTES = 256 * 1024  # keep batch frames well under the pubsub message size limit
+MAX_DECOMPRESSED_SIZE = 4 * 1024 * 1024
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class WireFormatError(Exception):
+    pass
+
+
+def _timestamp_to_wire(timestamp):
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _timestamp_from_wire(value):
+    if value is None:
+        return None
+    seconds, microseconds = divmod(value, 1000000)
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(microsecond=microseconds)
+
+
+def _pack(envelope):
+    content_hash = bytes.fromhex(envelope.content_hash) if envelope.content_hash else None
+    return [content_hash, envelope.content, envelope.user_id,
+            _timestamp_to_wire(envelope.timestamp), envelope.hops, envelope.channel]
+
+
+def _unpack(fields):
+    if not isinstance(fields, list) or len(fields) < 5:
+        raise WireFormatError("Malformed envelope")
+    content_hash, content, user_id, timestamp, hops = fields[:5]
+    try:
+        channel = normalize_channel(fields[5] if len(fields) > 5 else None)
+    except ValueError as e:
+        raise WireFormatError(str(e))
+    return Envelope(content_hash.hex() if content_hash is not None else None, content, user_id,
+                    _timestamp_from_wire(timestamp), hops, channel)
+
+
+def _frame(body, flags, compress):
+    if compress and zstandard is not None and len(body) > COMPRESSION_THRESHOLD:
+        compressed = zstandard.ZstdCompressor().compress(body)
+        if len(compressed) < len(body):
+            body, flags = compressed, flags | FLAG_ZSTD
+    return _HEADER.pack(MAGIC, WIRE_VERSION, flags) + body
+
+
+def encode_envelope(envelope, compress=True):
+    return _frame(msgpack.packb(_pack(envelope), use_bin_type=True), 0, compress)
+
+
+def encode_batch(envelopes, compress=True):
+    return _frame(msgpack.packb([_pack(e) for e in envelopes], use_bin_type=True), FLAG_BATCH, compress)
+
+
+def encode_batches(envelopes, compress=True, max_bytes=MAX_BATCH_BYTES):
+    # Splits envelopes into as few batch frames as fit max_bytes (before compression)
+    batch, size = [], 0
+    for envelope in envelopes:
+        packed = _pack(envelope)
+        packed_size = len(msgpack.packb(packed, use_bin_type=True))
+        if batch and size + packed_size > max_bytes:
+            yield _frame(msgpack.packb(batch, use_bin_type=True), FLAG_BATCH, compress)
+            batch, size = [], 0
+        batch.append(packed)
+        size += packed_size
+    if batch:
+        yield _frame(msgpack.packb(batch, use_bin_type=True), FLAG_BATCH, compress)
+
+
+def decode_payload(data):
+    """Decode a pubsub payload into a list of envelopes."""
+    if not data or data[0] != MAGIC:
+        # Plain UTF-8 text from nodes that predate envelopes; no metadata
+        return [Envelope(None, bytes(data).decode(), None, None, 0)]
+    if len(data) < _HEADER.size:
+        raise WireFormatError("Truncated frame header")
+    _, version, flags = _HEADER.unpack_from(data)
+    if version != WIRE_VERSION:
+        raise WireFormatError(f"Unsupported wire version: {version}")
+    body = bytes(data[_HEADER.size:])
+    if flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise WireFormatError("Compressed frame received but zstandard is not installed")
+        try:
+            if zstandard.frame_content_size(body) > MAX_DECOMPRESSED_SIZE:
+                raise WireFormatError("Compressed frame too large")
+            body = zstandard.ZstdDecompressor().decompress(body, max_output_size=MAX_DECOMPRESSED_SIZE)
+        except zstandard.ZstdError as e:
+            raise WireFormatError(f"Invalid compressed frame: {e}")
+    try:
+        decoded = msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise WireFormatError(f"Invalid frame body: {e}")
+    if flags & FLAG_BATCH:
+        if not isinstance(decoded, list):
+            raise WireFormatError("Malformed batch")
+        return [_unpack(fields) for fields in decoded]
+    return [_unpack(decoded)]
+
+
+def decode_envelope(data):
+    envelopes = decode_payload(data)
+    if len(envelopes) != 1:
+        raise WireFormatError(f"Expected a single envelope, got {len(envelopes)}")
+    return envelopes[0]
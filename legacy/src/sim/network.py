@@ -0,0 +1,294 @@
+import asyncio
+import selectors
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from libp2p.peer.id import ID
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop on simulated time: whenever every task is waiting, the clock
+    jumps to the next timer instead of sleeping until it.
+
+    Simulated seconds cost only the work done in them, and a run does not
+    depend on how fast the machine is. Only usable for code that does no real
+    I/O, such as nodes on a SimNetwork.
+    """
+
+    def __init__(self):
+        super().__init__(selector=_ClockSelector(self))
+        self._now = 0.0
+
+    def time(self):
+        return self._now
+
+
+class _ClockSelector(selectors.DefaultSelector):
+    # The loop still owns a self-pipe for call_soon_threadsafe, so real
+    # readiness is polled; the wait itself becomes a clock jump
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events:
+            if timeout is None:
+                raise RuntimeError("Simulation stalled: no task is runnable and no timer is pending")
+            self.loop._now += timeout
+        return events
+
+
+class GossipMessage(NamedTuple):
+    data: bytes
+    from_peer: str
+
+
+class Traffic:
+    # Per-node counters, in messages and bytes
+    def __init__(self):
+        self.gossip_received = 0
+        self.gossip_bytes_in = 0
+        self.gossip_bytes_out = 0
+        self.sync_bytes_in = 0
+        self.sync_bytes_out = 0
+        self.streams_opened = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class SimNetwork:
+    """In-memory transport and pubsub for P2PNodes in one event loop.
+
+    Nodes are connected by links with latency (seconds, plus up to jitter more,
+    drawn per delivery) and loss (the chance a gossip delivery or a stream open
+    is dropped). A node can be taken down, and the network partitioned into
+    groups; either closes the links affected, with libp2p's disconnected events,
+    and makes new ones fail until it is reverted.
+
+    Gossip is delivered straight to every reachable subscriber, without a mesh:
+    hop counts are lower than GossipSub's, but what each node receives is the
+    same, so per-node inbound load is comparable.
+    """
+
+    def __init__(self, rng, latency=0.05, jitter=0.05, loss=0.0):
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.hosts = {}  # peer id -> SimHost
+        self.links = set()  # frozensets of two peer ids
+        self.down = set()
+        self.group_of = {}  # peer id -> partition group; empty when not partitioned
+
+    def add_host(self, index):
+        host = SimHost(self, index)
+        self.hosts[host.peer_id] = host
+        return host
+
+    def delay(self):
+        return self.latency + self.jitter * self.rng.random()
+
+    def addrs(self, peer_id):
+        # The peerstore's view: where a peer listens, without its /p2p part
+        return [self.hosts[str(peer_id)].listen_addr]
+
+    def dropped(self):
+        return self.loss > 0 and self.rng.random() < self.loss
+
+    def reachable(self, a, b):
+        if a in self.down or b in self.down:
+            return False
+        return self.group_of.get(a) == self.group_of.get(b)
+
+    async def _link(self, a, b):
+        await asyncio.sleep(2 * self.delay())
+        if not self.reachable(a, b):
+            raise ConnectionError(f"Peer {b} is unreachable")
+        link = frozenset((a, b))
+        if link not in self.links:
+            self.links.add(link)
+            await self.hosts[a].notify("connected", b)
+            await self.hosts[b].notify("connected", a)
+
+    async def _cut_links(self):
+        for link in sorted(self.links, key=sorted):
+            a, b = sorted(link)
+            if not self.reachable(a, b):
+                self.links.discard(link)
+                await self.hosts[a].notify("disconnected", b)
+                await self.hosts[b].notify("disconnected", a)
+
+    async def partition(self, groups):
+        # groups: lists of peer ids; peers in different groups cannot reach each other
+        self.group_of = {peer_id: i for i, group in enumerate(groups) for peer_id in group}
+        await self._cut_links()
+
+    def heal(self):
+        self.group_of = {}
+
+    async def set_down(self, peer_id, down=True):
+        if down:
+            self.down.add(peer_id)
+            await self._cut_links()
+        else:
+            self.down.discard(peer_id)
+
+    def publish(self, sender, topic, data):
+        for peer_id, host in self.hosts.items():
+            queue = host.subscriptions.get(topic)
+            if peer_id == sender or queue is None or not self.reachable(sender, peer_id):
+                continue
+            self.hosts[sender].traffic.gossip_bytes_out += len(data)
+            if self.dropped():
+                continue
+            asyncio.get_running_loop().call_later(self.delay(), self._deliver, host, queue, data, sender)
+
+    def _deliver(self, host, queue, data, sender):
+        if host.peer_id in self.down:
+            return
+        host.traffic.gossip_received += 1
+        host.traffic.gossip_bytes_in += len(data)
+        queue.put_nowait(GossipMessage(data, sender))
+
+    async def open_stream(self, sender, peer_id, protocols):
+        await asyncio.sleep(self.delay())
+        if frozenset((sender, peer_id)) not in self.links or not self.reachable(sender, peer_id) \
+                or self.dropped():
+            raise ConnectionError(f"Failed to open a stream to {peer_id}")
+        remote = self.hosts[peer_id]
+        handler = remote.stream_handlers.get(protocols[0])
+        if handler is None:
+            raise ConnectionError(f"{peer_id} does not speak {protocols[0]}")
+        local_end = SimStream(self, self.hosts[sender])
+        remote_end = SimStream(self, remote)
+        local_end.remote, remote_end.remote = remote_end, local_end
+        self.hosts[sender].traffic.streams_opened += 1
+        remote.spawn(handler(remote_end))
+        return local_end
+
+
+class SimHost:
+    # The parts of a libp2p host that P2PNode uses
+    def __init__(self, network, index):
+        self.network = network
+        self.id = ID(b"\x00\x08" + index.to_bytes(8, "big"))  # identity multihash
+        self.peer_id = self.id.to_base58()
+        self.listen_addr = f"/ip4/10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}/tcp/4001"
+        self.addr = f"{self.listen_addr}/p2p/{self.peer_id}"
+        self.subscriptions = {}  # topic -> queue of GossipMessage
+        self.stream_handlers = {}
+        self.notifees = []
+        self.tasks = set()
+        self.traffic = Traffic()
+
+    def get_id(self):
+        return self.id
+
+    async def get_addrs(self):
+        return [self.addr]
+
+    def get_network(self):
+        return self
+
+    def get_peerstore(self):
+        return self.network
+
+    def register_notifee(self, notifee):
+        self.notifees.append(notifee)
+
+    async def notify(self, event, peer_id):
+        conn = SimpleNamespace(muxed_conn=SimpleNamespace(peer_id=peer_id))
+        for notifee in self.notifees:
+            await getattr(notifee, event)(self, conn)
+
+    def set_stream_handler(self, protocol, handler):
+        self.stream_handlers[protocol] = handler
+
+    async def connect(self, peer_info):
+        await self.network._link(self.peer_id, str(peer_info.peer_id))
+
+    async def new_stream(self, peer_id, protocols):
+        return await self.network.open_stream(self.peer_id, str(peer_id), protocols)
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class SimPubsub:
+    # The parts of GossipSub that P2PNode uses
+    def __init__(self, host):
+        self.host = host
+
+    async def subscribe(self, topic):
+        return self.host.subscriptions.setdefault(topic, asyncio.Queue())
+
+    async def unsubscribe(self, topic):
+        self.host.subscriptions.pop(topic, None)
+
+    @property
+    def peer_topics(self):
+        # topic -> ids of the reachable peers subscribed to it. GossipSub only
+        # knows this of the peers it is connected to; here every host can see
+        # every other, standing in for GossipSub's peer exchange.
+        network = self.host.network
+        topics = {}
+        for peer_id, host in network.hosts.items():
+            if peer_id != self.host.peer_id and network.reachable(self.host.peer_id, peer_id):
+                for topic in host.subscriptions:
+                    topics.setdefault(topic, set()).add(host.id)
+        return topics
+
+    async def publish(self, topic, data):
+        if self.host.peer_id not in self.host.network.down:
+            self.host.network.publish(self.host.peer_id, topic, data)
+
+
+class SimStream:
+    # One end of an in-memory stream; writes arrive at the other end in order,
+    # after the link's latency
+    def __init__(self, network, host):
+        self.network = network
+        self.host = host
+        self.remote = None
+        self.buffer = bytearray()
+        self.eof = False
+        self.readable = asyncio.Event()
+        self.arrival = 0.0  # when the last write sent reaches the other end
+
+    def _send(self, data):
+        loop = asyncio.get_running_loop()
+        self.arrival = max(self.arrival, loop.time() + self.network.delay())
+        loop.call_at(self.arrival, self.remote._receive, data)
+
+    def _receive(self, data):
+        if data is None:
+            self.eof = True
+        else:
+            self.buffer += data
+            self.host.traffic.sync_bytes_in += len(data)
+        self.readable.set()
+
+    async def write(self, data):
+        self.host.traffic.sync_bytes_out += len(data)
+        self._send(bytes(data))
+
+    async def read(self, n=-1):
+        while not self.buffer and not self.eof:
+            self.readable.clear()
+            await self.readable.wait()
+        size = len(self.buffer) if n is None or n < 0 else min(n, len(self.buffer))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def close(self):
+        self._send(None)
@@ -0,0 +1,277 @@
+"""Simulates a network of P2PNodes in one process to measure convergence.
+
+Every node is a real P2PNode with a MemoryStore, on a SimNetwork instead of
+libp2p, and all of them share one VirtualClockLoop: runs are reproducible for a
+seed, and simulated minutes take seconds. While messages are published, nodes
+may churn (go down and come back) and the network may be partitioned; once
+publishing is over and every disruption has healed, the simulation measures
+how long the nodes take to all hold every message, and what it cost them.
+
+Run from legacy/:
+  python -m src.sim.simulator [--nodes N] [--messages N] [--partition START:END:GROUPS] [--churn P]
+                              [--channels N --channels-per-node N] [--json PATH]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from src.core.channels import DEFAULT_CHANNEL
+from src.core.memory_store import MemoryStore
+from src.core.p2p import P2PNode
+from src.core.relay import RelayPolicy
+from src.sim.network import SimNetwork, SimPubsub, VirtualClockLoop
+
+logger = logging.getLogger(__name__)
+
+SIMULATION_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Simulation:
+    """One simulated run; all durations are in simulated seconds.
+
+    nodes dial degree random peers each. messages are published at an even
+    rate over duration, each by a random node that is up. partition is
+    (start, end, groups) or None. churn is the chance per second that a node
+    goes down, for an exponentially distributed time averaging downtime.
+    Nodes sync every sync_interval seconds, with an anti-entropy pass every
+    anti_entropy_every syncs (0 for none). node_options go to P2PNode.
+
+    With channels > 1, each node follows channels_per_node of them at random,
+    publishes into those, and prefers peers sharing one, as GossipSub peers
+    would be found per topic, and adds a sync peer per channel (see
+    P2PNode.discover_channel_peers); converged means every node holds every
+    message of its channels.
+    """
+
+    def __init__(self, nodes=50, degree=6, messages=1000, duration=300, latency=0.05, jitter=0.05, loss=0.0,
+                 churn=0.0, downtime=60, partition=None, sync_interval=30, anti_entropy_every=10,
+                 relay_gossip=False, relay_synced=False, max_time=3600, check_interval=1.0, seed=0,
+                 node_options=None, channels=1, channels_per_node=1):
+        self.n_nodes = nodes
+        self.degree = min(degree, nodes - 1)
+        self.n_messages = messages
+        self.duration = duration
+        self.churn = churn
+        self.downtime = downtime
+        self.partition = partition
+        self.sync_interval = sync_interval
+        self.anti_entropy_every = anti_entropy_every
+        self.relay_gossip = relay_gossip
+        self.relay_synced = relay_synced
+        self.max_time = max_time
+        self.check_interval = check_interval
+        self.rng = random.Random(seed)
+        self.network = SimNetwork(self.rng, latency, jitter, loss)
+        self.node_options = node_options or {}
+        self.channels = [DEFAULT_CHANNEL] if channels <= 1 else [f"channel-{i}" for i in range(channels)]
+        self.channels_per_node = max(1, min(channels_per_node, len(self.channels)))
+        self.nodes = []  # (host, node)
+        self.published = {}  # channel -> content hashes
+        self.pending_recoveries = 0
+
+    def run(self):
+        loop = VirtualClockLoop()
+        try:
+            return loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        wall_started = time.perf_counter()
+        for index in range(self.n_nodes):
+            host = self.network.add_host(index)
+            channels = self.rng.sample(self.channels, self.channels_per_node) if len(self.channels) > 1 \
+                else self.channels
+            node = P2PNode(store=MemoryStore(), relay_policy=RelayPolicy(self.relay_gossip, self.relay_synced),
+                           channels=channels, **self.node_options)
+            # Backoff runs on simulated time and the simulation's random numbers too
+            node.connections.clock = loop.time
+            node.connections.rng = self.rng.random
+            await node.start(host, SimPubsub(host))
+            self.nodes.append((host, node))
+        for host, node in self.nodes:
+            others = [peer_host for peer_host, _ in self.nodes if peer_host is not host]
+            sharing = [peer_host for peer_host, peer in self.nodes if peer_host is not host
+                       and set(peer.router.subscribed()) & set(node.router.subscribed())]
+            if len(sharing) >= self.degree:
+                others = sharing
+            for peer_host in self.rng.sample(others, self.degree):
+                node.connections.add(peer_host.addr, peer_host.peer_id)
+
+        tasks = [asyncio.ensure_future(self._sync_loop(host, node)) for host, node in self.nodes]
+        tasks.append(asyncio.ensure_future(self._churn()))
+        disruptions = [self._publish(), self._churn_until_done()]
+        if self.partition:
+            disruptions.append(self._partition(*self.partition))
+        try:
+            await asyncio.gather(*disruptions)
+            healed_at = loop.time()
+            coverage_at_heal = self._coverage()
+            converged_at = await self._wait_for_convergence(healed_at)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for _, node in self.nodes:
+                await node.stop()
+        return self._report(healed_at, coverage_at_heal, converged_at, time.perf_counter() - wall_started)
+
+    async def _publish(self):
+        loop = asyncio.get_running_loop()
+        interval = self.duration / max(1, self.n_messages)
+        for i in range(self.n_messages):
+            up = [entry for entry in self.nodes if entry[0].peer_id not in self.network.down]
+            if up:
+                _, node = self.rng.choice(up)
+                channels = node.router.subscribed()
+                channel = self.rng.choice(channels) if len(channels) > 1 else channels[0]
+                # Timestamps, and with them content hashes, on simulated time
+                timestamp = SIMULATION_EPOCH + timedelta(seconds=loop.time())
+                content_hash = node.enqueue_message(f"simulated message {i}", self.rng.randrange(1000), timestamp,
+                                                    channel)
+                self.published.setdefault(channel, set()).add(content_hash)
+            await asyncio.sleep(interval)
+
+    async def _sync_loop(self, host, node):
+        # Staggered, so nodes do not sync in lockstep
+        await asyncio.sleep(self.rng.random() * self.sync_interval)
+        rounds = 0
+        while True:
+            if host.peer_id not in self.network.down:
+                await node.discover_channel_peers()
+                await node.sync_messages()
+                rounds += 1
+                if self.anti_entropy_every and rounds % self.anti_entropy_every == 0:
+                    await node.anti_entropy()
+            await asyncio.sleep(self.sync_interval)
+
+    async def _churn(self):
+        loop = asyncio.get_running_loop()
+        while self.churn and loop.time() < self.duration:
+            for host, _ in self.nodes:
+                if host.peer_id not in self.network.down and self.rng.random() < self.churn:
+                    await self.network.set_down(host.peer_id)
+                    self.pending_recoveries += 1
+                    loop.call_later(self.rng.expovariate(1 / self.downtime), self._recover, host.peer_id)
+            await asyncio.sleep(1)
+
+    def _recover(self, peer_id):
+        asyncio.ensure_future(self.network.set_down(peer_id, False))
+        self.pending_recoveries -= 1
+
+    async def _churn_until_done(self):
+        await asyncio.sleep(self.duration)
+        while self.pending_recoveries:
+            await asyncio.sleep(self.check_interval)
+
+    async def _partition(self, start, end, groups):
+        await asyncio.sleep(start)
+        peer_ids = [host.peer_id for host, _ in self.nodes]
+        self.rng.shuffle(peer_ids)
+        await self.network.partition([peer_ids[i::groups] for i in range(groups)])
+        await asyncio.sleep(end - start)
+        self.network.heal()
+
+    def _expected(self, node):
+        # Content hashes of the messages in the node's channels
+        return set().union(*(self.published.get(channel, ()) for channel in node.router.subscribed()))
+
+    def _coverage(self):
+        # Fraction of (node, message of one of its channels) pairs held
+        expected = [(node, self._expected(node)) for _, node in self.nodes]
+        total = sum(len(hashes) for _, hashes in expected)
+        if not total:
+            return 1.0
+        return sum(len(node.store.by_hash.keys() & hashes) for node, hashes in expected) / total
+
+    async def _wait_for_convergence(self, healed_at):
+        loop = asyncio.get_running_loop()
+        while loop.time() - healed_at < self.max_time:
+            if all(len(node.store) == len(self._expected(node)) for _, node in self.nodes) \
+                    and self._coverage() == 1:
+                return loop.time()
+            await asyncio.sleep(self.check_interval)
+        return None
+
+    def _report(self, healed_at, coverage_at_heal, converged_at, wall_seconds):
+        per_node = {}
+        for host, node in self.nodes:
+            counters = node.counters.as_dict()
+            values = {**host.traffic.as_dict(), "db_writes": counters["db_writes"],
+                      "duplicates_dropped": counters["duplicates_dropped"]}
+            for name, value in values.items():
+                per_node.setdefault(name, []).append(value)
+        return {
+            "nodes": self.n_nodes,
+            "channels": len(self.channels),
+            "messages": sum(len(hashes) for hashes in self.published.values()),
+            "converged": converged_at is not None,
+            "time_to_convergence": converged_at - healed_at if converged_at is not None else None,
+            "healed_at": healed_at,
+            "coverage_at_heal": coverage_at_heal,
+            "simulated_seconds": (converged_at or healed_at + self.max_time),
+            "wall_seconds": wall_seconds,
+            "per_node": {name: {"mean": statistics.fmean(values), "max": max(values)}
+                         for name, values in per_node.items()},
+        }
+
+
+def parse_partition(value):
+    start, end, groups = value.split(":")
+    return float(start), float(end), int(groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--degree", type=int, default=6)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--churn", type=float, default=0.0, help="chance per node per second of going down")
+    parser.add_argument("--downtime", type=float, default=60, help="mean seconds down")
+    parser.add_argument("--partition", type=parse_partition, help="START:END:GROUPS, in seconds")
+    parser.add_argument("--sync-interval", type=float, default=30)
+    parser.add_argument("--anti-entropy-every", type=int, default=10)
+    parser.add_argument("--relay-gossip", action="store_true")
+    parser.add_argument("--relay-synced", action="store_true")
+    parser.add_argument("--max-time", type=float, default=3600)
+    parser.add_argument("--channels", type=int, default=1, help="channels messages are spread over")
+    parser.add_argument("--channels-per-node", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger("src").setLevel(logging.ERROR)
+    report = Simulation(args.nodes, args.degree, args.messages, args.duration, args.latency, args.jitter,
+                        args.loss, args.churn, args.downtime, args.partition, args.sync_interval,
+                        args.anti_entropy_every, args.relay_gossip, args.relay_synced, args.max_time,
+                        seed=args.seed, channels=args.channels,
+                        channels_per_node=args.channels_per_node).run()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"{report['nodes']} nodes, {report['channels']} channels, {report['messages']} messages, "
+          f"{report['coverage_at_heal']:.1%} delivered by the time disruptions healed")
+    if report["converged"]:
+        print(f"converged {report['time_to_convergence']:.1f}s after healing "
+              f"({report['wall_seconds']:.1f}s wall clock)")
+    else:
+        print(f"not converged within {args.max_time:.0f}s of healing")
+    print(f"{'per node':<20} {'mean':>12} {'max':>12}")
+    for name, values in report["per_node"].items():
+        print(f"{name:<20} {values['mean']:>12.1f} {values['max']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
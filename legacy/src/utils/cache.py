@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import msgpack
+
+try:
+    import redis
+except ImportError:  # the shared backend is optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live per entry.
+
+    Counts hits, misses, evictions (entries dropped for space) and expirations
+    (entries found past their TTL) so it can be sized from real traffic.
+    on_remove(key, value), if given, is called after an entry is evicted,
+    expires or is deleted, outside the cache's lock.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, clock=time.monotonic, on_remove=None):
+        self.max_size = max_size
+        self.ttl = ttl  # seconds, None to keep entries until evicted
+        self.clock = clock
+        self.on_remove = on_remove
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        expired = _MISSING
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] is not None and entry[0] <= self.clock():
+                expired = self.entries.pop(key)
+                self.expirations += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if expired is not _MISSING:
+            self._removed([(key, expired)])
+        return default if entry is _MISSING else entry[1]
+
+    def set(self, key, value, ttl=_MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        evicted = []
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl if ttl is not None else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                evicted.append(self.entries.popitem(last=False))
+                self.evictions += 1
+        self._removed(evicted)
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, _MISSING)
+        if entry is _MISSING:
+            return False
+        self._removed([(key, entry)])
+        return True
+
+    def _removed(self, items):
+        if self.on_remove is not None:
+            for key, (_, value) in items:
+                self.on_remove(key, value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class RedisCache:
+    """LRUCache's interface over Redis, for a cache shared by several processes.
+
+    Values are msgpack-encoded, so they are limited to plain data (timezone-aware
+    datetimes included). Memory is bounded by the server's maxmemory policy
+    (allkeys-lru) rather than max_size. Redis errors are logged and treated as
+    misses, so a cache outage only costs database reads.
+    """
+
+    def __init__(self, client, ttl=None, prefix="cosmicsynccore:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        if redis is None:
+            raise RuntimeError("A redis:// cache URL needs the redis package")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, key):
+        parts = key if isinstance(key, tuple) else (key,)
+        return self.prefix + ":".join(str(part) for part in parts)
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            return getattr(self.client, method)(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache {method} failed: {e}")
+            return None
+
+    def get(self, key, default=None):
+        data = self._call("get", self._key(key))
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return msgpack.unpackb(data, timestamp=3)
+
+    def set(self, key, value, ttl=_MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        self._call("set", self._key(key), msgpack.packb(value, datetime=True),
+                   px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key):
+        return bool(self._call("delete", self._key(key)))
+
+    def clear(self):
+        keys = list(self._call("scan_iter", match=self.prefix + "*") or ())
+        if keys:
+            self._call("delete", *keys)
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
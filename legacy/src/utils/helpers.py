@@ -0,0 +1,26 @@
+import json
+import zlib
+
+NDJSON_CHUNK_SIZE = 64 * 1024  # bytes per response chunk
+
+
+def ndjson_chunks(records, compress=False, chunk_size=NDJSON_CHUNK_SIZE):
+    # Encodes records as newline-delimited JSON and yields it in chunks of about
+    # chunk_size bytes; with compress, as one gzip stream flushed per chunk so the
+    # client can decode each chunk as it arrives.
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, separators=(",", ":"), default=str).encode() + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            data = b"".join(buffer)
+            yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+            buffer, size = [], 0
+    data = b"".join(buffer)
+    if compressor:
+        yield compressor.compress(data) + compressor.flush()
+    elif data:
+        yield data
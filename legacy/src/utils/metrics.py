@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# Prometheus metrics for the hot paths, served by GET /metrics (see endpoints.py).
+# Everything is registered in the default registry at import; gauges of live
+# state are bound to the running node by bind_node().
+
+# Buckets from 100us to 30s: DB commits and cache hits sit at the low end,
+# sync rounds at the high end
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30)
+
+PUBLISH_SECONDS = Histogram("cosmicsync_publish_seconds", "Storing and gossiping messages authored here",
+                            ["path"], buckets=LATENCY_BUCKETS)
+HANDLE_SECONDS = Histogram("cosmicsync_handle_seconds", "Handling one gossip payload", buckets=LATENCY_BUCKETS)
+SYNC_ROUND_SECONDS = Histogram("cosmicsync_sync_round_seconds", "Sync and anti-entropy rounds", ["kind"],
+                               buckets=LATENCY_BUCKETS)
+PEER_FETCH_SECONDS = Histogram("cosmicsync_peer_fetch_seconds", "Fetches from one peer within a round",
+                               ["outcome"], buckets=LATENCY_BUCKETS)
+DB_COMMIT_SECONDS = Histogram("cosmicsync_db_commit_seconds", "Database writes, through their commit",
+                              ["operation"], buckets=LATENCY_BUCKETS)
+RECOMMENDATION_SECONDS = Histogram("cosmicsync_recommendation_seconds", "Recommendation queries", ["mode"],
+                                   buckets=LATENCY_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram("cosmicsync_http_request_seconds", "API requests", ["method", "route", "status"],
+                                 buckets=LATENCY_BUCKETS)
+
+DEDUPE_HITS = Counter("cosmicsync_dedupe_hits", "Messages dropped as already seen", ["stage"])
+
+PEERS = Gauge("cosmicsync_peers", "Connected peers")
+CHANNELS = Gauge("cosmicsync_channels", "Channels subscribed to")
+QUEUE_DEPTH = Gauge("cosmicsync_queue_depth", "Items waiting in a P2P queue", ["queue"])
+EVENT_LOOP_LAG = Gauge("cosmicsync_event_loop_lag_seconds", "How late the event loop ran a timer, last check")
+
+
+def bind_node(node):
+    # Gauges read the node's state at scrape time
+    PEERS.set_function(lambda: len(node.connections.connected_peers()))
+    CHANNELS.set_function(lambda: len(node.router.holders))
+    QUEUE_DEPTH.labels("ingest").set_function(lambda: len(node.ingest_queue))
+    QUEUE_DEPTH.labels("outbox").set_function(lambda: len(node.outbox))
+
+
+async def monitor_event_loop(interval=0.5):
+    # Anything blocking the loop delays this wakeup by as long as it blocked
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - started - interval))
+
+
+class CacheCollector:
+    # Exposes the metrics() of an LRUCache or RedisCache as gauges labelled by cache name
+    def __init__(self):
+        self.caches = {}
+
+    def add(self, name, cache):
+        self.caches[name] = cache
+
+    def collect(self):
+        families = {}
+        for name, cache in self.caches.items():
+            for key, value in cache.metrics().items():
+                if key not in families:
+                    families[key] = GaugeMetricFamily(f"cosmicsync_cache_{key}", f"Cache {key}", labels=["cache"])
+                families[key].add_metric([name], value)
+        return list(families.values())
+
+
+caches = CacheCollector()
+REGISTRY.register(caches)
+
+
+class timed:
+    # Times a block into a histogram: with timed(DB_COMMIT_SECONDS, "add_user"): ...
+    # Works the same in coroutines, unlike Histogram.time() as a decorator.
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram.labels(*labels) if labels else histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
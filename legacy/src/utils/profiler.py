@@ -0,0 +1,58 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# Opt-in sampling profiler behind GET /debug/profile. While a profile runs, a
+# thread snapshots the stack of every other thread each interval; the result is
+# in collapsed-stack format ("outer;inner;leaf count" per line), which
+# flamegraph.pl and speedscope read. Sampling costs a few microseconds per
+# thread per sample, and nothing at all while no profile is running.
+#
+#   PROFILING_ENABLED     1 to serve /debug/profile (default off)
+#   PROFILE_INTERVAL      seconds between samples (default 0.005)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '') in ('1', 'true', 'yes')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+MAX_PROFILE_SECONDS = 60
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sample(seconds, interval=PROFILE_INTERVAL):
+    # Returns a Counter of collapsed stacks, sampled for seconds; one profile at a time
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        stacks = collections.Counter()
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    stacks[_collapse(frame)] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _running.release()
+
+
+def format_collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -6,3 +6,10 @@ def enable_tracemalloc():
     tracemalloc.start()
     yield
     tracemalloc.stop()
+
+@pytest.fixture(autouse=True)
+def clear_read_cache():
+    # Tests delete rows in bulk, which bypasses cache invalidation
+    from src.core.database import read_cache
+    read_cache.clear()
+    yield
@@ -0,0 +1,48 @@
+import numpy as np
+import scipy.sparse as sp
+from src.core.ann import IVFIndex, LSHIndex, project
+from src.core.ml import RecommendationSystem
+
+
+def make_profiles(count, topics=20):
+    rng = np.random.default_rng(0)
+    return {user_id: " ".join(f"t{topic}w{word}" for topic, word in
+                              zip(rng.choice(2, 8, p=[0.8, 0.2]) + user_id % topics, rng.integers(0, 12, 8)))
+            for user_id in range(count)}
+
+
+def test_project_preserves_cosine():
+    rng = np.random.default_rng(1)
+    indices = np.sort(rng.choice(200, (50, 20)), axis=1) * 5000
+    matrix = sp.csr_matrix((rng.random(1000), indices.ravel(), np.arange(0, 1001, 20)), shape=(50, 2 ** 20))
+    matrix = sp.csr_matrix(matrix / np.sqrt(matrix.multiply(matrix).sum(axis=1)))
+    reduced = project(matrix, 4096)
+    np.testing.assert_allclose(reduced @ reduced.T / 4096, (matrix @ matrix.T).toarray(), atol=0.1)
+
+
+def test_indexes_support_insert_and_delete():
+    for index in [LSHIndex(n_tables=4, n_bits=8), IVFIndex(n_lists=8, n_probe=2)]:
+        rec_system = RecommendationSystem(index=index)
+        rec_system.add_users_bulk(make_profiles(400))
+        assert len(index) == 400
+        # Identical interests always land in the same bucket
+        rec_system.add_user_interests(1000, rec_system.user_interests[7])
+        assert 1000 in index.candidates(rec_system.matrix.csr()[rec_system.matrix.rows[7]])
+
+        rec_system.remove_user(1000)
+        assert len(index) == 400
+        assert 1000 not in index.candidates(rec_system.matrix.csr()[rec_system.matrix.rows[7]])
+        assert 1000 not in rec_system.get_recommendations(7, top_n=50)
+
+
+def test_ivf_recall_against_exact_search():
+    rec_system = RecommendationSystem(index=IVFIndex(n_lists=16, n_probe=4))
+    rec_system.add_users_bulk(make_profiles(2000))
+
+    hits = total = 0
+    for user_id in range(0, 2000, 40):
+        exact = rec_system.get_recommendations(user_id, top_n=10, exact=True)
+        approximate = rec_system.get_recommendations(user_id, top_n=10)
+        hits += len(set(exact) & set(approximate))
+        total += len(exact)
+    assert hits / total > 0.8
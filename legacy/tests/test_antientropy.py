@@ -0,0 +1,139 @@
+import asyncio
+import pytest
+from src.core.antientropy import MAX_HASHES_PER_REQUEST, MerkleIndex, antientropy_handlers, reconcile
+from src.core.database import Message, compute_message_hash
+from src.core.memory_store import MemoryStore
+from src.core.sync_protocol import serve_sync_stream
+from tests.test_sync_protocol import stream_pair
+
+
+class HashStore:
+    # Minimal in-memory stand-in for the messages table
+    def __init__(self, messages):
+        self.messages = {}
+        self.index = MerkleIndex(depth=3)
+        for msg in messages:
+            self.add(msg)
+
+    def add(self, msg):
+        msg.content_hash = compute_message_hash(msg.content, msg.user_id, msg.timestamp)
+        self.messages[msg.content_hash] = msg
+        self.index.add(msg.content_hash)
+
+    async def hashes_with_prefix(self, prefix, channel=None):
+        return [h for h in self.messages if h.startswith(prefix)]
+
+    async def messages_by_hashes(self, hashes):
+        return [self.messages[h] for h in hashes if h in self.messages]
+
+    def handlers(self):
+        return antientropy_handlers({"global": self.index}, self.hashes_with_prefix, self.messages_by_hashes)
+
+
+def make_messages(start, stop):
+    return [Message(id=i, content=f"msg{i}", user_id=i % 7, timestamp=f"2021-01-01T00:00:{i % 60:02d}")
+            for i in range(start, stop)]
+
+
+def test_merkle_index_digest_is_order_independent():
+    hashes = [compute_message_hash(f"msg{i}", 1, "2021-01-01") for i in range(50)]
+    forward, backward = MerkleIndex(), MerkleIndex()
+    for h in hashes:
+        forward.add(h)
+    for h in reversed(hashes):
+        backward.add(h)
+
+    assert forward.digest("") == backward.digest("")
+    assert len(forward) == 50
+
+    backward.remove(hashes[0])
+    assert forward.digest("") != backward.digest("")
+    backward.add(hashes[0])
+    assert forward.digest("") == backward.digest("")
+
+
+@pytest.mark.asyncio
+async def test_reconcile_finds_only_missing_messages():
+    shared = make_messages(0, 2000)
+    local = HashStore(shared)
+    remote = HashStore(shared + make_messages(2000, 2005))
+
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, remote.handlers()))
+    stats = {}
+    pages = [page async for page in reconcile(client, local.index, local.hashes_with_prefix,
+                                               leaf_size=8, stats=stats)]
+    await client.close()
+    await server_task
+
+    received = sorted(msg.content for page in pages for msg in page)
+    assert received == [f"msg{i}" for i in range(2000, 2005)]
+    assert stats["missing"] == 5
+    # One round-trip per tree level, plus the hash and message fetches
+    assert stats["round_trips"] <= local.index.depth + 3
+
+
+@pytest.mark.asyncio
+async def test_reconcile_identical_stores_is_one_round_trip():
+    shared = make_messages(0, 500)
+    local, remote = HashStore(shared), HashStore(shared)
+
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, remote.handlers()))
+    stats = {}
+    pages = [page async for page in reconcile(client, local.index, local.hashes_with_prefix, stats=stats)]
+    await client.close()
+    await server_task
+
+    assert pages == []
+    assert stats["round_trips"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reconcile_channel_the_peer_does_not_serve():
+    local, remote = HashStore(make_messages(0, 10)), HashStore(make_messages(0, 50))
+
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, remote.handlers()))
+    pages = [page async for page in reconcile(client, MerkleIndex(depth=3), local.hashes_with_prefix,
+                                               channel="music")]
+    await client.close()
+    await server_task
+
+    assert pages == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_fresh_node_against_more_hashes_than_fit_in_a_frame():
+    # 70000 hashes are about 4.7MB of JSON, over MAX_FRAME_SIZE
+    remote = MemoryStore()
+    await remote.add_messages_bulk([{'content': f'msg{i}', 'user_id': 1, 'timestamp': '2021-01-01'}
+                                    for i in range(70000)])
+    remote_index = MerkleIndex()
+    await remote_index.refresh(remote.get_message_hashes_after)
+    handlers = antientropy_handlers({"global": remote_index}, remote.get_message_hashes_with_prefix,
+                                    remote.get_messages_by_hashes)
+
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, handlers))
+    stats = {}
+    pages = reconcile(client, MerkleIndex(), MemoryStore().get_message_hashes_with_prefix, stats=stats)
+    first_page = await anext(pages)  # all hashes are exchanged before the first page
+    await pages.aclose()
+    await client.close()
+    await server_task
+
+    assert stats["missing"] == 70000
+    assert len(first_page) == MAX_HASHES_PER_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_hashes_response_is_cut_to_fit_its_frame(monkeypatch):
+    monkeypatch.setattr("src.core.antientropy.MAX_HASHES_PER_RESPONSE", 3)
+    store = HashStore(make_messages(0, 50))
+    hashes = store.handlers()["hashes"]
+    prefixes = sorted({h[:1] for h in store.messages})
+
+    response = await hashes({"prefixes": prefixes})
+    # Only the first prefix fits, but it is always answered
+    assert list(response["hashes"]) == prefixes[:1]
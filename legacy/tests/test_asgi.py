@@ -0,0 +1,144 @@
+from unittest.mock import AsyncMock, Mock
+from starlette.testclient import TestClient
+from src.api.asgi import create_app
+from src.core.p2p import P2PNode
+from src.core.wire import decode_payload
+
+
+class LocalNode(P2PNode):
+    # No libp2p host: only the outbox runs
+    async def start(self):
+        self.pubsub = AsyncMock()
+        self.outbox.start()
+
+
+def make_node(**kwargs):
+    store = Mock()
+    store.insert_messages = AsyncMock(side_effect=lambda messages, chunk_size:
+                                      [(i, message.content_hash) for i, message in enumerate(messages)])
+    store.get_existing_user_ids = AsyncMock(side_effect=lambda user_ids: set(user_ids) & {1, 2})
+    return LocalNode(store=store, publish_flush_interval=0.01, **kwargs)
+
+
+def test_post_message_is_stored_and_published_on_the_node_loop():
+    node = make_node()
+    with TestClient(create_app(node, sync_interval=None)) as client:
+        responses = [client.post('/messages', json={'content': f'msg{i}', 'user_id': 1}) for i in range(3)]
+        assert [response.status_code for response in responses] == [202] * 3
+
+    # Shutdown drains the outbox
+    stored = [envelope for call in node.store.insert_messages.call_args_list for envelope in call.args[0]]
+    published = [envelope for call in node.pubsub.publish.call_args_list
+                 for envelope in decode_payload(call.args[1])]
+    assert [envelope.content_hash for envelope in stored] == \
+        [envelope.content_hash for envelope in published] == \
+        [response.json()['content_hash'] for response in responses]
+    assert node.counters.write_amplification == node.counters.publish_amplification == 1
+
+
+def test_post_message_when_outbox_is_full():
+    node = make_node(outbox_size=1)
+    node.start = AsyncMock()  # no outbox worker, so nothing drains
+    with TestClient(create_app(node, sync_interval=None)) as client:
+        assert client.post('/messages', json={'content': 'first', 'user_id': 1}).status_code == 202
+        response = client.post('/messages', json={'content': 'second', 'user_id': 1})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert client.post('/messages', json={'content': 'no user'}).status_code == 400
+
+
+def test_post_message_rejects_invalid_messages_before_enqueueing():
+    node = make_node()
+    with TestClient(create_app(node, sync_interval=None)) as client:
+        for body, error in [({'content': '', 'user_id': 1}, 'Invalid content'),
+                            ({'content': 'a', 'user_id': True}, 'Invalid user_id'),
+                            ({'content': 'a', 'user_id': 1, 'timestamp': 'soon'}, 'Invalid timestamp'),
+                            ({'content': 'a', 'user_id': 3}, 'Unknown user_id')]:
+            response = client.post('/messages', json=body)
+            assert response.status_code == 400
+            assert response.json()['message'] == error
+
+    node.store.insert_messages.assert_not_called()
+
+
+def test_other_routes_are_served_by_flask():
+    with TestClient(create_app(make_node(), sync_interval=None)) as client:
+        response = client.get('/messages?cursor=not-a-cursor')
+        assert response.status_code == 400
+        assert response.json()['error'] == 'Bad Request'
+
+
+def test_post_message_batch_reports_per_item_results():
+    node = make_node()
+    batch = [
+        {'content': 'first', 'user_id': 1},
+        {'content': '', 'user_id': 1},
+        {'content': 'relayed', 'user_id': 2, 'timestamp': '2021-01-01T00:00:00+00:00'},
+        {'content': 'no user'},
+        {'content': 'unknown user', 'user_id': 3},
+    ]
+    with TestClient(create_app(node, sync_interval=None)) as client:
+        response = client.post('/messages/batch', json=batch)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert (data['stored'], data['duplicate'], data['rejected'], data['failed']) == (2, 0, 3, 0)
+    assert [result['status'] for result in data['results']] == \
+        ['stored', 'rejected', 'stored', 'rejected', 'rejected']
+    assert data['results'][1]['error'] == 'Invalid content'
+    assert data['results'][4]['error'] == 'Unknown user_id'
+    # One transaction and one frame for the whole batch
+    node.store.insert_messages.assert_called_once()
+    node.pubsub.publish.assert_called_once()
+    published = list(decode_payload(node.pubsub.publish.call_args.args[1]))
+    assert [envelope.content_hash for envelope in published] == \
+        [data['results'][0]['content_hash'], data['results'][2]['content_hash']]
+    assert published[1].timestamp.isoformat() == '2021-01-01T00:00:00+00:00'
+
+
+def test_post_message_batch_reports_duplicates_and_failures_per_item():
+    node = make_node()
+
+    async def insert_messages(messages, chunk_size):
+        if len(messages) > 1:
+            raise ConnectionError("transaction failed")
+        if messages[0].content == 'bad':
+            raise ValueError("row rejected")
+        return [] if messages[0].content == 'stored before' else [(1, messages[0].content_hash)]
+
+    node.store.insert_messages = AsyncMock(side_effect=insert_messages)
+    batch = [{'content': content, 'user_id': 1} for content in ('new', 'stored before', 'bad')]
+    with TestClient(create_app(node, sync_interval=None)) as client:
+        response = client.post('/messages/batch', json=batch)
+        assert response.status_code == 200
+        data = response.json()
+        assert [result['status'] for result in data['results']] == ['stored', 'duplicate', 'failed']
+        assert (data['stored'], data['duplicate'], data['failed']) == (1, 1, 1)
+
+        # Only when nothing could be stored is the whole batch worth retrying
+        response = client.post('/messages/batch', json=[{'content': 'bad', 'user_id': 1}])
+        assert response.status_code == 503
+
+
+def test_post_message_batch_ndjson_and_limits():
+    with TestClient(create_app(make_node(), sync_interval=None)) as client:
+        body = '{"content": "a", "user_id": 1}\n\n{"content": "b", "user_id": 1}\n'
+        response = client.post('/messages/batch', content=body, headers={'Content-Type': 'application/x-ndjson'})
+        assert response.json()['stored'] == 2
+
+        assert client.post('/messages/batch', json={'content': 'a', 'user_id': 1}).status_code == 400
+        too_many = [{'content': 'a', 'user_id': 1}] * 501
+        assert client.post('/messages/batch', json=too_many).status_code == 413
+
+
+def test_messages_are_published_on_their_channel():
+    node = make_node()
+    with TestClient(create_app(node, sync_interval=None)) as client:
+        assert client.post('/messages', json={'content': 'a', 'user_id': 1, 'channel': 'Music'}).status_code == 202
+        assert client.post('/messages', json={'content': 'b', 'user_id': 1, 'channel': 'no such'}).status_code == 400
+        response = client.post('/messages/batch', json=[{'content': 'c', 'user_id': 1, 'channel': 'chess'},
+                                                         {'content': 'd', 'user_id': 1, 'channel': '#'}])
+        assert [result['status'] for result in response.json()['results']] == ['stored', 'rejected']
+
+    topics = sorted(call.args[0] for call in node.pubsub.publish.call_args_list)
+    assert topics == ['cosmicsynccore/chess', 'cosmicsynccore/music']
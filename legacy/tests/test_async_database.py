@@ -0,0 +1,70 @@
+import unittest
+from src.core import async_database
+from src.core.database import User, Message, SyncWatermark, engine, add_user, compute_message_hash, get_messages
+from sqlalchemy.orm import sessionmaker
+
+
+class TestAsyncDatabase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        User.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.user_id = add_user('asyncuser', 'async@example.com')
+
+    async def asyncTearDown(self):
+        await async_database.dispose_engine()
+
+    def tearDown(self):
+        self.session.query(SyncWatermark).delete()
+        self.session.query(Message).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+
+    async def test_add_messages_bulk_and_page_after(self):
+        messages = [{'content': f'msg{i}', 'user_id': self.user_id, 'timestamp': '2021-01-01T00:00:00+00:00'}
+                    for i in range(5)]
+        inserted_ids = await async_database.add_messages_bulk(messages, chunk_size=2)
+        self.assertEqual(len(inserted_ids), 5)
+        self.assertEqual(await async_database.add_messages_bulk(messages), [])
+
+        page = await async_database.get_messages_after(inserted_ids[1], limit=2)
+        self.assertEqual([msg.id for msg in page], sorted(inserted_ids)[2:4])
+
+        hashes = [row async for row in async_database.get_message_hashes_after(chunk_size=2)]
+        self.assertEqual(len(hashes), 5)
+        self.assertEqual(await async_database.get_existing_hashes([h for _, h in hashes[:2]] + ['0' * 64]),
+                         {h for _, h in hashes[:2]})
+        self.assertEqual(await async_database.get_existing_user_ids([self.user_id, self.user_id + 1]),
+                         {self.user_id})
+
+        inserted = await async_database.insert_messages(messages[:1] + [dict(messages[0], content='new')])
+        self.assertEqual([content_hash for _, content_hash in inserted],
+                         [compute_message_hash('new', self.user_id, '2021-01-01T00:00:00+00:00')])
+
+    async def test_channel_scoped_sync_queries(self):
+        messages = [{'content': f'msg{i}', 'user_id': self.user_id, 'timestamp': '2021-01-01T00:00:00+00:00',
+                     'channel': ('music', 'chess')[i % 2]} for i in range(4)]
+        inserted_ids = await async_database.add_messages_bulk(messages)
+
+        page = await async_database.get_messages_after(None, channel='music')
+        self.assertEqual([msg.id for msg in page], inserted_ids[0::2])
+        self.assertEqual({msg.channel for msg in page}, {'music'})
+        hashes = [row async for row in async_database.get_message_hashes_after(channel='chess')]
+        self.assertEqual([message_id for message_id, _ in hashes], inserted_ids[1::2])
+        self.assertEqual(set(await async_database.get_message_hashes_with_prefix('', channel='chess')),
+                         {content_hash for _, content_hash in hashes})
+
+    async def test_ingest_invalidates_cached_first_page(self):
+        self.assertEqual(get_messages(limit=5), [])
+        await async_database.add_messages_bulk([{'content': 'gossip', 'user_id': self.user_id}])
+        self.assertEqual([msg.content for msg in get_messages(limit=5)], ['gossip'])
+
+    async def test_sync_watermark_only_advances(self):
+        await async_database.set_sync_watermark('peer1', 10)
+        await async_database.set_sync_watermark('peer1', 5)
+        watermark = await async_database.get_sync_watermark('peer1')
+        self.assertEqual(watermark.message_id, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from src.core.builder import RecommendationBuilder, extract_interests
+from src.core.database import Message, Session, User, add_user, engine
+from src.core.snapshot import load_snapshot, read_manifest
+
+PROFILES = {
+    "ada": {"interests": ["machine learning", "data science"], "bio": "neural networks"},
+    "grace": {"interests": "compilers programming languages"},
+    "alan": {"skills": ["machine learning", "neural networks"]},
+    "linus": {"topics": ["programming languages", "operating systems"]},
+}
+
+
+@pytest.fixture
+def user_ids():
+    User.metadata.create_all(engine)
+    ids = {name: add_user(name, f"{name}@example.com", profile) for name, profile in PROFILES.items()}
+    yield ids
+    with Session() as session:
+        session.query(Message).delete()
+        session.query(User).delete()
+        session.commit()
+
+
+def test_extract_interests():
+    assert extract_interests({"interests": ["chess", " go "], "bio": "board games", "age": 30}) == \
+        "chess go board games"
+    assert extract_interests({"interests": [1, None]}) == ""
+    assert extract_interests(None) == ""
+
+
+def test_full_build_in_worker_processes(tmp_path, user_ids):
+    version = RecommendationBuilder(str(tmp_path), workers=2, chunk_size=2).build_full()
+
+    model = load_snapshot(str(tmp_path), version)
+    assert len(model.matrix) == len(PROFILES)
+    assert model.get_recommendations(user_ids["ada"], top_n=1) == [user_ids["alan"]]
+    assert model.get_recommendations(user_ids["grace"], top_n=1) == [user_ids["linus"]]
+    assert read_manifest(str(tmp_path))["metadata"]["watermark"][1] in user_ids.values()
+
+
+def test_catch_up_applies_updated_profiles(tmp_path, user_ids):
+    builder = RecommendationBuilder(str(tmp_path), workers=0)
+    builder.build_full()
+
+    with Session() as session:
+        session.get(User, user_ids["alan"]).profile = {"skills": ["operating systems", "compilers"]}
+        session.get(User, user_ids["linus"]).profile = {}
+        session.commit()
+    new_id = add_user("geoffrey", "geoffrey@example.com", {"interests": ["neural networks", "machine learning"]})
+
+    model = load_snapshot(str(tmp_path), builder.catch_up())
+    assert user_ids["linus"] not in model.matrix
+    assert model.get_recommendations(user_ids["ada"], top_n=1) == [new_id]
+    assert model.get_recommendations(user_ids["grace"], top_n=1) == [user_ids["alan"]]
+
+
+def test_idle_catch_up_publishes_nothing(tmp_path, user_ids):
+    builder = RecommendationBuilder(str(tmp_path), workers=0)
+    version = builder.build_full()
+
+    assert builder.catch_up() is None
+    assert builder.catch_up() is None
+    assert read_manifest(str(tmp_path))["version"] == version
+
+
+def test_catch_up_applies_late_commit_inside_overlap(tmp_path, user_ids):
+    builder = RecommendationBuilder(str(tmp_path), workers=0)
+    builder.build_full()
+    watermark = datetime.fromisoformat(read_manifest(str(tmp_path))["metadata"]["watermark"][0])
+
+    # A transaction that started before the build but committed after it
+    with Session() as session:
+        user = session.get(User, user_ids["alan"])
+        user.profile = {"skills": ["operating systems", "compilers"]}
+        session.flush()
+        user.updated_at = watermark - timedelta(seconds=10)
+        session.commit()
+
+    model = load_snapshot(str(tmp_path), builder.catch_up())
+    assert model.get_recommendations(user_ids["alan"], top_n=1) == [user_ids["linus"]]
+    assert builder.catch_up() is None
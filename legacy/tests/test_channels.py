@@ -0,0 +1,43 @@
+import pytest
+from src.core.channels import ChannelRouter, channels_from_profile, normalize_channel, sync_peer_for, topic_for
+
+
+def test_channel_names_and_topics():
+    assert normalize_channel(None) == 'global'
+    assert normalize_channel(' Music ') == 'music'
+    for name in ('', 'a b', '-music', 'x' * 65, 7):
+        with pytest.raises(ValueError):
+            normalize_channel(name)
+    # The default channel keeps the topic of nodes that predate channels
+    assert topic_for('global') == 'cosmicsynccore'
+    assert topic_for('music') == 'cosmicsynccore/music'
+
+
+def test_channels_from_profile():
+    profile = {'channels': ['Music', 'not a channel'], 'groups': 'chess-club', 'interests': ['ignored']}
+    assert channels_from_profile(profile) == {'music', 'chess-club'}
+    assert channels_from_profile(None) == set()
+
+
+def test_router_subscribes_while_anyone_follows_a_channel():
+    router = ChannelRouter()
+    assert router.subscribed() == ['global']
+
+    assert router.set_interests(1, ['music', 'chess']) == (['chess', 'music'], [])
+    assert router.set_interests(2, ['music']) == ([], [])
+    assert router.set_interests(1, ['chess']) == ([], [])
+    assert router.set_interests(2, []) == ([], ['music'])
+    assert router.subscribed() == ['chess', 'global']
+    assert 'music' not in router
+
+
+def test_sync_peers_form_a_ring_per_channel():
+    peers = [f'peer{i}' for i in range(6)]
+    for channel in ('music', 'chess'):
+        # Following each peer's pick from any start visits every subscriber
+        peer, visited = peers[0], set()
+        while peer not in visited:
+            visited.add(peer)
+            peer = sync_peer_for(channel, peer, [other for other in peers if other != peer])
+        assert visited == set(peers)
+    assert sync_peer_for('music', 'peer0', []) is None
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from src.core.connections import ConnectionManager
+
+
+def test_backoff_doubles_up_to_the_cap_with_jitter():
+    manager = ConnectionManager(None, base_backoff=1, max_backoff=8, jitter=0.5, rng=lambda: 1.0)
+    assert [manager._backoff(failures) for failures in range(6)] == [0.5, 1, 2, 4, 4, 4]
+    manager.rng = lambda: 0.0
+    assert manager._backoff(10) == 8
+
+
+@pytest.mark.asyncio
+async def test_dials_are_capped_and_failures_retried():
+    in_flight = 0
+    peak = 0
+    attempts = {}
+
+    async def dial(addr):
+        nonlocal in_flight, peak
+        attempts[addr] = attempts.get(addr, 0) + 1
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if addr == "flaky" and attempts[addr] < 3:
+            raise ConnectionError("refused")
+
+    manager = ConnectionManager(dial, max_dials=3, base_backoff=0.01, jitter=0)
+    for i in range(10):
+        manager.add(f"peer{i}")
+    manager.add("flaky")
+    manager.start()
+    await asyncio.sleep(0.3)
+    await manager.stop()
+
+    assert peak == 3
+    assert len(manager.connected_peers()) == 11
+    assert attempts["flaky"] == 3
+    assert manager.peers["flaky"].total_failures == 2
+    assert manager.peers["flaky"].failures == 0
+
+
+@pytest.mark.asyncio
+async def test_disconnect_event_schedules_redial():
+    dialed = []
+
+    async def dial(addr):
+        dialed.append(addr)
+
+    manager = ConnectionManager(dial, base_backoff=0.01, jitter=0)
+    assert await manager.connect("addr1", peer_id="id1")
+    manager.start()
+    manager.on_disconnected("id1")
+    assert manager.connected_peers() == []
+    await asyncio.sleep(0.05)
+    await manager.stop()
+
+    assert dialed == ["addr1", "addr1"]
+    assert manager.connected_peers() == ["addr1"]
+
+
+@pytest.mark.asyncio
+async def test_connected_peers_are_ordered_by_health():
+    async def dial(addr):
+        pass
+
+    manager = ConnectionManager(dial)
+    for addr in ["slow", "fast", "erroring"]:
+        await manager.connect(addr)
+    manager.record_rtt("slow", 0.5)
+    manager.record_rtt("fast", 0.01)
+    manager.record_rtt("erroring", 0.01)
+    for _ in range(3):
+        manager.record_error("erroring")
+
+    assert manager.connected_peers() == ["fast", "erroring", "slow"]
@@ -1,5 +1,6 @@
 import unittest
-from src.core.database import User, Session, engine
+from src.core.database import (User, Message, Session, engine, add_message, add_user, add_messages_bulk,
+                               get_messages, get_user, read_cache)
 from sqlalchemy.orm import sessionmaker
 
 class TestDatabase(unittest.TestCase):
@@ -34,5 +35,69 @@ class TestDatabase(unittest.TestCase):
             self.session.add(user2)
             self.session.commit()
 
+class TestBulkInsert(unittest.TestCase):
+    def setUp(self):
+        User.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.user_id = add_user('bulkuser', 'bulk@example.com')
+
+    def tearDown(self):
+        self.session.query(Message).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+
+    def test_add_messages_bulk_skips_duplicates(self):
+        messages = [{'content': f'msg{i}', 'user_id': self.user_id, 'timestamp': '2021-01-01T00:00:00+00:00'}
+                    for i in range(5)]
+        first_ids = add_messages_bulk(messages, chunk_size=2)
+        second_ids = add_messages_bulk(messages[3:] + [
+            {'content': 'msg5', 'user_id': self.user_id, 'timestamp': '2021-01-01T00:00:00+00:00'}
+        ])
+
+        self.assertEqual(len(first_ids), 5)
+        self.assertEqual(len(second_ids), 1)
+        self.assertEqual(self.session.query(Message).count(), 6)
+
+class TestReadCache(unittest.TestCase):
+    def setUp(self):
+        User.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.alice = add_user('alice', 'alice@example.com')
+        self.bob = add_user('bob', 'bob@example.com')
+
+    def tearDown(self):
+        self.session.query(Message).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        read_cache.clear()
+
+    def test_first_page_is_cached_until_a_write(self):
+        add_messages_bulk([{'content': f'msg{i}', 'user_id': self.alice if i % 2 else self.bob,
+                            'timestamp': f'2021-01-0{i + 1}T00:00:00+00:00'} for i in range(4)])
+        self.assertEqual([m.content for m in get_messages(limit=2)], ['msg3', 'msg2'])
+        self.assertEqual([m.content for m in get_messages(limit=10, user_id=self.alice)], ['msg3', 'msg1'])
+
+        # A bulk delete bypasses invalidation, so cached pages still show the rows
+        self.session.query(Message).filter(Message.content == 'msg3').delete()
+        self.session.commit()
+        self.assertEqual([m.content for m in get_messages(limit=2)], ['msg3', 'msg2'])
+
+        add_message('new', self.bob)
+        self.assertEqual([m.content for m in get_messages(limit=2)], ['new', 'msg2'])
+        # Only bob's page was dropped
+        self.assertEqual([m.content for m in get_messages(limit=10, user_id=self.alice)], ['msg3', 'msg1'])
+
+    def test_user_rows_are_written_through_and_dropped_on_update(self):
+        self.assertEqual(read_cache.get(('user', self.alice))['username'], 'alice')
+        user = self.session.get(User, self.alice)
+        user.username = 'alice2'
+        self.session.commit()
+
+        self.assertIsNone(read_cache.get(('user', self.alice)))
+        self.assertEqual(get_user(self.alice).username, 'alice2')
+        self.assertIsNone(get_user(-1))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,12 @@
 import unittest
+import gzip
 import json
+import tempfile
+from unittest.mock import patch
 from src.api.endpoints import app
-from src.core.database import User, Session, engine
+from src.core.ml import RecommendationSystem
+from src.core.snapshot import SnapshotReader, save_snapshot
+from src.core.database import User, Message, Session, engine, add_user, add_messages_bulk
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
@@ -11,6 +16,7 @@ class TestAPI(unittest.TestCase):
         self.session = Session()
 
     def tearDown(self):
+        self.session.query(Message).delete()
         self.session.query(User).delete()
         self.session.commit()
         self.session.close()
@@ -36,5 +42,64 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(data[0]['username'], 'testuser')
         self.assertEqual(data[0]['email'], 'test@example.com')
 
+    def test_get_messages_pages_with_cursor(self):
+        alice = add_user('alice', 'alice@example.com')
+        bob = add_user('bob', 'bob@example.com')
+        # Equal timestamps across users, so pages have to break ties on id
+        add_messages_bulk([{'content': f'msg{i}', 'user_id': alice if i % 2 else bob,
+                            'timestamp': f'2021-01-01T00:00:{i // 2:02d}+00:00'} for i in range(7)])
+
+        contents = []
+        cursor = ''
+        while cursor is not None:
+            data = json.loads(self.app.get(f'/messages?limit=3&cursor={cursor}').data)
+            self.assertLessEqual(len(data['messages']), 3)
+            contents.extend(msg['content'] for msg in data['messages'])
+            cursor = data['next_cursor']
+        self.assertEqual(sorted(contents), [f'msg{i}' for i in range(7)])
+        self.assertEqual(len(set(contents)), 7)
+        self.assertEqual(contents[0], 'msg6')
+
+        data = json.loads(self.app.get(f'/messages?user_id={alice}').data)
+        self.assertEqual([msg['content'] for msg in data['messages']], ['msg5', 'msg3', 'msg1'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_messages_rejects_invalid_cursor(self):
+        response = self.app.get('/messages?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_messages_streams_ndjson(self):
+        alice = add_user('alice', 'alice@example.com')
+        bob = add_user('bob', 'bob@example.com')
+        add_messages_bulk([{'content': f'msg{i}', 'user_id': alice if i % 2 else bob,
+                            'timestamp': f'2021-01-0{i + 1}T00:00:00+00:00'} for i in range(6)])
+
+        response = self.app.get(f'/messages/export?user_id={alice}&since=2021-01-03T00:00:00%2B00:00')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        records = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([record['content'] for record in records], ['msg3', 'msg5'])
+
+    def test_export_users_gzip(self):
+        for i in range(3):
+            add_user(f'user{i}', f'user{i}@example.com')
+
+        response = self.app.get('/users/export', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        records = [json.loads(line) for line in gzip.decompress(response.data).splitlines()]
+        self.assertEqual([record['username'] for record in records], ['user0', 'user1', 'user2'])
+
+    def test_recommendations_from_snapshot(self):
+        with tempfile.TemporaryDirectory() as root:
+            with patch('src.api.endpoints.recommendations', SnapshotReader(root, refresh_interval=0)):
+                self.assertEqual(self.app.get('/users/1/recommendations').status_code, 503)
+
+                rec_system = RecommendationSystem()
+                rec_system.add_users_bulk({1: 'machine learning', 2: 'machine learning python', 3: 'gardening'})
+                save_snapshot(rec_system, root)
+                response = self.app.get('/users/1/recommendations?top_n=1')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.data)['recommendations'], [2])
+
 if __name__ == '__main__':
     unittest.main()
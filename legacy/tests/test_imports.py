@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+
+LEGACY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start of the server entry point, in seconds; it took over 3 with
+# scikit-learn, libp2p and the schema check loaded on import, and under 1 without
+IMPORT_BUDGET = 2.5
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def import_in_subprocess(module, heavy=('sklearn', 'libp2p', 'multiaddr')):
+    # A fresh interpreter, pointed at a database that refuses connections:
+    # importing must not need one
+    env = dict(os.environ, DB_HOST='127.0.0.1', DB_PORT='1', PROFILING_ENABLED='')
+    env.pop('CACHE_URL', None)
+    result = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module, heavy=heavy)],
+                            cwd=LEGACY_ROOT, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_run_imports_fast_without_database():
+    report = import_in_subprocess('run')
+    assert report['loaded'] == []
+    assert report['seconds'] < IMPORT_BUDGET
+
+
+def test_core_modules_import_without_side_effects():
+    for module in ('src.core.database', 'src.core.async_database', 'src.core.ml', 'src.core.p2p',
+                   'src.core.builder'):
+        assert import_in_subprocess(module)['loaded'] == []
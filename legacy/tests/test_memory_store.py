@@ -0,0 +1,58 @@
+import pytest
+from unittest.mock import MagicMock
+from src.core.database import Message, compute_message_hash
+from src.core.memory_store import MemoryStore
+from src.core.p2p import P2PNode
+
+
+@pytest.mark.asyncio
+async def test_inserts_skip_stored_hashes():
+    store = MemoryStore()
+    first = await store.add_message('msg1', 1, timestamp='2021-01-01')
+    assert await store.add_messages_bulk([{'content': 'msg1', 'user_id': 1, 'timestamp': '2021-01-01'},
+                                          {'content': 'msg2', 'user_id': 2, 'timestamp': '2021-01-02'}]) == [2]
+    assert first == 1 and len(store) == 2
+
+    content_hash = compute_message_hash('msg2', 2, '2021-01-02')
+    assert await store.get_existing_hashes([content_hash, 'f' * 64]) == {content_hash}
+    assert await store.insert_messages([{'content': 'msg2', 'user_id': 2, 'timestamp': '2021-01-02'},
+                                        {'content': 'msg3', 'user_id': 2, 'timestamp': '2021-01-03'}]) == \
+        [(3, compute_message_hash('msg3', 2, '2021-01-03'))]
+    assert await store.get_message_hashes_with_prefix(content_hash[:3]) == [content_hash]
+    assert [message.id for message in await store.get_messages_after(1)] == [2, 3]
+    assert [row async for row in store.get_message_hashes_after(1)][0] == (2, content_hash)
+
+
+@pytest.mark.asyncio
+async def test_channel_scoped_queries():
+    store = MemoryStore()
+    await store.add_messages_bulk([{'content': f'msg{i}', 'user_id': 1, 'timestamp': '2021-01-01',
+                                    'channel': ('music', 'chess')[i % 2]} for i in range(6)])
+
+    assert [message.id for message in await store.get_messages_after(2, channel='music')] == [3, 5]
+    assert [message_id async for message_id, _ in store.get_message_hashes_after(channel='chess')] == [2, 4, 6]
+    music = {message.content_hash for message in store.by_channel['music']}
+    assert set(await store.get_message_hashes_with_prefix('', channel='music')) == music
+
+
+@pytest.mark.asyncio
+async def test_sync_messages_into_memory_store():
+    store = MemoryStore()
+    await store.add_message('msg3', 3, timestamp='2021-01-03')
+    node = P2PNode(store=store)
+    node.get_connected_peers = MagicMock(return_value=['peer1', 'peer2'])
+
+    async def fetch_messages_from_peer(peer, limit):
+        if peer == 'peer1':
+            return [Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01'),
+                    Message(id=2, content='msg2', user_id=2, timestamp='2021-01-02')]
+        return [Message(id=7, content='msg2', user_id=2, timestamp='2021-01-02'),
+                Message(id=8, content='msg3', user_id=3, timestamp='2021-01-03')]
+
+    node.fetch_messages_from_peer = fetch_messages_from_peer
+
+    assert await node.sync_messages() == 2
+    assert sorted(message.content for message in store.messages) == ['msg1', 'msg2', 'msg3']
+    assert (await store.get_sync_watermark('peer2')).message_id == 8
+    await store.set_sync_watermark('peer2', 5)
+    assert (await store.get_sync_watermark('peer2')).message_id == 8
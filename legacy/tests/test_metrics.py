@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, Mock
+import pytest
+from prometheus_client import REGISTRY
+from src.api.endpoints import app
+from src.core.database import compute_message_hash
+from src.core.p2p import P2PNode
+from src.core.wire import Envelope, encode_envelope
+from src.utils import metrics, profiler
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_endpoint():
+    client = app.test_client()
+    before = sample('cosmicsync_http_request_seconds_count', method='GET', route='/messages', status='400')
+    assert client.get('/messages?cursor=not-a-cursor').status_code == 400
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    for name in ['cosmicsync_publish_seconds', 'cosmicsync_db_commit_seconds', 'cosmicsync_event_loop_lag_seconds',
+                 'cosmicsync_cache_hits{cache="read"}', 'cosmicsync_cache_hits{cache="recommendations"}']:
+        assert name in body
+    assert sample('cosmicsync_http_request_seconds_count', method='GET', route='/messages', status='400') == \
+        before + 1
+
+
+@pytest.mark.asyncio
+async def test_handle_message_records_latency_and_dedupe_hits():
+    node = P2PNode()
+    node.pubsub = AsyncMock()
+    timestamp = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    payload = encode_envelope(Envelope(compute_message_hash("Hello", 1, timestamp), "Hello", 1, timestamp, 0))
+    handled = sample('cosmicsync_handle_seconds_count')
+    dedupe_hits = sample('cosmicsync_dedupe_hits_total', stage='seen_cache')
+
+    await node.handle_message(Mock(data=payload))
+    await node.handle_message(Mock(data=payload))
+
+    assert sample('cosmicsync_handle_seconds_count') == handled + 2
+    assert sample('cosmicsync_dedupe_hits_total', stage='seen_cache') == dedupe_hits + 1
+
+
+@pytest.mark.asyncio
+async def test_event_loop_lag():
+    monitor = asyncio.create_task(metrics.monitor_event_loop(0.05))
+    await asyncio.sleep(0)
+    time.sleep(0.1)  # blocks the loop
+    await asyncio.sleep(0.01)
+    monitor.cancel()
+    assert sample('cosmicsync_event_loop_lag_seconds') >= 0.04
+
+
+def spin(stop):
+    while not stop.is_set():
+        pass
+
+
+def test_profiler_samples_other_threads():
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,))
+    thread.start()
+    try:
+        stacks = profiler.sample(0.1, interval=0.001)
+    finally:
+        stop.set()
+        thread.join()
+
+    spinning = [stack for stack in stacks if ';spin (test_metrics.py:' in stack]
+    assert spinning and 'test_profiler_samples_other_threads' not in profiler.format_collapsed(stacks)
+
+
+def test_profile_endpoint_is_opt_in(monkeypatch):
+    client = app.test_client()
+    assert client.get('/debug/profile?seconds=0.01').status_code == 404
+    monkeypatch.setattr(profiler, 'PROFILING_ENABLED', True)
+    assert client.get('/debug/profile?seconds=0.01').status_code == 200
+    assert client.get('/debug/profile?seconds=600').status_code == 400
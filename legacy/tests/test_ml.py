@@ -0,0 +1,141 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from src.core.ml import RecommendationCache, RecommendationSystem
+from src.utils.cache import LRUCache
+
+INTERESTS = {
+    1: "machine learning artificial intelligence data science",
+    2: "web development javascript python react",
+    3: "artificial intelligence neural networks deep learning",
+    4: "python data science pandas",
+    5: "react frontend design javascript",
+}
+
+
+def test_vectors_match_tfidf_after_refresh():
+    rec_system = RecommendationSystem()
+    for user_id, interests in INTERESTS.items():
+        rec_system.add_user_interests(user_id, interests)
+    rec_system.refresh_idf()
+
+    tfidf = TfidfVectorizer().fit_transform(list(INTERESTS.values()))
+    matrix = rec_system.matrix.csr()
+    np.testing.assert_allclose((matrix @ matrix.T).toarray(), (tfidf @ tfidf.T).toarray(), atol=1e-9)
+
+
+def test_add_users_bulk_matches_incremental():
+    incremental = RecommendationSystem()
+    for user_id, interests in INTERESTS.items():
+        incremental.add_user_interests(user_id, interests)
+    incremental.refresh_idf()
+    bulk = RecommendationSystem()
+    bulk.add_users_bulk(INTERESTS)
+
+    np.testing.assert_array_equal(bulk.document_frequency, incremental.document_frequency)
+    assert bulk.get_recommendations(1, top_n=4) == incremental.get_recommendations(1, top_n=4)
+    assert bulk.get_recommendations(1, top_n=1) == [3]
+
+
+def test_updating_interests_replaces_document_frequency():
+    rec_system = RecommendationSystem()
+    rec_system.add_users_bulk(INTERESTS)
+    rec_system.add_user_interests(1, "javascript react")
+
+    fresh = RecommendationSystem()
+    fresh.add_users_bulk({**INTERESTS, 1: "javascript react"})
+    np.testing.assert_array_equal(rec_system.document_frequency, fresh.document_frequency)
+    assert rec_system.n_documents == len(INTERESTS)
+    assert rec_system.get_recommendations(1, top_n=2) == [5, 2]
+
+
+def test_idf_refresh_is_amortized():
+    rec_system = RecommendationSystem(idf_refresh_ratio=0.5)
+    rec_system.add_users_bulk({i: f"topic{i % 10} shared" for i in range(100)})
+    rec_system.add_user_interests(100, "topic1 shared")
+    # Not yet stale: the new user is weighted with the current IDF, others untouched
+    assert rec_system.idf_documents == 100
+    rec_system.add_users_bulk({i: "topic2" for i in range(101, 160)})
+    assert rec_system.idf_documents == 160
+
+
+def test_get_recommendations_many_matches_single_queries():
+    rec_system = RecommendationSystem()
+    rec_system.add_users_bulk({i: f"topic{i % 7} topic{i % 5} common" for i in range(200)})
+    rec_system.add_user_interests(3, "topic1 topic2")
+    rec_system.remove_user(10)
+
+    user_ids = list(range(0, 200, 9)) + [10, 999]
+    results = rec_system.get_recommendations_many(user_ids, top_n=4, batch_size=5)
+
+    assert results == {user_id: rec_system.get_recommendations(user_id, top_n=4) for user_id in user_ids}
+    assert results[10] == [] and results[999] == []
+    assert all(10 not in recommended and user_id not in recommended
+               for user_id, recommended in results.items())
+    # Users sharing both topics with 0 rank first
+    assert set(results[0][:4]) <= {35, 70, 105, 140, 175}
+
+
+def test_compaction_keeps_recommendations():
+    rec_system = RecommendationSystem()
+    rec_system.add_users_bulk(INTERESTS)
+    before = rec_system.get_recommendations_many(INTERESTS, top_n=1)
+    for _ in range(4):
+        for user_id, interests in INTERESTS.items():
+            rec_system.add_user_interests(user_id, interests)
+
+    assert rec_system.matrix.n_rows <= 2 * len(INTERESTS) + 1
+    assert rec_system.get_recommendations_many(INTERESTS, top_n=1) == before
+
+
+def test_recommendation_cache_hits_and_invalidation():
+    cache = RecommendationCache(max_size=3)
+    rec_system = RecommendationSystem(cache=cache)
+    rec_system.add_users_bulk(INTERESTS)
+
+    first = rec_system.get_recommendations(1, top_n=2)
+    assert rec_system.get_recommendations(1, top_n=2) == first
+    assert rec_system.get_recommendations_many([1, 2], top_n=2)[1] == first
+    assert (cache.entries.hits, cache.entries.misses) == (2, 2)
+
+    # 3 was recommended to 1, so changing 3 invalidates 1's entry but not 2's
+    rec_system.add_user_interests(3, "javascript react frontend")
+    assert rec_system.get_recommendations(1, top_n=2) != first
+    rec_system.get_recommendations(2, top_n=2)
+    assert (cache.entries.hits, cache.entries.misses) == (3, 3)
+
+    for user_id in (3, 4, 5):
+        rec_system.get_recommendations(user_id, top_n=2)
+    metrics = cache.metrics()
+    assert metrics["evictions"] >= 2 and metrics["size"] == 3 and metrics["invalidations"] == 2
+
+
+def test_recommendation_cache_stays_bounded():
+    now = [0]
+    cache = RecommendationCache(max_size=2, ttl=10, clock=lambda: now[0])
+    for user_id in range(5):
+        key, _ = cache.lookup(1, user_id, 2)
+        cache.put(key, [user_id + 10, user_id + 20])
+    # Dependencies of evicted entries are dropped with them
+    assert set(cache.dependents) == {13, 23, 14, 24}
+
+    cache.invalidate_user(13)
+    assert set(cache.generations) == {3, 13} and set(cache.dependents) == {23, 14, 24}
+    now[0] = 10
+    cache.invalidate_user(1)
+    assert set(cache.generations) == {1}
+
+    # Results computed across an invalidation are not stored
+    key, _ = cache.lookup(1, 1, 2)
+    cache.invalidate_user(1)
+    cache.put(key, [2])
+    assert cache.lookup(1, 1, 2)[1] is None
+
+
+def test_lru_cache_ttl():
+    now = [0]
+    cache = LRUCache(max_size=10, ttl=5, clock=lambda: now[0])
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now[0] = 6
+    assert cache.get("a") is None
+    assert cache.metrics()["expirations"] == 1
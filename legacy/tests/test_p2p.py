@@ -2,6 +2,12 @@ import pytest
 import asyncio
 from unittest.mock import Mock, patch, AsyncMock
 from src.core.p2p import P2PNode
+from src.core.sync_protocol import SYNC_PROTOCOL_ID
+from src.core.wire import Envelope, decode_envelope, decode_payload, encode_envelope
+from src.core.database import compute_message_hash
+from src.core.memory_store import MemoryStore, StoredMessage
+from src.core.relay import RelayPolicy
+from datetime import datetime, timezone
 from libp2p.network.exceptions import SwarmException
 import logging
 
@@ -16,7 +22,7 @@ async def test_init():
     assert node.host is None
     assert node.pubsub is None
     assert node.peers == set()
-    assert node.retry_interval == 5
+    assert node.get_connected_peers() == []
 
 @pytest.mark.asyncio
 @patch('src.core.p2p.new_host')
@@ -25,6 +31,8 @@ async def test_init():
 async def test_start(mock_create_task, mock_gossipsub, mock_new_host):
     node = P2PNode()
     mock_host = AsyncMock()
+    mock_host.set_stream_handler = Mock()
+    mock_host.get_network = Mock()
     mock_new_host.return_value = mock_host
     mock_pubsub = AsyncMock()
     mock_gossipsub.return_value = mock_pubsub
@@ -47,16 +55,17 @@ async def test_start(mock_create_task, mock_gossipsub, mock_new_host):
     mock_new_host.assert_called_once()
     mock_gossipsub.assert_called_once_with(mock_host)
     mock_pubsub.subscribe.assert_called_once_with("cosmicsynccore")
+    mock_host.set_stream_handler.assert_called_once_with(SYNC_PROTOCOL_ID, node.handle_sync_stream)
     assert node.host == mock_host
     assert node.pubsub == mock_pubsub
-    mock_create_task.assert_called_once()
-
-    # Ensure the maintain_connections task was created
-    assert node.maintain_task is not None
-    assert asyncio.iscoroutine(node.maintain_task)
+    # The dial scheduler, the ingest and outbox workers, the gossip reader and the loop monitor
+    assert mock_create_task.call_count == 5
+    # Connection state follows libp2p's events
+    mock_host.get_network.return_value.register_notifee.assert_called_once()
+    assert node.connections.task is not None
 
 @pytest.mark.asyncio
-@patch('src.core.p2p.add_message')
+@patch('src.core.async_database.add_message', new_callable=AsyncMock)
 async def test_publish_message(mock_add_message):
     node = P2PNode()
     node.pubsub = AsyncMock()
@@ -65,11 +74,19 @@ async def test_publish_message(mock_add_message):
 
     await node.publish_message(message, user_id)
 
-    node.pubsub.publish.assert_called_once_with("cosmicsynccore", message.encode())
-    mock_add_message.assert_called_once_with(message, user_id)
+    node.pubsub.publish.assert_called_once()
+    topic, payload = node.pubsub.publish.call_args[0]
+    envelope = decode_envelope(payload)
+    assert topic == "cosmicsynccore"
+    assert (envelope.content, envelope.user_id, envelope.hops) == (message, user_id, 0)
+    mock_add_message.assert_called_once_with(message, user_id, timestamp=envelope.timestamp, channel="global")
+    assert node.counters.write_amplification == 1
+    assert node.counters.publish_amplification == 1
 
 @pytest.mark.asyncio
 async def test_handle_message(caplog):
+    # Per-message logging is at debug level, off the hot path by default
+    caplog.set_level(logging.DEBUG, logger='src.core.p2p')
     node = P2PNode()
     message = Mock()
     message.data = b"Test message"
@@ -78,20 +95,30 @@ async def test_handle_message(caplog):
     assert "Received message: Test message" in caplog.text
 
 @pytest.mark.asyncio
-@patch('src.core.p2p.get_recent_messages')
-async def test_sync_messages(mock_get_recent_messages):
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
     node = P2PNode()
-    mock_get_recent_messages.return_value = [
-        Mock(content="Message 1", user_id=1),
-        Mock(content="Message 2", user_id=2)
-    ]
+    node.get_connected_peers = Mock(return_value=['peer1'])
+    node.fetch_messages_from_peer = AsyncMock(return_value=[
+        Mock(id=1, content="Message 1", user_id=1, timestamp='2021-01-01', channel='global'),
+        Mock(id=2, content="Message 2", user_id=2, timestamp='2021-01-02', channel='global')
+    ])
+    mock_get_existing_hashes.return_value = set()
     node.publish_message = AsyncMock()
 
+    mock_add_messages_bulk.side_effect = lambda messages, chunk_size: [msg.id for msg in messages]
+    node.pubsub = AsyncMock()
+
     await node.sync_messages()
 
-    assert node.publish_message.call_count == 2
-    node.publish_message.assert_any_call("Message 1", 1)
-    node.publish_message.assert_any_call("Message 2", 2)
+    # Synced messages are written once and not re-published
+    mock_add_messages_bulk.assert_called_once()
+    node.publish_message.assert_not_called()
+    node.pubsub.publish.assert_not_called()
+    assert node.counters.messages_ingested == 2
+    assert node.counters.write_amplification == 1
 
 @pytest.mark.asyncio
 @patch('src.core.p2p.info_from_p2p_addr')
@@ -124,13 +151,102 @@ async def test_connect_to_peer_failure(mock_info_from_p2p_addr, caplog):
 async def test_stop():
     node = P2PNode()
     node.host = AsyncMock()
-    
-    # Create a real coroutine for maintain_task
-    async def mock_maintain_task():
-        pass
-    node.maintain_task = asyncio.create_task(mock_maintain_task())
+    scheduler = node.connections.start()
 
     await node.stop()
 
-    assert node.maintain_task.cancelled()
+    assert scheduler.cancelled()
     node.host.close.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+async def test_handle_message_persists_gossip_once(mock_get_existing_hashes, mock_add_messages_bulk):
+    node = P2PNode(ingest_flush_interval=0.01)
+    mock_get_existing_hashes.return_value = set()
+    mock_add_messages_bulk.side_effect = lambda messages, chunk_size: list(range(len(messages)))
+    timestamp = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    content_hash = compute_message_hash("Hello", 1, timestamp)
+    payload = encode_envelope(Envelope(content_hash, "Hello", 1, timestamp, 0))
+
+    node.ingest_queue.start()
+    await node.handle_message(Mock(data=payload))
+    await node.handle_message(Mock(data=payload))
+    await asyncio.sleep(0.05)
+    await node.ingest_queue.stop()
+
+    mock_add_messages_bulk.assert_called_once()
+    stored = mock_add_messages_bulk.call_args[0][0]
+    assert [envelope.content_hash for envelope in stored] == [content_hash]
+    assert node.counters.messages_ingested == 1
+    assert node.counters.duplicates_dropped == 1
+    assert content_hash in node.seen_filter
+
+@pytest.mark.asyncio
+async def test_handle_message_drops_mismatched_hash():
+    node = P2PNode()
+    timestamp = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    payload = encode_envelope(Envelope("0" * 64, "Hello", 1, timestamp, 0))
+
+    await node.handle_message(Mock(data=payload))
+
+    assert len(node.ingest_queue) == 0
+
+@pytest.mark.asyncio
+async def test_set_interests_joins_and_leaves_topics():
+    node = P2PNode(channels=['music'])
+    node.pubsub = AsyncMock()
+    node.pubsub.subscribe.return_value = asyncio.Queue()
+
+    assert await node.set_interests(7, ['chess', 'music']) == (['chess'], [])
+    node.pubsub.subscribe.assert_called_once_with("cosmicsynccore/chess")
+    assert await node.set_interests(7, []) == ([], ['chess'])
+    node.pubsub.unsubscribe.assert_called_once_with("cosmicsynccore/chess")
+    assert set(node.merkle_indexes) == {'music'} and node.subscriptions == {}
+
+@pytest.mark.asyncio
+async def test_messages_are_published_and_accepted_per_channel():
+    store = Mock()
+    store.insert_messages = AsyncMock(side_effect=lambda messages, chunk_size:
+                                      [(i, message.content_hash) for i, message in enumerate(messages)])
+    node = P2PNode(store=store, channels=['music'])
+    node.pubsub = AsyncMock()
+
+    await node.publish_messages([("a", 1, None, 'music'), ("b", 1, None, 'chess'), ("c", 1, None, 'music')])
+    topics = {call.args[0]: [e.content for e in decode_payload(call.args[1])]
+              for call in node.pubsub.publish.call_args_list}
+    assert topics == {"cosmicsynccore/music": ["a", "c"], "cosmicsynccore/chess": ["b"]}
+
+    timestamp = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    for channel in ('global', 'music'):
+        envelope = Envelope(compute_message_hash(channel, 1, timestamp), channel, 1, timestamp, 0, channel)
+        await node.handle_message(Mock(data=encode_envelope(envelope)))
+    # Only the subscribed channel's message is ingested
+    assert len(node.ingest_queue) == 1
+    assert node.ingest_queue.queue.get_nowait().channel == 'music'
+
+@pytest.mark.asyncio
+async def test_synced_messages_are_relayed_on_their_channel():
+    node = P2PNode(store=MemoryStore(), relay_policy=RelayPolicy(relay_synced=True), channels=['music', 'chess'])
+    node.pubsub = AsyncMock()
+    timestamp = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    messages = [StoredMessage(i, channel, 1, timestamp, compute_message_hash(channel, 1, timestamp), channel)
+                for i, channel in enumerate(['music', 'chess'], 1)]
+
+    await node._store_new_messages(messages)
+    relayed = {call.args[0]: decode_envelope(call.args[1]).channel for call in node.pubsub.publish.call_args_list}
+    assert relayed == {"cosmicsynccore/music": "music", "cosmicsynccore/chess": "chess"}
+
+
+@pytest.mark.asyncio
+async def test_rows_skipped_as_stored_count_as_writes():
+    node = P2PNode(store=MemoryStore())
+    node.pubsub = AsyncMock()
+    messages = [("a", 1, datetime(2021, 1, 1, tzinfo=timezone.utc), 'global'),
+                ("b", 1, datetime(2021, 1, 2, tzinfo=timezone.utc), 'global')]
+
+    assert [status for _, status in await node.publish_messages(messages)] == ["stored", "stored"]
+    assert node.counters.write_amplification == 1
+    assert [status for _, status in await node.publish_messages(messages)] == ["duplicate", "duplicate"]
+    assert (node.counters.db_writes, node.counters.messages_originated) == (4, 2)
+    assert node.counters.write_amplification == 2
@@ -0,0 +1,57 @@
+import time
+from unittest.mock import patch
+from src.core.relay import IngestCounters, RelayPolicy, SeenCache
+from src.core.wire import Envelope
+
+
+def make_envelope(content_hash='abc', hops=0):
+    return Envelope(content_hash, 'content', 1, None, hops)
+
+
+def test_seen_cache_expires_entries():
+    cache = SeenCache(ttl=10)
+    with patch('src.core.relay.time.monotonic', return_value=100.0):
+        assert cache.add('abc')
+        assert not cache.add('abc')
+    with patch('src.core.relay.time.monotonic', return_value=111.0):
+        assert 'abc' not in cache
+        assert cache.add('abc')
+
+
+def test_seen_cache_is_bounded():
+    cache = SeenCache(ttl=60, max_size=3)
+    for i in range(5):
+        cache.add(str(i))
+    assert len(cache) == 3
+    assert '0' not in cache
+    assert '4' in cache
+
+
+def test_relay_policy_does_not_relay_by_default():
+    policy = RelayPolicy()
+    assert not policy.should_relay(make_envelope(), 'gossip')
+    assert not policy.should_relay(make_envelope('def'), 'sync')
+
+
+def test_relay_policy_relays_within_hop_limit():
+    policy = RelayPolicy(relay_gossip=True, max_hops=2)
+    assert policy.mark_seen('abc')
+    assert not policy.mark_seen('abc')
+    assert policy.should_relay(make_envelope('abc', hops=1), 'gossip')
+    assert not policy.should_relay(make_envelope('def', hops=2), 'gossip')
+    assert not policy.should_relay(make_envelope('abc', hops=1), 'sync')
+    assert not policy.should_relay(make_envelope(None), 'gossip')
+
+
+def test_ingest_counters_amplification():
+    counters = IngestCounters()
+    counters.messages_originated = 2
+    counters.messages_ingested = 3
+    counters.db_writes = 5
+    counters.publishes = 2
+    assert counters.write_amplification == 1
+    assert counters.publish_amplification == 1
+    assert counters.as_dict()['db_writes'] == 5
+    # A row retried, or skipped as already stored, is written without being stored
+    counters.db_writes = 6
+    assert counters.write_amplification == 1.2
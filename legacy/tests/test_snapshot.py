@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from src.core.ann import IVFIndex
+from src.core.ml import RecommendationSystem
+from src.core.snapshot import (SnapshotError, SnapshotReader, current_version, list_versions,
+                               load_snapshot, save_snapshot)
+
+INTERESTS = {
+    1: "machine learning artificial intelligence data science",
+    2: "web development javascript python react",
+    3: "artificial intelligence neural networks deep learning",
+    4: "python data science pandas",
+    5: "react frontend design javascript",
+}
+
+
+def make_system():
+    rec_system = RecommendationSystem()
+    rec_system.add_users_bulk(INTERESTS)
+    rec_system.remove_user(4)
+    rec_system.add_user_interests(6, "deep learning python")
+    return rec_system
+
+
+def test_snapshot_round_trip(tmp_path):
+    rec_system = make_system()
+    version = save_snapshot(rec_system, str(tmp_path))
+
+    loaded = load_snapshot(str(tmp_path))
+    assert loaded.version == version == current_version(str(tmp_path))
+    assert isinstance(loaded.matrix.data, np.memmap)
+    assert loaded.get_recommendations_many([1, 2, 3, 5, 6], top_n=3) == \
+        rec_system.get_recommendations_many([1, 2, 3, 5, 6], top_n=3)
+
+
+def test_loaded_snapshot_is_copy_on_write(tmp_path):
+    save_snapshot(make_system(), str(tmp_path))
+    loaded = load_snapshot(str(tmp_path))
+    loaded.remove_user(1)
+    loaded.add_user_interests(7, "neural networks")
+    loaded.refresh_idf()
+
+    again = load_snapshot(str(tmp_path))
+    assert 1 in again.matrix and 7 not in again.matrix
+    assert loaded.get_recommendations(3, top_n=1) == [7]
+
+
+def test_string_user_ids_and_index(tmp_path):
+    rec_system = RecommendationSystem()
+    rec_system.add_users_bulk({f"user-{user_id}": interests for user_id, interests in INTERESTS.items()})
+    save_snapshot(rec_system, str(tmp_path))
+
+    loaded = load_snapshot(str(tmp_path), index=IVFIndex(n_lists=2, n_probe=2))
+    assert len(loaded.index) == len(INTERESTS)
+    assert loaded.get_recommendations("user-1", top_n=1) == ["user-3"]
+
+
+def test_reader_swaps_to_new_snapshots_and_old_ones_are_pruned(tmp_path):
+    root = str(tmp_path)
+    reader = SnapshotReader(root)
+    assert reader.refresh() is False
+
+    rec_system = make_system()
+    first = save_snapshot(rec_system, root, keep=2)
+    assert reader.refresh() is True
+    model = reader.model
+    assert reader.refresh() is False
+
+    rec_system.add_user_interests(8, "javascript react")
+    save_snapshot(rec_system, root, keep=2)
+    save_snapshot(rec_system, root, keep=2)
+    assert reader.refresh() is True
+    assert reader.model is not model and 8 in reader.model.matrix
+    assert first not in list_versions(root) and len(list_versions(root)) == 2
+    assert not [name for name in os.listdir(root) if name.startswith(".tmp")]
+
+
+def test_missing_snapshot(tmp_path):
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(tmp_path))
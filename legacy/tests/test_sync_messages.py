@@ -1,13 +1,19 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 from src.core.p2p import P2PNode
-from src.core.database import Message
+from src.core.database import Message, compute_message_hash
+
+def insert_all(messages, chunk_size=500):
+    return [msg.id for msg in messages]
 
 @pytest.mark.asyncio
-@patch('src.core.p2p.get_recent_messages')
-@patch('src.core.p2p.add_message')
-async def test_sync_messages_successful(mock_add_message, mock_get_recent_messages):
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_successful(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
     node = P2PNode()
+    mock_add_messages_bulk.side_effect = insert_all
     node.get_connected_peers = MagicMock(return_value=['peer1', 'peer2'])
     
     # Create a side_effect that returns different messages for each peer
@@ -26,51 +32,248 @@ async def test_sync_messages_successful(mock_add_message, mock_get_recent_messag
     node.fetch_messages_from_peer = AsyncMock(side_effect=fetch_messages_side_effect)
     node.publish_message = AsyncMock()
 
-    mock_get_recent_messages.return_value = [
-        Message(id=3, content='msg3', user_id=3, timestamp='2021-01-03')
-    ]
+    mock_get_existing_hashes.return_value = {compute_message_hash('msg3', 3, '2021-01-03')}
 
     result = await node.sync_messages()
     print(f"Result from sync_messages: {result}")
 
     assert result == 2  # We expect 2 new messages (id 1 and 2)
-    assert mock_add_message.call_count == 2
-    assert node.publish_message.call_count == 2
+    mock_add_messages_bulk.assert_called_once()
+    assert [msg.id for msg in mock_add_messages_bulk.call_args[0][0]] == [1, 2]
+    assert node.publish_message.call_count == 0
+    mock_set_sync_watermark.assert_any_call('peer1', 2, '2021-01-02')
+    mock_set_sync_watermark.assert_any_call('peer2', 3, '2021-01-03')
 
 @pytest.mark.asyncio
-@patch('src.core.p2p.get_recent_messages')
-@patch('src.core.p2p.add_message')
-async def test_sync_messages_no_new_messages(mock_add_message, mock_get_recent_messages):
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_no_new_messages(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
     node = P2PNode()
+    mock_add_messages_bulk.side_effect = insert_all
     node.get_connected_peers = MagicMock(return_value=['peer1'])
     node.fetch_messages_from_peer = AsyncMock(return_value=[
         Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01')
     ])
     node.publish_message = AsyncMock()
 
-    mock_get_recent_messages.return_value = [
-        Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01')
-    ]
+    mock_get_existing_hashes.return_value = {compute_message_hash('msg1', 1, '2021-01-01')}
 
     result = await node.sync_messages()
 
     assert result == 0
-    assert mock_add_message.call_count == 0
+    assert [msg for call in mock_add_messages_bulk.call_args_list for msg in call[0][0]] == []
     assert node.publish_message.call_count == 0
+    mock_set_sync_watermark.assert_called_once_with('peer1', 1, '2021-01-01')
 
 @pytest.mark.asyncio
-@patch('src.core.p2p.get_recent_messages')
-@patch('src.core.p2p.add_message')
-async def test_sync_messages_error_handling(mock_add_message, mock_get_recent_messages):
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_error_handling(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
     node = P2PNode()
+    mock_add_messages_bulk.side_effect = insert_all
     node.get_connected_peers = MagicMock(return_value=['peer1'])
     node.fetch_messages_from_peer = AsyncMock(side_effect=Exception('Fetch error'))
     node.publish_message = AsyncMock()
 
-    mock_get_recent_messages.return_value = []
+    mock_get_existing_hashes.return_value = set()
 
     result = await node.sync_messages()
 
     assert result == 0
-    assert mock_add_message.call_count == 0
+    assert [msg for call in mock_add_messages_bulk.call_args_list for msg in call[0][0]] == []
     assert node.publish_message.call_count == 0
+    mock_set_sync_watermark.assert_not_called()
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_fetches_peers_concurrently(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
+    node = P2PNode(sync_concurrency=2)
+    mock_add_messages_bulk.side_effect = insert_all
+    node.get_connected_peers = MagicMock(return_value=['peer1', 'peer2', 'peer3', 'peer4'])
+    node.publish_message = AsyncMock()
+    mock_get_existing_hashes.return_value = set()
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fetch_messages_side_effect(peer, limit):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return [Message(id=int(peer[-1]), content=peer, user_id=1, timestamp='2021-01-01')]
+
+    node.fetch_messages_from_peer = AsyncMock(side_effect=fetch_messages_side_effect)
+
+    result = await node.sync_messages()
+
+    assert result == 4
+    assert max_in_flight == 2
+    assert node.last_sync_report['succeeded'] == 4
+    assert all(stats['fetches'] == 1 for stats in node.get_peer_stats().values())
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_slow_peer_times_out(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
+    node = P2PNode(peer_timeout=0.05)
+    mock_add_messages_bulk.side_effect = insert_all
+    node.get_connected_peers = MagicMock(return_value=['fast', 'slow'])
+    node.publish_message = AsyncMock()
+    mock_get_existing_hashes.return_value = set()
+
+    async def fetch_messages_side_effect(peer, limit):
+        if peer == 'slow':
+            await asyncio.sleep(10)
+        return [Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01')]
+
+    node.fetch_messages_from_peer = AsyncMock(side_effect=fetch_messages_side_effect)
+
+    result = await node.sync_messages()
+
+    assert result == 1
+    stats = node.get_peer_stats()
+    assert stats['fast']['failures'] == 0
+    assert stats['slow']['failures'] == 1
+    assert stats['slow']['last_error'] == 'timeout'
+    assert node.last_sync_report['timed_out'] == 1
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_round_deadline(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
+    node = P2PNode(peer_timeout=10, sync_deadline=0.05)
+    mock_add_messages_bulk.side_effect = insert_all
+    node.get_connected_peers = MagicMock(return_value=['fast', 'slow'])
+    node.publish_message = AsyncMock()
+    mock_get_existing_hashes.return_value = set()
+
+    async def fetch_messages_side_effect(peer, limit):
+        if peer == 'slow':
+            await asyncio.sleep(10)
+        return [Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01')]
+
+    node.fetch_messages_from_peer = AsyncMock(side_effect=fetch_messages_side_effect)
+
+    result = await node.sync_messages()
+
+    assert result == 1
+    assert node.get_peer_stats()['slow']['last_error'] == 'sync deadline exceeded'
+    assert node.last_sync_report['timed_out'] == 1
+
+@pytest.mark.asyncio
+@patch('src.core.p2p.info_from_p2p_addr')
+@patch('src.core.async_database.get_sync_watermark', new_callable=AsyncMock)
+async def test_fetch_messages_from_peer_resumes_from_watermark(mock_get_sync_watermark, mock_info_from_p2p_addr):
+    node = P2PNode()
+    node.host = AsyncMock()
+    stream = AsyncMock()
+    node.host.new_stream.return_value = stream
+    mock_get_sync_watermark.return_value = MagicMock(message_id=41)
+    mock_info_from_p2p_addr.return_value = MagicMock(peer_id='peer-id')
+    requested = []
+
+    async def request_messages_side_effect(stream, after_id, page_size, max_pages, channel):
+        requested.append((after_id, page_size, channel))
+        yield [Message(id=42, content='msg42', user_id=1, timestamp='2021-01-01')]
+        yield [Message(id=43, content='msg43', user_id=1, timestamp='2021-01-02')]
+
+    with patch('src.core.p2p.request_messages', request_messages_side_effect):
+        messages = await node.fetch_messages_from_peer(
+            '/ip4/127.0.0.1/tcp/8000/p2p/QmYyQSo1c1Ym7orWxLYvCrM2EmxFTANf8wXmmE7DWjhx5N', 2)
+
+    assert requested == [(41, 2, 'global')]
+    assert [msg.id for msg in messages] == [42, 43]
+    node.host.new_stream.assert_called_once()
+    stream.close.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_writes_in_chunks(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
+    node = P2PNode(write_chunk_size=3)
+    mock_add_messages_bulk.side_effect = insert_all
+    node.get_connected_peers = MagicMock(return_value=['peer1', 'peer2'])
+    node.publish_message = AsyncMock()
+    mock_get_existing_hashes.return_value = set()
+
+    async def fetch_messages_side_effect(peer, limit):
+        offset = 0 if peer == 'peer1' else 2
+        return [Message(id=i, content=f'msg{i}', user_id=1, timestamp='2021-01-01')
+                for i in range(offset, offset + 4)]
+
+    node.fetch_messages_from_peer = AsyncMock(side_effect=fetch_messages_side_effect)
+
+    result = await node.sync_messages()
+
+    # Six distinct messages across both peers, flushed once per peer result
+    assert result == 6
+    assert mock_add_messages_bulk.call_count == 2
+    assert sum(len(call[0][0]) for call in mock_add_messages_bulk.call_args_list) == 6
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_drops_message_by_unknown_author(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
+    from sqlalchemy.exc import IntegrityError
+
+    def insert_known_authors(messages, chunk_size=500):
+        if any(msg.user_id == 99 for msg in messages):
+            raise IntegrityError('INSERT INTO messages', {}, Exception('violates foreign key constraint'))
+        return [msg.id for msg in messages]
+
+    node = P2PNode()
+    mock_add_messages_bulk.side_effect = insert_known_authors
+    node.get_connected_peers = MagicMock(return_value=['peer1'])
+    node.fetch_messages_from_peer = AsyncMock(return_value=[
+        Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01'),
+        Message(id=2, content='msg2', user_id=99, timestamp='2021-01-02'),
+        Message(id=3, content='msg3', user_id=3, timestamp='2021-01-03'),
+    ])
+    mock_get_existing_hashes.return_value = set()
+
+    result = await node.sync_messages()
+
+    assert result == 2
+    assert node.counters.messages_ingested == 2
+    assert node.counters.messages_rejected == 1
+    assert node.counters.duplicates_dropped == 0
+    mock_set_sync_watermark.assert_called_once_with('peer1', 3, '2021-01-03')
+
+@pytest.mark.asyncio
+@patch('src.core.async_database.set_sync_watermark', new_callable=AsyncMock)
+@patch('src.core.async_database.get_existing_hashes', new_callable=AsyncMock)
+@patch('src.core.async_database.add_messages_bulk', new_callable=AsyncMock)
+async def test_sync_messages_cancels_outstanding_fetches_when_a_write_fails(mock_add_messages_bulk, mock_get_existing_hashes, mock_set_sync_watermark):
+    node = P2PNode(write_chunk_size=1)
+    mock_add_messages_bulk.side_effect = ConnectionError('database went away')
+    node.get_connected_peers = MagicMock(return_value=['fast', 'slow'])
+    mock_get_existing_hashes.return_value = set()
+    slow_cancelled = asyncio.Event()
+
+    async def fetch_messages_side_effect(peer, limit):
+        if peer == 'slow':
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                slow_cancelled.set()
+                raise
+        return [Message(id=1, content='msg1', user_id=1, timestamp='2021-01-01')]
+
+    node.fetch_messages_from_peer = AsyncMock(side_effect=fetch_messages_side_effect)
+
+    result = await node.sync_messages()
+
+    assert result == 0
+    assert slow_cancelled.is_set()
+    assert node.last_sync_report['timed_out'] == 1
+    mock_set_sync_watermark.assert_not_called()
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from src.core.database import Message
+from src.core.sync_protocol import (request_messages, serve_sync_stream, write_frame, read_frame,
+                                    messages_after_handler, SyncProtocolError)
+
+
+class PipeStream:
+    # One end of an in-memory bidirectional byte stream
+    def __init__(self, inbox, outbox):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.buffer = b""
+        self.closed = False
+
+    async def read(self, n):
+        if not self.buffer:
+            self.buffer = await self.inbox.get()
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    async def write(self, data):
+        await self.outbox.put(data)
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await self.outbox.put(b"")
+
+
+def stream_pair():
+    a_to_b, b_to_a = asyncio.Queue(), asyncio.Queue()
+    return PipeStream(b_to_a, a_to_b), PipeStream(a_to_b, b_to_a)
+
+
+def make_store(count, channels=("global",)):
+    messages = [Message(id=i, content=f"msg{i}", user_id=1, timestamp=f"2021-01-{i:02d}",
+                        channel=channels[i % len(channels)])
+                for i in range(1, count + 1)]
+
+    async def get_messages_after(after_id, limit, channel=None):
+        return [msg for msg in messages if (after_id is None or msg.id > after_id)
+                and channel in (None, msg.channel)][:limit]
+    return {"messages_after": messages_after_handler(get_messages_after)}
+
+
+@pytest.mark.asyncio
+async def test_request_messages_pages_after_watermark():
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, make_store(7)))
+
+    pages = [page async for page in request_messages(client, 2, 2, max_pages=10)]
+    await client.close()
+    await server_task
+
+    assert [[msg.id for msg in page] for page in pages] == [[3, 4], [5, 6], [7]]
+    assert pages[0][0].content == "msg3"
+
+
+@pytest.mark.asyncio
+async def test_request_messages_respects_max_pages():
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, make_store(10)))
+
+    pages = [page async for page in request_messages(client, None, 3, max_pages=2)]
+    await client.close()
+    await server_task
+
+    assert [msg.id for page in pages for msg in page] == [1, 2, 3, 4, 5, 6]
+
+
+@pytest.mark.asyncio
+async def test_request_messages_pages_through_one_channel():
+    client, server = stream_pair()
+    server_task = asyncio.create_task(serve_sync_stream(server, make_store(9, channels=("global", "music", "chess"))))
+
+    pages = [page async for page in request_messages(client, 2, 2, max_pages=10, channel="music")]
+    await client.close()
+    await server_task
+
+    assert [[msg.id for msg in page] for page in pages] == [[4, 7]]
+    assert {msg.channel for page in pages for msg in page} == {"music"}
+
+
+@pytest.mark.asyncio
+async def test_request_messages_surfaces_peer_errors():
+    client, server = stream_pair()
+
+    async def fake_peer():
+        await read_frame(server)
+        await write_frame(server, {"error": "boom"})
+
+    peer_task = asyncio.create_task(fake_peer())
+    with pytest.raises(SyncProtocolError):
+        async for _ in request_messages(client, None, 10, max_pages=1):
+            pass
+    await peer_task
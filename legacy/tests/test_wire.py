@@ -0,0 +1,80 @@
+import msgpack
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+from src.core.database import compute_message_hash
+from src.core.wire import (MAGIC, WIRE_VERSION, Envelope, WireFormatError, _HEADER, _pack, decode_envelope,
+                           decode_payload, encode_batch, encode_batches, encode_envelope)
+
+
+def make_envelope(i=0, content=None):
+    timestamp = datetime(2021, 1, 1, 12, 0, i, 123456, tzinfo=timezone.utc)
+    content = content if content is not None else f"message {i}"
+    return Envelope(compute_message_hash(content, 7, timestamp), content, 7, timestamp, 1)
+
+
+def test_envelope_round_trip_keeps_hash_valid():
+    envelope = make_envelope()
+    decoded = decode_envelope(encode_envelope(envelope))
+
+    assert decoded == envelope
+    assert compute_message_hash(decoded.content, decoded.user_id, decoded.timestamp) == decoded.content_hash
+
+
+def test_binary_envelope_is_smaller_than_hex_metadata():
+    envelope = make_envelope()
+    # 3-byte header + 32-byte hash + content + a few bytes of ints
+    assert len(encode_envelope(envelope)) < len(envelope.content) + 64
+
+
+def test_large_payloads_are_compressed():
+    envelope = make_envelope(content="spam " * 1000)
+    payload = encode_envelope(envelope)
+
+    assert len(payload) < 1000
+    assert decode_envelope(payload) == envelope
+    assert len(encode_envelope(envelope, compress=False)) > 5000
+
+
+def test_batch_round_trip():
+    envelopes = [make_envelope(i) for i in range(50)]
+    assert decode_payload(encode_batch(envelopes)) == envelopes
+
+
+def test_encode_batches_splits_by_size():
+    envelopes = [make_envelope(i, content="x" * 100) for i in range(50)]
+    frames = list(encode_batches(envelopes, compress=False, max_bytes=1000))
+
+    assert len(frames) > 1
+    assert all(len(frame) <= 1000 + 200 for frame in frames)
+    assert [e for frame in frames for e in decode_payload(frame)] == envelopes
+
+
+def test_plain_text_payloads_still_decode():
+    envelope = decode_envelope("hello".encode())
+    assert envelope.content == "hello"
+    assert envelope.content_hash is None
+
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(WireFormatError):
+        decode_payload(b"\xff\x09\x00")
+
+
+def test_compressed_frame_without_zstandard_is_rejected():
+    payload = encode_envelope(make_envelope(content="spam " * 1000))
+    with patch('src.core.wire.zstandard', None):
+        with pytest.raises(WireFormatError):
+            decode_payload(payload)
+
+
+def test_channel_round_trip_and_five_field_envelopes():
+    envelope = make_envelope()._replace(channel="music")
+    assert decode_envelope(encode_envelope(envelope)).channel == "music"
+
+    # As sent by nodes that predate channels
+    legacy = msgpack.packb(_pack(envelope)[:5], use_bin_type=True)
+    assert decode_envelope(_HEADER.pack(MAGIC, WIRE_VERSION, 0) + legacy).channel == "global"
+    invalid = msgpack.packb(_pack(envelope)[:5] + ["not a channel"], use_bin_type=True)
+    with pytest.raises(WireFormatError):
+        decode_envelope(_HEADER.pack(MAGIC, WIRE_VERSION, 0) + invalid)